@@ -293,6 +293,9 @@ def init(force_reload: bool = False, **kwargs) -> None:
     if appconfig.app.get("settings", {}).get("debug", False):
         appconfig.log.root.level = appconfig.log.loggers.gramex.level = logging.DEBUG
 
+    # app.listen.processes: N forks N worker processes. Fork before services start threads
+    services.fork(appconfig.app)
+
     # Set up a watch on config files (including imported files)
     if appconfig.app.get("watch", True):
         from services import watcher
@@ -347,7 +350,7 @@ def gramex_update(url: str):
         return app_log.error("eventlog: service is not running. So Gramex update is disabled")
 
     query = services.info.eventlog.query
-    update = query('SELECT * FROM events WHERE event="update" ORDER BY time DESC LIMIT 1')
+    update = query("SELECT * FROM events WHERE event='update' ORDER BY time DESC LIMIT 1")
     delay = 24 * 60 * 60  # Wait for one day before updates
     if update and time.time() < update[0]["time"] + delay:
         return app_log.debug("Gramex update ran recently. Deferring check.")
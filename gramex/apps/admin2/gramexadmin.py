@@ -289,7 +289,10 @@ def schedule(handler, service):
         # If ?mock is set, and it's an alert, capture the alert mails in result
         if handler.get_argument('mock', False) and service == 'alert':
             kwargs = {'callback': lambda **kwargs: results.append(kwargs)}
-        if schedule.thread:
+        if schedule.process and kwargs:
+            # The mock callback can't be sent to another process. Run the task in this process
+            args = yield gramex.service.threadpool.submit(schedule.target, **kwargs)
+        elif schedule.thread or schedule.process:
             args = yield schedule.function(**kwargs)
         else:
             args = yield gramex.service.threadpool.submit(schedule.function, **kwargs)
@@ -2,11 +2,13 @@
 
 import atexit
 import contextlib
-import copy
+import hashlib
+import heapq
 import inspect
 import io
 import json
 import mimetypes
+import numpy as np
 import os
 import pandas as pd
 import re
@@ -17,16 +19,17 @@ import sqlalchemy as sa
 import subprocess  # noqa B404
 import sys
 import tempfile
+import threading
 import time
 import tornado.ioloop
 import tornado.template
-from gramex.config import PathConfig
+from gramex.config import PathConfig, variables
 from gramex.config import app_log, merge, used_kwargs, CustomJSONDecoder, CustomJSONEncoder
 from orderedattrdict import AttrDict
 from queue import Queue
 from threading import Thread
 from tornado.concurrent import Future
-from types import ModuleType
+from types import CodeType, ModuleType
 from typing import Optional, Any, List, Tuple, Union, Dict, Callable, BinaryIO
 from typing_extensions import Literal
 from urllib.parse import urlparse
@@ -55,6 +58,7 @@ _markdown_defaults = {
 # A set of temporary files to delete on program exit
 _TEMP_FILES = set()
 _ID_CACHE = set()
+_O_BINARY = getattr(os, 'O_BINARY', 0)  # Windows needs this for binary os.open()
 # In read_excel, we use range= as a parameter. Store the built-in range() to reference it
 builtin_range = range
 
@@ -73,6 +77,7 @@ def open(
     callback: Optional[Union[str, Callable]] = None,
     transform: Optional[Callable] = None,
     rel: bool = False,
+    snapshot: Union[bool, str] = False,
     **kwargs,
 ) -> Any:
     '''Reads a file, processes it via a callback, caches the result and returns it.
@@ -92,6 +97,8 @@ def open(
         callback: type of file, e.g. `csv`, `json`, or callback function
         transform: function to transform the data before caching
         rel: if True, path is relative to the calling file. Default: False
+        snapshot: if True, save DataFrames as an Arrow snapshot under `$GRAMEXDATA/cache/snapshot/`
+            (or under the folder specified, if it's a string). Default: False
         **kwargs: passed to the callback function
 
     `callback=` accepts these predefined types:
@@ -154,6 +161,24 @@ def open(
 
     All `kwargs` are passed directly to the callback. If the callback is a predefined string
     using `io.open()`, all `io.open()` arguments are passed to `io.open()`, rest to the callback.
+
+    To process large files in chunks, pass `chunksize=` or `iterator=True` to callbacks that
+    support it (e.g. `csv`, `table`, `jsondata` with `lines=True`, `sas`, `stata`, `hdf`).
+    These return an iterator that can only be consumed once, so it is NOT cached.
+
+    Examples:
+        >>> for chunk in gramex.cache.open('large.csv', 'csv', chunksize=100000):
+        ...     process(chunk)
+
+    `snapshot=True` saves the result (after `transform=`) as an uncompressed Arrow/Feather file,
+    keyed by the path, modified time, size, callback, transform and kwargs. When the file is next
+    opened -- after a restart, or by another Gramex instance -- the snapshot is memory-mapped
+    instead of parsing the file again. This needs `pyarrow`. Only DataFrames are snapshotted.
+    Snapshots are skipped if the callback or transform isn't a plain function, e.g. a builtin.
+
+    Examples:
+        >>> gramex.cache.open('large.xlsx', 'xlsx', snapshot=True)
+        >>> gramex.cache.open('large.csv', 'csv', snapshot='/tmp/snapshots')
     '''
     # Pass _reload_status = True for testing purposes. This returns a tuple:
     # (result, reloaded) instead of just the result.
@@ -175,26 +200,42 @@ def open(
         hashfn(transform),
         frozenset(((k, hashed(v)) for k, v in kwargs.items())),
     )
-    cached = _cache.get(key, _FALLBACK_MEMORY_CACHE.get(key))
+    # Iterators (e.g. csv with chunksize=) can be consumed only once. Don't cache them
+    iterator = bool(kwargs.get('chunksize', None) or kwargs.get('iterator', False))
+    cached = None if iterator else _cache.get(key, _FALLBACK_MEMORY_CACHE.get(key))
     fstat = stat(path)
     if cached is None or fstat != cached.get('stat'):
         reloaded = True
-        if callable(callback):
-            data = callback(path, **kwargs)
-        elif callback_is_str:
-            method = None
-            method = open_callback.get(callback)
-            if method is not None:
-                data = method(path, **kwargs)
-            elif original_callback is None:
-                raise TypeError(f'gramex.cache.open: path "{path}" has unknown extension')
+        # Load the parsed data from an on-disk snapshot if one exists for this version of the file
+        target = None
+        if snapshot and not iterator and fstat[0] is not None:
+            target = _snapshot_path(snapshot, path, callback, transform, kwargs, fstat)
+        data = _read_snapshot(target) if target else None
+        if data is None:
+            if callable(callback):
+                data = callback(path, **kwargs)
+            elif callback_is_str:
+                method = None
+                method = open_callback.get(callback)
+                if method is not None:
+                    data = method(path, **kwargs)
+                elif original_callback is None:
+                    raise TypeError(f'gramex.cache.open: path "{path}" has unknown extension')
+                else:
+                    raise TypeError(
+                        f'gramex.cache.open(callback="{callback}") is not a known type'
+                    )
             else:
-                raise TypeError(f'gramex.cache.open(callback="{callback}") is not a known type')
-        else:
-            raise TypeError(f'gramex.cache.open(callback=) must be a function, not {callback!r}')
-        if callable(transform):
-            data = transform(data)
+                raise TypeError(
+                    f'gramex.cache.open(callback=) must be a function, not {callback!r}'
+                )
+            if callable(transform):
+                data = transform(data)
+            if target:
+                _write_snapshot(data, target)
         cached = {'data': data, 'stat': fstat}
+        if iterator:
+            return (data, reloaded) if _reload_status else data
         try:
             _cache[key] = cached
         except TypeError as e:
@@ -202,7 +243,7 @@ def open(
             app_log.debug(f'gramex.cache.open: {e} on {callback}. Using fallback memory cache')
             _FALLBACK_MEMORY_CACHE[key] = cached
         except ValueError:
-            size = sys.getsizeof(data)
+            size = sizeof(data)
             app_log.exception(
                 f'gramex.cache.open: {type(_cache)} cannot cache {size} bytes. '
                 + 'Increase cache.memory.size in gramex.yaml'
@@ -214,6 +255,92 @@ def open(
     return (result, reloaded) if _reload_status else result
 
 
+def _code_key(fn: Any) -> Any:
+    # Return a key for fn that is stable across processes. Functions are keyed by their code,
+    # defaults and closure. Other callables (builtins, partials, etc.) raise a TypeError
+    if not callable(fn):
+        return fn
+    code = getattr(fn, '__code__', None)
+    if code is None:
+        raise TypeError(f'{fn!r} has no __code__')
+    closure = [cell.cell_contents for cell in fn.__closure__ or ()]
+    return [
+        fn.__module__,
+        fn.__qualname__,
+        _code_digest(code),
+        _json_dump([fn.__defaults__, fn.__kwdefaults__, closure]),
+    ]
+
+
+def _code_digest(code: CodeType) -> str:
+    # marshal.dumps(code) varies with reference counts. So hash the bytecode, names and constants
+    digest = hashlib.sha256(code.co_code)
+    digest.update(repr(code.co_names).encode('utf-8'))
+    for const in code.co_consts:
+        const = _code_digest(const) if isinstance(const, CodeType) else repr(const)
+        digest.update(const.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _snapshot_path(
+    folder: Union[bool, str], path: str, callback: Any, transform: Any, kwargs: dict, fstat: tuple
+) -> Optional[str]:
+    # Return the snapshot file path for open(path, callback, transform, **kwargs), or None
+    if folder is True:
+        folder = os.path.join(variables['GRAMEXDATA'], 'cache', 'snapshot')
+    try:
+        key = _json_dump(
+            [os.path.abspath(path), _code_key(callback), _code_key(transform), kwargs]
+        )
+    except Exception as e:
+        app_log.debug(f'gramex.cache.open: no snapshot for {path}: {e}')
+        return None
+    # All versions of a file share the key hash prefix. Only the latest version is kept
+    key = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    version = hashlib.sha256(repr(fstat).encode('utf-8')).hexdigest()
+    return os.path.join(folder, f'{key}-{version[:16]}.feather')
+
+
+def _read_snapshot(target: str) -> Optional[pd.DataFrame]:
+    if not os.path.exists(target):
+        return None
+    import pyarrow.feather
+
+    try:
+        return pyarrow.feather.read_table(target, memory_map=True).to_pandas()
+    except Exception:
+        app_log.exception(f'gramex.cache.open: cannot read snapshot {target}')
+        return None
+
+
+def _write_snapshot(data: Any, target: str) -> None:
+    if not isinstance(data, pd.DataFrame):
+        return
+    import pyarrow.feather
+
+    folder = os.path.dirname(target)
+    os.makedirs(folder, exist_ok=True)
+    # Write to a temp file and rename it, so that other processes never read a partial snapshot
+    handle, temp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    os.close(handle)
+    try:
+        # Uncompressed Feather files can be memory-mapped
+        pyarrow.feather.write_feather(data, temp, compression='uncompressed')
+        os.replace(temp, target)
+    except Exception as e:
+        app_log.debug(f'gramex.cache.open: cannot snapshot {target}: {e}')
+        os.remove(temp)
+        return
+    # Delete snapshots of older versions of this file
+    prefix = os.path.basename(target).split('-')[0]
+    for name in os.listdir(folder):
+        if name.startswith(f'{prefix}-') and name.endswith('.feather'):
+            path = os.path.join(folder, name)
+            if path != target:
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+
+
 def read_excel(
     io: Union[str, BinaryIO],
     sheet_name: Union[str, int] = 0,
@@ -262,34 +389,52 @@ def read_excel(
 
     import openpyxl
 
-    wb = openpyxl.load_workbook(io, data_only=True)
-    # Pick a SINGLE sheet using sheet_name -- it can be an int or a str
-    ws = wb[wb.sheetnames[sheet_name] if isinstance(sheet_name, int) else sheet_name]
-    # Get the data range to be picked
-    if table is not None:
-        range = ws.tables[table].ref
-        # Tables themselves specify whether they have a column header. Use this as default
-        if header is ...:
-            header = list(builtin_range(ws.tables[table].headerRowCount))
-    elif name is not None:
-        # If the name is workbook-scoped, get it directly
-        defined_name = wb.defined_names.get(name)
-        # Else, if it's sheet-scoped, get it related to the sheet
-        if defined_name is None:
-            defined_name = wb.defined_names.get(name, wb.sheetnames.index(ws.title))
-        # Raise an error if we can't find it
-        if defined_name is None:
-            raise ValueError(f'{io}: missing name {name} in sheet {sheet_name}')
-        # Note: This only works if it's a cell range. If we create a named range inside a table,
-        # Excel may store this as =Table[[#All],[Col1]:[Col5]], which isn't a valid range.
-        # Currently, we ignore that, and assumed that the name is like Sheet1!A1:C10
-        range = defined_name.attr_text.split('!')[-1]
-    elif not range:
-        range = ws.dimensions
-
-    # If range is a single cell, ws[range] returns the value. cells ensures it's a 2D tuple
-    cells = ws[range] if isinstance(ws[range], tuple) else ((ws[range],),)
-    data = pd.DataFrame([[cell.value for cell in row] for row in cells])
+    # Hyperlinks need the full workbook. Else, open read-only. This streams the sheet XML and
+    # parses only the rows in range, instead of creating every cell in the workbook
+    read_only = not links
+    wb = openpyxl.load_workbook(io, read_only=read_only, data_only=True)
+    try:
+        # Pick a SINGLE sheet using sheet_name -- it can be an int or a str
+        ws = wb[wb.sheetnames[sheet_name] if isinstance(sheet_name, int) else sheet_name]
+        # Get the data range to be picked
+        if table is not None:
+            # Read-only worksheets don't load tables. Read them from the sheet's table XML
+            tables = _xlsx_tables(io, ws.title) if read_only else ws.tables
+            if table not in tables:
+                raise ValueError(f'{io}: missing table {table} in sheet {sheet_name}')
+            range = tables[table].ref
+            # Tables themselves specify whether they have a column header. Use this as default
+            if header is ...:
+                header = list(builtin_range(tables[table].headerRowCount))
+        elif name is not None:
+            # If the name is workbook-scoped, get it directly
+            defined_name = wb.defined_names.get(name)
+            # Else, if it's sheet-scoped, get it related to the sheet.
+            # openpyxl >= 3.1 stores these in ws.defined_names. Older versions use a sheet index
+            if defined_name is None:
+                if isinstance(getattr(ws, 'defined_names', None), dict):
+                    defined_name = ws.defined_names.get(name)
+                else:
+                    defined_name = wb.defined_names.get(name, wb.sheetnames.index(ws.title))
+            # Raise an error if we can't find it
+            if defined_name is None:
+                raise ValueError(f'{io}: missing name {name} in sheet {sheet_name}')
+            # Note: This only works if it's a cell range. If we create a named range inside a
+            # table, Excel may store this as =Table[[#All],[Col1]:[Col5]], which isn't a valid
+            # range. Currently, we ignore that, and assume that the name is like Sheet1!A1:C10
+            range = defined_name.attr_text.split('!')[-1]
+        elif not range:
+            range = ws.dimensions
+
+        if read_only:
+            data = pd.DataFrame(_xlsx_range(ws, range))
+        else:
+            # If range is a single cell, ws[range] returns the value. cells ensures it's 2D
+            cells = ws[range] if isinstance(ws[range], tuple) else ((ws[range],),)
+            data = pd.DataFrame([[cell.value for cell in row] for row in cells])
+    finally:
+        if read_only:
+            wb.close()
     # Header defaults to 0 if undefined. If it's not None, apply the header
     header = 0 if header is ... else header
     if header is not None:
@@ -333,6 +478,74 @@ def read_excel(
     return data
 
 
+def _xlsx_range(ws, range: str) -> List[list]:
+    '''Return cell values in a range (e.g. `A1:C10`, `B:C`, `A1`) of a read-only worksheet'''
+    from openpyxl.utils import range_boundaries
+
+    min_col, min_row, max_col, max_row = range_boundaries(range.replace('$', ''))
+    min_row, min_col = min_row or 1, min_col or 1
+    rows = [
+        list(row)
+        for row in ws.iter_rows(
+            min_row=min_row, max_row=max_row, min_col=min_col, max_col=max_col, values_only=True
+        )
+    ]
+    # Read-only worksheets skip trailing empty rows. Pad them like ws[range] does
+    if max_row is not None and max_col is not None:
+        width = max_col - min_col + 1
+        rows.extend([None] * width for _ in builtin_range(max_row - min_row + 1 - len(rows)))
+    return rows
+
+
+def _xlsx_tables(io: Union[str, BinaryIO], sheet: str) -> Dict[str, AttrDict]:
+    '''Return `{table: AttrDict(ref=..., headerRowCount=...)}` for tables in an XLSX sheet.
+
+    Parses only the workbook, relationship and table XML -- not the sheet's cells.
+    '''
+    import posixpath
+    import zipfile
+    from xml.etree import ElementTree
+
+    main = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+    rel_id = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+    pkg = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+    def rels(archive, part):
+        # Return {id: (type, target)} for relationships of an XML part, e.g. xl/workbook.xml
+        folder, filename = posixpath.split(part)
+        path = posixpath.join(folder, '_rels', f'{filename}.rels')
+        if path not in archive.namelist():
+            return {}
+        result = {}
+        for rel in ElementTree.fromstring(archive.read(path)).iter(f'{pkg}Relationship'):
+            target = rel.get('Target', '')
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join(folder, target))
+            result[rel.get('Id')] = (rel.get('Type', ''), target)
+        return result
+
+    tables = {}
+    with zipfile.ZipFile(io) as archive:
+        workbook = 'xl/workbook.xml'
+        for rel_type, target in rels(archive, '').values():
+            if rel_type.endswith('/officeDocument'):
+                workbook = target
+        workbook_rels = rels(archive, workbook)
+        for node in ElementTree.fromstring(archive.read(workbook)).iter(f'{main}sheet'):
+            if node.get('name') == sheet and node.get(rel_id) in workbook_rels:
+                for rel_type, target in rels(archive, workbook_rels[node.get(rel_id)][1]).values():
+                    if rel_type.endswith('/table'):
+                        attrs = ElementTree.fromstring(archive.read(target)).attrib
+                        tables[attrs.get('name', attrs.get('displayName'))] = AttrDict(
+                            ref=attrs['ref'],
+                            headerRowCount=int(attrs.get('headerRowCount', 1)),
+                        )
+                break
+    return tables
+
+
 def save(
     data: pd.DataFrame,
     url: str,
@@ -371,6 +584,8 @@ def query(
     sql: str,
     engine: sa.engine.base.Engine,
     state: Union[str, Callable, List[str], None] = None,
+    state_ttl: float = 0,
+    key: Any = None,
     **kwargs: dict,
 ):
     '''Read SQL query or database table into a DataFrame, cached.
@@ -380,12 +595,18 @@ def query(
     Examples:
         >>> engine = sqlalchemy.create_engine('sqlite:///path/to/file.db')
         >>> gramex.cache.query('SELECT * FROM table', engine, state='SELECT max(date) FROM table')
+        >>> # Check the state at most once a minute
+        >>> gramex.cache.query('SELECT * FROM table', engine, state=['table'], state_ttl=60)
 
     Parameters:
 
         sql: SQL query or table name to read from the database.
         engine: SQLAlchemy engine to read from.
         state: An SQL query, function or list of table names to check if the data has changed.
+        state_ttl: Check the `state` at most once every `state_ttl` seconds. Till then, return
+            the cached result without checking the state.
+        key: Cache key for the query. Defaults to `sql`. Pass a stable key if `sql` differs on
+            each call, e.g. an `sa.text()` with a unique comment.
         kwargs: Other keyword arguments are passed directly to `pandas.read_sql`.
 
     `state` can be a:
@@ -405,6 +626,16 @@ def query(
     _cache = kwargs.pop('_cache', _QUERY_CACHE)
     store_cache = True
 
+    key = (str(sql if key is None else key), cache_key(kwargs.get('params', {})), engine.url)
+    # If the state was checked within state_ttl seconds, return the cached result
+    now = time.time()
+    if state_ttl and key in _cache:
+        cached = _cache[key]
+        # Entries cached by older versions have no 'checked' time
+        if now - cached.get('checked', 0) < state_ttl:
+            result = cached['data']
+            return (result, reloaded) if _reload_status else result
+
     if isinstance(state, (list, tuple)):
         try:
             status = _table_status(engine, tuple(state))
@@ -414,7 +645,7 @@ def query(
             app_log.warning(e.args[0] if len(e.args) > 0 else 'gramex.cache.query: state failed')
             status, store_cache = object(), False
     elif isinstance(state, str):
-        status = pd.read_sql(state, engine).to_dict(orient='list')
+        status = _query_rows(engine, state)
     elif callable(state):
         status = state()
     elif state is None:
@@ -423,9 +654,12 @@ def query(
     else:
         raise TypeError(f'gramex.cache.query(state=) must be a table list/query/fn, not {state!r}')
 
-    key = (str(sql), cache_key(kwargs.get('params', {})), engine.url)
-    if key in _cache and _cache[key]['status'] == status:
-        result = _cache[key]['data']
+    cached = _cache[key] if key in _cache else None
+    if cached is not None and cached['status'] == status:
+        result = cached['data']
+        # Save the entry again, not in place, so that Redis / disk caches store the checked time
+        if state_ttl:
+            _cache[key] = dict(cached, checked=now)
     else:
         app_log.debug(
             f'gramex.cache.query: {sql}. engine: {engine}. state: {state}. kwargs: {kwargs}'
@@ -435,6 +669,7 @@ def query(
             _cache[key] = {
                 'data': result,
                 'status': status,
+                'checked': now,
             }
         reloaded = True
 
@@ -955,11 +1190,19 @@ class KeyStore:
     `purge` seconds. You can provide a custom `purge_keys=` function that
     returns an iterator of keys to delete if any.
 
+    `store.dump(key, value, expire=time.time() + 60)` expires the key after 60 seconds.
+    `expire` is the time (in seconds since epoch) after which `load()` ignores the key, and
+    `purge()` deletes it. Purging expired keys is proportional to the number of expired keys.
+    `purge_keys=` only checks keys that were saved without an `expire`. Persistent stores save the
+    expiry with the key, so keys expire after a restart too. (KeyStore is not persistent.)
+
     When the program exits, `.close()` is automatically called.
     '''
 
     def __init__(self, flush=None, purge=None, purge_keys=None, **kwargs):
         self.store = {}
+        # {key: expiry time}, and a heap of (expiry time, key) to find expired keys quickly
+        self._expiry, self._expiry_heap = {}, []
         if callable(purge_keys):
             self.purge_keys = purge_keys
         elif purge_keys is not None:
@@ -979,17 +1222,56 @@ class KeyStore:
     def load(self, key, default=...):
         '''Same as `store.get(key)`, but it's called `load()` to indicate persistence'''
         key = self._escape(key)
-        return self.store.get(key, {} if default is ... else default)
+        default = {} if default is ... else default
+        if self._is_expired(key):
+            return default
+        return self.store.get(key, default)
 
-    def dump(self, key, value):
-        '''Same as `store[key] = value`'''
+    def dump(self, key, value, expire=None):
+        '''Same as `store[key] = value`. Expires the key at `expire` (seconds since epoch)'''
         key = self._escape(key)
         self.store[key] = value
+        self._set_expiry(key, expire)
+
+    def get_many(self, keys, default=None):
+        '''Return `{key: value}` for each key, or `default` if the key is missing or expired'''
+        return {self._escape(key): self.load(key, default) for key in keys}
+
+    def set_many(self, items, expire=None):
+        '''Save a `{key: value}` dict. Keys expire at `expire` (seconds since epoch)'''
+        for key, value in items.items():
+            self.dump(key, value, expire)
 
     def _escape(self, key):
         # Converts key into a unicode string (interpreting byte-string keys as UTF-8)
         return str(key, encoding='utf-8') if isinstance(key, bytes) else str(key)
 
+    def _set_expiry(self, key, expire):
+        if expire is None:
+            self._expiry.pop(key, None)
+        elif self._expiry.get(key) != expire:
+            self._expiry[key] = expire
+            heapq.heappush(self._expiry_heap, (expire, key))
+            # Keys that are re-saved with a new expiry leave stale entries in the heap. Compact it
+            if len(self._expiry_heap) > 2 * len(self._expiry) + 1000:
+                self._expiry_heap = [(val, key) for key, val in self._expiry.items()]
+                heapq.heapify(self._expiry_heap)
+
+    def _is_expired(self, key):
+        expire = self._expiry.get(key)
+        return expire is not None and expire <= time.time()
+
+    def _expired_keys(self):
+        '''Remove and return keys from the expiry index that have expired'''
+        now, heap, keys = time.time(), self._expiry_heap, []
+        while heap and heap[0][0] <= now:
+            expire, key = heapq.heappop(heap)
+            # Ignore stale heap entries, i.e. keys re-saved with a different expiry
+            if self._expiry.get(key) == expire:
+                del self._expiry[key]
+                keys.append(key)
+        return keys
+
     @staticmethod
     def purge_keys(data):
         return [key for key, val in data.items() if val is None]
@@ -999,8 +1281,12 @@ class KeyStore:
         pass
 
     def purge(self):
-        '''Delete empty keys and flush'''
-        for key in self.purge_keys(self.store):
+        '''Delete expired and empty keys and flush'''
+        for key in self._expired_keys():
+            self.store.pop(key, None)
+        # Keys without an expiry are checked via purge_keys
+        items = {key: val for key, val in self.store.items() if key not in self._expiry}
+        for key in self.purge_keys(items):
             # If the key was already removed from store, ignore
             with contextlib.suppress(KeyError):
                 del self.store[key]
@@ -1018,6 +1304,8 @@ class RedisStore(KeyStore):
         >>> store = RedisStore('localhost:6379:1:password=x:...')     # host:port:db:params
         >>> value = store.load(key)
         >>> store.dump(key, value)
+        >>> store.set_many({key1: value1, key2: value2})
+        >>> values = store.get_many([key1, key2])
 
     The path in the constructor contains parameters separated by colon (:):
 
@@ -1026,18 +1314,27 @@ class RedisStore(KeyStore):
     - `db`: the Redis server DB number (default: 0)
     - zero or more parameters passed to StrictRedis (e.g. password=abc)
 
+    `prefix` is prepended to each key in Redis. This lets multiple stores share a Redis DB. For
+    example, `RedisStore(path, prefix='session:')` stores key `x` as `session:x`. `keys()` and
+    `purge()` only scan keys with this prefix.
+
     Values are encoded as JSON using gramex.config.CustomJSONEncoder (thus
     handling datetime.) Keys are JSON encoded.
+
+    Keys saved with `expire=` use Redis TTLs. `get_many()` uses MGET, and `set_many()` uses a
+    pipeline, to save round trips. `purge()` uses SCAN, and checks keys in batches of `batch`.
     '''
 
-    def __init__(self, path=None, *args, **kwargs):
+    def __init__(self, path=None, *args, prefix='', batch=1000, **kwargs):
         super(RedisStore, self).__init__(*args, **kwargs)
         from gramex.services.rediscache import get_redis
 
         self.store = get_redis(path, decode_responses=True, encoding='utf-8')
+        self.prefix, self.batch = prefix, batch
+        # SCAN pattern matching all keys with the prefix. Escape glob characters in prefix
+        self._match = re.sub(r'([*?\[\]\\])', r'\\\1', prefix) + '*' if prefix else None
 
-    def load(self, key, default=None):
-        result = self.store.get(key)
+    def _decode(self, key, result, default):
         if result is None:
             return default
         try:
@@ -1046,22 +1343,73 @@ class RedisStore(KeyStore):
             app_log.error(f'RedisStore("{self.store}").load("{key}") is not JSON "{result!r}"')
             return default
 
-    def dump(self, key, value):
-        if value is None:
-            self.store.delete(key)
+    def load(self, key, default=None):
+        return self._decode(key, self.store.get(self.prefix + self._escape(key)), default)
+
+    def get_many(self, keys, default=None):
+        keys, result = [self._escape(key) for key in keys], {}
+        for index in builtin_range(0, len(keys), self.batch):
+            batch = keys[index : index + self.batch]
+            values = self.store.mget([self.prefix + key for key in batch])
+            for key, value in zip(batch, values):
+                result[key] = self._decode(key, value, default)
+        return result
+
+    def _set(self, client, key, value, expire):
+        # Redis expires keys natively. Expired keys are deleted
+        key = self.prefix + self._escape(key)
+        ttl = None if expire is None else int((expire - time.time()) * 1000)
+        if value is None or (ttl is not None and ttl <= 0):
+            client.delete(key)
         else:
-            value = _json_dump(value)
-            self.store.set(key, value)
+            client.set(key, _json_dump(value), px=ttl)
+
+    def dump(self, key, value, expire=None):
+        self._set(self.store, key, value, expire)
+
+    def set_many(self, items, expire=None):
+        pipe = self.store.pipeline(transaction=False)
+        for key, value in items.items():
+            self._set(pipe, key, value, expire)
+        pipe.execute()
+
+    def keys(self):
+        return (
+            key[len(self.prefix) :]
+            for key in self.store.scan_iter(match=self._match, count=self.batch)
+        )
 
     def close(self):
         pass
 
     def purge(self):
         app_log.debug(f'Purging {self.store}')
-        # TODO: optimize item retrieval
-        items = {key: self.load(key, None) for key in self.store.keys()}
-        for key in self.purge_keys(items):
-            self.store.delete(key)
+        # Keys with an expiry are deleted by Redis. Check only keys without an expiry (TTL = -1).
+        # SCAN in batches instead of KEYS, which blocks Redis on large keyspaces
+        keys = []
+        for key in self.store.scan_iter(match=self._match, count=self.batch):
+            keys.append(key)
+            if len(keys) >= self.batch:
+                self._purge(keys)
+                keys = []
+        self._purge(keys)
+
+    def _purge(self, keys):
+        if not keys:
+            return
+        # Get the TTL of all keys in 1 round trip, and values of keys without an expiry in another
+        pipe = self.store.pipeline(transaction=False)
+        for key in keys:
+            pipe.ttl(key)
+        keys = [key for key, ttl in zip(keys, pipe.execute()) if ttl == -1]
+        items = {}
+        for key, value in zip(keys, self.store.mget(keys) if keys else []):
+            # Ignore keys deleted after SCAN
+            if value is not None:
+                items[key[len(self.prefix) :]] = self._decode(key, value, None)
+        purge = [self.prefix + key for key in self.purge_keys(items)]
+        if purge:
+            self.store.delete(*purge)
 
 
 class SQLiteStore(KeyStore):
@@ -1071,38 +1419,142 @@ class SQLiteStore(KeyStore):
         >>> store = SQLiteStore('file.db', table='store')
         >>> value = store.load(key)
         >>> store.dump(key, value)
+        >>> store.set_many({key1: value1, key2: value2})
+        >>> values = store.get_many([key1, key2])
 
     Values are encoded as JSON using gramex.config.CustomJSONEncoder (thus
     handling datetime.) Keys are JSON encoded.
+
+    Key expiry times are stored in an indexed `expire` column.
+
+    The database uses write-ahead logging (`journal_mode='WAL'`) with `synchronous='NORMAL'`.
+    This lets multiple Gramex processes read while one writes. Writes are buffered in memory and
+    committed in one transaction on `flush()`, or `delay` seconds after the first buffered write
+    (default: 0.05s). `load()` reads buffered writes too.
     '''
 
-    def __init__(self, path, table='store', *args, **kwargs):
+    def __init__(
+        self,
+        path,
+        table='store',
+        *args,
+        delay=0.05,
+        journal_mode='WAL',
+        synchronous='NORMAL',
+        timeout=10,
+        **kwargs,
+    ):
         super(SQLiteStore, self).__init__(*args, **kwargs)
         self.path = _create_path(path)
-        from sqlitedict import SqliteDict
-
-        self.store = SqliteDict(
-            self.path,
-            tablename=table,
-            autocommit=True,
-            encode=_json_dump,
-            decode=lambda v: json.loads(v, object_pairs_hook=AttrDict, cls=CustomJSONDecoder),
-        )
+        self.table = table
+        self.delay = delay
+        import sqlite3
+
+        # Writes are buffered here as {key: (value JSON, expire)} until flush()
+        self._pending, self._timer, self._lock = {}, None, threading.RLock()
+        self.store = sqlite3.connect(self.path, timeout=timeout, check_same_thread=False)
+        self.store.execute(f'PRAGMA journal_mode={journal_mode}')
+        self.store.execute(f'PRAGMA synchronous={synchronous}')
+        with self.store:
+            # This schema is compatible with sqlitedict, which SQLiteStore used earlier
+            self.store.execute(
+                f'CREATE TABLE IF NOT EXISTS "{table}" (key TEXT PRIMARY KEY, value BLOB)'
+            )
+            # Add an indexed expire column to the table, if it doesn't have one
+            cols = [row[1] for row in self.store.execute(f'PRAGMA table_info("{table}")')]
+            if 'expire' not in cols:
+                self.store.execute(f'ALTER TABLE "{table}" ADD COLUMN expire REAL')
+            self.store.execute(
+                f'CREATE INDEX IF NOT EXISTS "{table}_expire" ON "{table}" (expire)'
+            )
+
+    @staticmethod
+    def _decode(value):
+        return json.loads(value, object_pairs_hook=AttrDict, cls=CustomJSONDecoder)
+
+    def load(self, key, default=...):
+        return self.get_many([key], default).get(self._escape(key))
+
+    def get_many(self, keys, default=None):
+        '''Return `{key: value}` for each key, or `default` if the key is missing or expired'''
+        default = {} if default is ... else default
+        keys, now, result = [self._escape(key) for key in keys], time.time(), {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                if key in self._pending:
+                    value, expire = self._pending[key]
+                    if expire is None or expire > now:
+                        result[key] = value
+                else:
+                    missing.append(key)
+            # SQLite allows up to 999 parameters in older versions. Query in batches
+            for index in builtin_range(0, len(missing), 900):
+                batch = missing[index : index + 900]
+                query = (
+                    f'SELECT key, value FROM "{self.table}" WHERE key IN '
+                    f'({", ".join("?" * len(batch))}) AND (expire IS NULL OR expire > ?)'
+                )
+                result.update(self.store.execute(query, batch + [now]))
+        return {key: self._decode(result[key]) if key in result else default for key in keys}
+
+    def dump(self, key, value, expire=None):
+        self.set_many({key: value}, expire)
+
+    def set_many(self, items, expire=None):
+        '''Save a `{key: value}` dict. Keys expire at `expire` (seconds since epoch)'''
+        with self._lock:
+            for key, value in items.items():
+                self._pending[self._escape(key)] = (_json_dump(value), expire)
+            # Commit after a delay, batching writes in the meantime
+            if self._timer is None and self._pending:
+                self._timer = threading.Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
 
     def close(self):
+        self.flush()
         self.store.close()
 
     def flush(self):
         super(SQLiteStore, self).flush()
-        self.store.commit()
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._pending:
+                with self.store:
+                    self.store.executemany(
+                        f'REPLACE INTO "{self.table}" (key, value, expire) VALUES (?, ?, ?)',
+                        [(key, value, expire) for key, (value, expire) in self._pending.items()],
+                    )
+                self._pending.clear()
 
     def keys(self):
         # Keys need to be escaped
-        return (self._escape(key) for key in self.store.keys())
+        self.flush()
+        with self._lock:
+            rows = self.store.execute(
+                f'SELECT key FROM "{self.table}" WHERE expire IS NULL OR expire > ?',
+                (time.time(),),
+            ).fetchall()
+        return (self._escape(row[0]) for row in rows)
 
     def purge(self):
         app_log.debug(f'Purging {self.path}')
-        super(SQLiteStore, self).purge()
+        self.flush()
+        with self._lock, self.store:
+            # Delete expired keys using the index on expire
+            self.store.execute(f'DELETE FROM "{self.table}" WHERE expire <= ?', (time.time(),))
+            # Keys without an expiry are checked via purge_keys
+            rows = self.store.execute(
+                f'SELECT key, value FROM "{self.table}" WHERE expire IS NULL'
+            )
+            items = {key: self._decode(value) for key, value in rows}
+            self.store.executemany(
+                f'DELETE FROM "{self.table}" WHERE key = ?',
+                [(key,) for key in self.purge_keys(items)],
+            )
 
 
 class HDF5Store(KeyStore):
@@ -1116,6 +1568,7 @@ class HDF5Store(KeyStore):
     Internally, it uses HDF5 groups to store data. Values are encoded as JSON
     using gramex.config.CustomJSONEncoder (thus handling datetime.) Keys are JSON
     encoded, and '/' is escaped as well (since HDF5 groups treat / as subgroups.)
+    Expiry times are saved in an `expire` attribute of each key.
     '''
 
     def __init__(self, path, *args, **kwargs):
@@ -1128,12 +1581,15 @@ class HDF5Store(KeyStore):
         # '.meta.h5', errno = 17, error message = 'File exists', flags = 15, o_flags = 502)
         # TODO: identify why this happens and resolve it.
         self.store = h5py.File(self.path, 'a')
+        for key, dataset in self.store.items():
+            if 'expire' in dataset.attrs:
+                self._set_expiry(key, float(dataset.attrs['expire']))
 
     def load(self, key, default=None):
         # Keys cannot contain / in HDF5 store. Escape it
         key = self._escape(key).replace('/', '\t')
         result = self.store.get(key)
-        if result is None:
+        if result is None or self._is_expired(key):
             return default
         result = result[()]
         try:
@@ -1142,7 +1598,7 @@ class HDF5Store(KeyStore):
             app_log.error(f'HDF5Store("{self.path}").load("{key}") is not JSON ("{result!r}")')
             return default
 
-    def dump(self, key, value):
+    def dump(self, key, value, expire=None):
         key = self._escape(key)
         # TODO: BUG. Rewrite like JSONStore.dump()
         if self.store.get(key) != value:
@@ -1150,6 +1606,15 @@ class HDF5Store(KeyStore):
                 del self.store[key]
             self.store[key] = _json_dump(value)
             self.changed = True
+        self._set_expiry(key, expire)
+        # Save the expiry with the key, so that it expires after a restart
+        attrs = self.store[key].attrs
+        if expire is not None:
+            attrs['expire'] = expire
+            self.changed = True
+        elif 'expire' in attrs:
+            del attrs['expire']
+            self.changed = True
 
     def _escape(self, key):
         # Converts key into a unicode string (interpreting byte-string keys as UTF-8).
@@ -1172,9 +1637,15 @@ class HDF5Store(KeyStore):
         # Load all keys into self.store. Delete what's required. Save.
         self.flush()
         changed = False
+        for key in self._expired_keys():
+            if key in self.store:
+                del self.store[key]
+                changed = True
+        # Keys without an expiry are checked via purge_keys
         items = {
             key: json.loads(val[()], object_pairs_hook=AttrDict, cls=CustomJSONDecoder)
             for key, val in self.store.items()
+            if key not in self._expiry
         }
         for key in self.purge_keys(items):
             del self.store[key]
@@ -1194,63 +1665,209 @@ class HDF5Store(KeyStore):
             app_log.debug(f'HDF5Store("{self.path}").close() error ({e}) ignored')
 
 
+# JSONStore lines like {_JSON_EXPIRE: {key: expire}} save expiry times. null removes the expiry
+_JSON_EXPIRE = '\x00expire'
+
+
 class JSONStore(KeyStore):
     '''
-    A KeyStore that stores data in a JSON file. Typical usage:
+    A KeyStore that stores data in a JSON Lines file. Typical usage:
 
         >>> store = JSONStore('file.json', flush=15)
         >>> value = store.load(key)
         >>> store.dump(key, value)
 
+    Each line in the file is either a JSON object like `{"key": value}` that sets keys, or a
+    JSON array like `["key1", "key2"]` that deletes keys. Later lines override earlier ones.
+    Expiry times are saved in lines like `{"\\u0000expire": {"key": expiry time or null}}`.
+    `flush()` appends lines only for keys whose JSON changed since the last flush, after reading
+    lines appended by other instances. When the file has over `compact` times as many lines as
+    keys (default: 2), or on `purge()`, it is rewritten with one line per key.
+
+    Files with a single JSON object (the earlier format) are read as-is, and rewritten as JSON
+    Lines on the next flush.
+
     This is less efficient than HDF5Store for large data, but is human-readable.
     They also cannot support multiple instances. Only one JSONStore instance
     is permitted per file.
     '''
 
-    def __init__(self, path, *args, **kwargs):
+    def __init__(self, path, *args, compact=2, **kwargs):
         super(JSONStore, self).__init__(*args, **kwargs)
         self.path = _create_path(path)
-        self._init_store(self._read_json())
-
-    def _init_store(self, contents):
-        self.store = contents
-        self._original = copy.deepcopy(self.store)  # copy of original contents
-        self.changed = False  # boolean: has the store contents changed?
+        self.compact = compact
         self.update = {}  # all key-values added since flush
+        self._reset()
+        self._read()
 
-    def _read_json(self):
+    def _reset(self):
+        self.store = {}
+        self._json = {}  # {key: JSON of value in the file}. Used to detect changes
+        self._expire_json = {}  # {key: expiry time in the file}. Used to detect changes
+        # The file's (device, inode), bytes read, lines read, and whether to rewrite it
+        self._inode, self._offset, self._lines, self._rewrite = None, 0, 0, False
+        # The last bytes read. If these change, the file was replaced
+        self._tail = b''
+
+    def _read(self):
+        '''Apply lines appended to the file since the last read. Re-read if it was replaced'''
         try:
-            with io.open(self.path) as handle:
-                return json.load(handle, cls=CustomJSONDecoder)
-        except (IOError, ValueError):
-            return {}
-
-    def _write_json(self, data):
-        json_value = _json_dump(data)
-        with io.open(self.path, 'w') as handle:
-            handle.write(json_value)
+            with io.open(self.path, 'rb') as handle:
+                stat = os.fstat(handle.fileno())
+                handle.seek(self._offset - len(self._tail))
+                data = handle.read()
+                # If the file was replaced (e.g. compacted by another instance), read afresh
+                if (stat.st_dev, stat.st_ino) != self._inode or not data.startswith(self._tail):
+                    self._reset()
+                    self._inode = (stat.st_dev, stat.st_ino)
+                    handle.seek(0)
+                    data = handle.read()
+                else:
+                    data = data[len(self._tail) :]
+        except IOError:
+            self._reset()
+            return
+        if self._offset == 0 and data.lstrip().startswith(b'{'):
+            # Files with a single (maybe multi-line) JSON object use the earlier format
+            with contextlib.suppress(ValueError):
+                text = data.decode('utf-8')
+                self._apply(json.loads(text, cls=CustomJSONDecoder), text)
+                self._offset, self._tail, self._rewrite = len(data), data[-64:], True
+                return
+        # Ignore the last line if it's incomplete, e.g. while another instance is writing it
+        end = data.rfind(b'\n') + 1
+        lines = data[:end].decode('utf-8').splitlines()
+        self._lines += len(lines)
+        lines = [line for line in lines if line.strip()]
+        try:
+            # Parsing all lines as one array is faster than parsing each line
+            rows = json.loads(f'[{",".join(lines)}]', cls=CustomJSONDecoder)
+        except ValueError:
+            rows = [self._parse(line) for line in lines]
+        for row, line in zip(rows, lines):
+            self._apply(row, line)
+        self._offset += end
+        self._tail = (self._tail + data[:end])[-64:]
 
-    def dump(self, key, value):
-        '''Same as store[key] = value'''
+    def _parse(self, line):
+        try:
+            return json.loads(line, cls=CustomJSONDecoder)
+        except ValueError:
+            app_log.warning(f'JSONStore: {self.path}: skipping invalid line {line[:100]}')
+
+    def _apply(self, row, line):
+        if isinstance(row, dict):
+            for key, expire in row.pop(_JSON_EXPIRE, {}).items():
+                self._set_expiry(key, expire)
+                if expire is None:
+                    self._expire_json.pop(key, None)
+                else:
+                    self._expire_json[key] = expire
+            for key, value in row.items():
+                self.store[key] = value
+            # flush() writes lines as {key:value}. Re-use the value's JSON instead of dumping it
+            prefix = f'{{{json.dumps(key)}:' if len(row) == 1 else None
+            if prefix and line.startswith(prefix) and line.endswith('}'):
+                self._json[key] = line[len(prefix) : -1]
+            else:
+                for key, value in row.items():
+                    self._json[key] = _json_dump(value)
+        elif isinstance(row, list):
+            for key in row:
+                self.store.pop(key, None)
+                self._json.pop(key, None)
+                self._expire_json.pop(key, None)
+                self._expiry.pop(key, None)
+
+    def dump(self, key, value, expire=None):
+        '''Same as store[key] = value. Expires the key at `expire` (seconds since epoch)'''
         key = self._escape(key)
         self.store[key] = value
-        # Update contents only if the value is different from the original
-        if self._original.get(key) != value:
-            self.update[key] = value
-            self.changed = True
+        self._set_expiry(key, expire)
+        # flush() writes this key if its JSON is different from the file
+        self.update[key] = value
 
     def flush(self, purge=False):
         super(JSONStore, self).flush()
-        if getattr(self, 'changed', False) or purge:
-            app_log.debug(f"{'Purging' if purge else 'Flushing'} {self.path}")
-            # Don't dump contents. That can overwrite other instances' updates.
-            # Instead: read, apply updates, and save.
-            store = self._read_json()
-            store.update(self.update)
-            for key in self.purge_keys(store):
-                del store[key]
-            self._write_json(store)
-            self._init_store(store)
+        expired = self._expired_keys()
+        if not self.update and not expired and not purge:
+            return
+        app_log.debug(f"{'Purging' if purge else 'Flushing'} {self.path}")
+        # Don't dump contents. That can overwrite other instances' updates.
+        # Instead: read their updates, apply ours, and save the changed keys.
+        # Keep our expiry for updated keys, even if their lines set a different one
+        pending = {key: self._expiry.get(key) for key in self.update}
+        self._read()
+        self.store.update(self.update)
+        for key, expire in pending.items():
+            self._set_expiry(key, expire)
+        for key in expired:
+            self.store.pop(key, None)
+        # Keys without an expiry are checked via purge_keys. Check all keys only when purging
+        keys = self.store if purge else self.update
+        items = {
+            key: self.store[key] for key in keys if key in self.store and key not in self._expiry
+        }
+        purged = self.purge_keys(items)
+        for key in purged:
+            self.store.pop(key, None)
+        sets, deletes, expiry = [], [], {}
+        for key in set(self.update).union(expired, purged):
+            if key in self.store:
+                value = _json_dump(self.store[key])
+                if self._json.get(key) != value:
+                    self._json[key] = value
+                    sets.append(f'{{{json.dumps(key)}:{value}}}\n')
+                expire = self._expiry.get(key)
+                if self._expire_json.get(key) != expire:
+                    expiry[key] = expire
+                    if expire is None:
+                        del self._expire_json[key]
+                    else:
+                        self._expire_json[key] = expire
+            else:
+                self._expire_json.pop(key, None)
+                if self._json.pop(key, None) is not None:
+                    deletes.append(key)
+        self.update = {}
+        if expiry:
+            sets.append(_json_dump({_JSON_EXPIRE: expiry}) + '\n')
+        if deletes:
+            sets.append(_json_dump(deletes) + '\n')
+        if purge or self._rewrite or self._lines + len(sets) > self.compact * len(self._json):
+            self._write()
+        elif sets:
+            self._append(''.join(sets).encode('utf-8'), len(sets))
+
+    def _append(self, data, lines):
+        handle = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | _O_BINARY, 0o666)
+        try:
+            os.write(handle, data)
+            end, stat = os.lseek(handle, 0, os.SEEK_CUR), os.fstat(handle)
+        finally:
+            os.close(handle)
+        # If no other instance appended since our last read, skip our lines on the next read.
+        # Else re-read from our last read. (Re-applying our lines is harmless)
+        if end - len(data) == self._offset:
+            self._inode, self._offset = (stat.st_dev, stat.st_ino), end
+            self._tail, self._lines = (self._tail + data)[-64:], self._lines + lines
+
+    def _write(self):
+        '''Rewrite the file with one line per key, and a line with expiry times'''
+        keys = sorted(self._json)
+        lines = [f'{{{json.dumps(key)}:{self._json[key]}}}\n' for key in keys]
+        self._expire_json = {key: self._expiry[key] for key in keys if key in self._expiry}
+        if self._expire_json:
+            lines.append(_json_dump({_JSON_EXPIRE: self._expire_json}) + '\n')
+        data = ''.join(lines).encode('utf-8')
+        # Write to a temporary file and rename, so that readers never see a partial file
+        target = f'{self.path}.{os.getpid()}.tmp'
+        with io.open(target, 'wb') as handle:
+            handle.write(data)
+        os.replace(target, self.path)
+        stat = os.stat(self.path)
+        self._inode, self._offset, self._tail = (stat.st_dev, stat.st_ino), len(data), data[-64:]
+        self._lines, self._rewrite = len(lines), False
 
     def purge(self):
         self.flush(purge=True)
@@ -1475,10 +2092,16 @@ def _table_status(engine, tables):
         if dialect == 'sqlite':
             _STATUS_METHODS[key] = lambda: stat(q)
         else:
-            _STATUS_METHODS[key] = lambda: pd.read_sql(q, engine).to_json(orient='records')
+            _STATUS_METHODS[key] = lambda: _query_rows(engine, q)
     return _STATUS_METHODS[key]()
 
 
+def _query_rows(engine, sql):
+    '''Run an SQL query and return its rows as tuples. This is faster than `pd.read_sql`'''
+    with engine.connect() as conn:
+        return [tuple(row) for row in conn.exec_driver_sql(sql)]
+
+
 def _get_current_ioloop():
     '''
     Return the current IOLoop. But if we're not already in an IOLoop, return an
@@ -1503,9 +2126,58 @@ def _create_path(path):
     return path
 
 
-def sizeof(obj):
+SIZEOF_SAMPLE = 1000  # sizeof() samples these many values from object arrays / columns
+
+
+def sizeof(obj: Any) -> int:
+    '''Return the approximate memory used by obj in bytes. Memory caches use this.
+
+    Examples:
+        >>> sizeof({'data': pd.DataFrame({'x': ['a', 'b']}), 'stat': (1, 2)})
+        594
+
+    It recurses into dicts, lists and sets. For DataFrames, Series and NumPy arrays, it adds up
+    the array buffers. For object (e.g. string) arrays, it extrapolates the size of
+    [SIZEOF_SAMPLE][] random values, instead of measuring every value. So the time taken does
+    not grow with the number of rows.
+    '''
     if isinstance(obj, dict):
         return sys.getsizeof(obj) + sum(sizeof(k) + sizeof(v) for k, v in obj.items())
     elif isinstance(obj, (set, list)):
         return sys.getsizeof(obj) + sum(sizeof(v) for v in obj)
+    elif isinstance(obj, pd.DataFrame):
+        # memory_usage(deep=False) is the size of the buffers. Object columns store pointers.
+        # Add the sampled size of the objects they point to
+        size = int(obj.memory_usage(index=True, deep=False).sum()) + _sizeof_objects(obj.index)
+        return size + sum(_sizeof_objects(col) for _, col in obj.items())
+    elif isinstance(obj, pd.Series):
+        size = int(obj.memory_usage(index=True, deep=False))
+        return size + _sizeof_objects(obj) + _sizeof_objects(obj.index)
+    elif isinstance(obj, np.ndarray):
+        # getsizeof() skips the data of views. Count it anyway, since the view keeps it alive
+        size = sys.getsizeof(obj) + (0 if obj.flags.owndata else obj.nbytes)
+        return size + _sizeof_objects(obj)
     return sys.getsizeof(obj)
+
+
+def _sizeof_objects(values: Union[np.ndarray, pd.Series, pd.Index]) -> int:
+    '''Return the sampled size of the Python objects in an object array. 0 for other arrays'''
+    dtype = values.dtype
+    # Object arrays, and pandas strings stored as Python objects, hold Python objects
+    objects = pd.api.types.is_object_dtype(dtype) or getattr(dtype, 'storage', None) == 'python'
+    if not objects or not values.size:
+        return 0
+    # MultiIndex values are tuples, but it stores levels and codes, which memory_usage() counts
+    if isinstance(values, pd.MultiIndex):
+        return 0
+    # Sample random (not evenly spaced) positions, so that periodic data doesn't skew the sample.
+    # Use a fixed seed, so that the same data has the same size
+    if values.size <= SIZEOF_SAMPLE:
+        sample = values.flat if isinstance(values, np.ndarray) else values
+    else:
+        index = np.random.default_rng(0).integers(0, values.size, SIZEOF_SAMPLE)
+        if isinstance(values, np.ndarray):
+            sample = values.flat[index]
+        else:
+            sample = (values.iloc if isinstance(values, pd.Series) else values)[index]
+    return values.size * sum(map(sys.getsizeof, sample)) // min(values.size, SIZEOF_SAMPLE)
@@ -32,13 +32,17 @@ import os
 import re
 import csv
 import sys
+import time
 import yaml
+import queue
 import base64
 import string
 import socket
 import inspect
 import logging
+import weakref
 import datetime
+import threading
 import dateutil.tz
 import dateutil.parser
 from pathlib import Path
@@ -58,7 +62,6 @@ from errno import EACCES, EPERM
 # This allows YAML conditionals like `key if six.text_type(...): val`
 import six  # noqa
 
-
 ERROR_SHARING_VIOLATION = 32  # from winerror.ERROR_SHARING_VIOLATION
 
 # gramex.config.app_log is the default logger used by all of gramex
@@ -854,11 +857,104 @@ class TimedRotatingCSVHandler(logging.handlers.TimedRotatingFileHandler):
         try:
             # Write the CSV record instead of the formatted record
             self.writer.writerow(record.msg)
-            self.stream.flush()
+            self.flush()
         except Exception:
             self.handleError(record)
 
 
+def _noop():
+    pass
+
+
+class QueueHandler(logging.Handler):
+    '''
+    Emits records to a `handler` via a background thread, so that logging doesn't block.
+
+    `.emit()` just queues the record. A writer thread waits for a record, collects more records
+    for up to `interval` seconds or until it has `batch` records, and emits them via `handler`.
+    Stream handlers (files, CSV files) flush once per batch, not once per record.
+    Rollovers happen in the writer thread. Records are formatted in the writer thread, so queued
+    output is delayed, and may appear out of order with `print()`. Don't queue console handlers.
+
+    `.close()` writes pending records and closes `handler`. `logging.shutdown()` does this at exit.
+
+    `gramex.services.log()` wraps handlers that have a `queue:` key with this.
+    '''
+
+    def __init__(self, handler: logging.Handler, batch: int = 1000, interval: float = 1.0):
+        super(QueueHandler, self).__init__(handler.level)
+        self.name, self.handler = handler.name, handler
+        self.batch, self.interval = batch, interval
+        self._start()
+        _queue_handlers.add(self)
+
+    def _start(self):
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name=f'log-{self.name}', daemon=True)
+        self.thread.start()
+
+    def handle(self, record):
+        # Skip the handler lock. SimpleQueue.put() is thread-safe and does not block
+        result = self.filter(record)
+        if result:
+            self.queue.put(record)
+        return result
+
+    def emit(self, record):
+        self.queue.put(record)
+
+    def _run(self):
+        get, batch, interval = self.queue.get, self.batch, self.interval
+        while True:
+            records = [get()]
+            deadline = time.monotonic() + interval
+            while records[-1] is not None and len(records) < batch:
+                try:
+                    records.append(get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            # .close() queues None to stop the thread
+            stop = records[-1] is None
+            if stop:
+                records.pop()
+            self._write(records)
+            if stop:
+                return
+
+    def _write(self, records):
+        handler = self.handler
+        # StreamHandler.emit() flushes each record. Instead, flush once per batch
+        handler.flush = _noop
+        try:
+            for record in records:
+                handler.handle(record)
+        finally:
+            del handler.flush
+        handler.flush()
+
+    def close(self):
+        _queue_handlers.discard(self)
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.handler.close()
+        super(QueueHandler, self).close()
+
+
+_queue_handlers = weakref.WeakSet()
+
+
+def _restart_queue_handlers():
+    # A forked child (e.g. app.listen.processes) has no writer threads. Start new ones.
+    # Records queued before the fork are written by the parent, not the child
+    for handler in list(_queue_handlers):
+        handler._start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_queue_handlers)
+
+
 def ioloop_running(loop):
     '''Returns whether the Tornado ioloop is running on not'''
     # TODO: Pressing Ctrl+C may cause this to raise an exception. Explore how to handle that
@@ -5,12 +5,16 @@ import os
 import re
 import time
 import json
+import threading
 import sqlalchemy as sa
 import sqlite3
 import numpy as np
 import pandas as pd
 import gramex.cache
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
+from functools import lru_cache
 from packaging import version
 from tornado.escape import json_encode
 from typing import Callable, List, Tuple, Dict, Union, Any
@@ -19,7 +23,10 @@ from gramex.transforms import build_transform
 from orderedattrdict import AttrDict
 from urllib.parse import urlparse
 
-_ENGINE_CACHE = {}
+# create_engine() caches up to ENGINE_CACHE_SIZE engines, least recently used first.
+# Templated url: or kwargs can create a new engine per request. This limits them
+ENGINE_CACHE_SIZE = 100
+_ENGINE_CACHE, _ENGINE_LOCK = OrderedDict(), threading.Lock()
 _METADATA_CACHE = {}
 _FOLDER = os.path.dirname(os.path.abspath(__file__))
 # Dummy path used by _path_safe to detect sub-directories
@@ -133,6 +140,7 @@ def filter(
 
     - `table`: table name (if url is an SQLAlchemy URL), `.format`-ed using `args`.
     - `state`: optional SQL query to check if data has changed.
+    - `state_ttl`: optional. Check `state` at most once every `state_ttl` seconds.
 
     TODO: Document how to pass params -- for each database
 
@@ -249,7 +257,7 @@ def filter(
         data = transform(url) if callable(transform) else url
         return _filter_frame(data, meta, controls, args, argstype)
     elif engine == 'dir':
-        data = dirstat(url, **args)
+        data = dirstat(url, **kwargs)
         data = transform(data) if callable(transform) else data
         return _filter_frame(data, meta, controls, args, argstype)
     elif engine in {'file', 'http', 'https'}:
@@ -280,6 +288,7 @@ def filter(
         )
     elif engine == 'sqlalchemy':
         state = kwargs.pop('state', None)
+        state_ttl = kwargs.pop('state_ttl', 0)
         engine = alter(url, table, columns, **kwargs)
         if query or queryfile:
             if queryfile:
@@ -291,27 +300,15 @@ def filter(
                     state = list(table)
                 elif table is not None:
                     raise ValueError(f'table: must be string or list of strings, not {table!r}')
-            # sa.text() provides backend-neutral :name for bind parameters
-            # NOTE: sa.text() caches queries => .bindparams() UPDATES previous bindparams. So:
-            #   If query = "SELECT * FROM table WHERE x=:x" and we bind with bindparam('x'),
-            #   we can NEVER bind with x as bindparam('x', expanding=True) without restarting.
-            #   Therefore, create a new query each time.
-            sql = sa.text(f'{query.rstrip().rstrip(";")}; -- {time.time()}')
-            all_params = {}
-            for key, vals in args.items():
-                conv, expanding = _argstype(argstype, key, str)
-                if expanding:
-                    all_params[key] = tuple(conv(val) for val in vals if val)
-                    sql = sql.bindparams(sa.bindparam(key, expanding=True))
-                elif len(vals) > 0:
-                    all_params[key] = conv(vals[0])
-            data = gramex.cache.query(sql, engine, state, params=all_params)
+            sql, all_params = _query_params(query, args, argstype)
+            # sql has a unique comment each time. Cache by the query instead
+            data = gramex.cache.query(sql, engine, state, state_ttl, key=query, params=all_params)
             data = transform(data) if callable(transform) else data
             # The query acts as base data. Now filter with additional parameters
             return _filter_frame(data, meta, controls, args, argstype)
         elif table:
             if callable(transform):
-                data = gramex.cache.query(table, engine, [table])
+                data = gramex.cache.query(table, engine, [table], state_ttl)
                 return _filter_frame(transform(data), meta, controls, args, argstype)
             else:
                 return _filter_db(engine, table, meta, controls, args, argstype)
@@ -498,17 +495,7 @@ def insert(
     if not args:
         raise ValueError('No args: specified')
     meta.update({'filters': [], 'ignored': [], 'inserted': []})
-    # If values do not have equal number of elements, pad them and warn
-    rowcount = max(len(val) for val in args.values())
-    for key, val in args.items():
-        rows = len(val)
-        if 0 < rows < rowcount:
-            val += [val[-1]] * (rowcount - rows)
-            app_log.warning(
-                f'data.insert: column {key} has {rows} rows not {rowcount}. '
-                f'Extended last value {val[-1]}'
-            )
-    rows = pd.DataFrame.from_dict(args)
+    rows = _insert_rows(args)
     url, table, ext, query, queryfile, kwargs = _replace(
         engine, args, url, table, ext, query, queryfile, **kwargs
     )
@@ -637,10 +624,20 @@ def get_engine(url: Union[str, pd.DataFrame]) -> str:
     for plugin_name in plugins:
         if url.startswith(f'{plugin_name}:'):
             return f'plugin+{plugin_name}'
+    engine = _url_engine(url)
+    # Don't cache dir / file. The path may be created or deleted later
+    if engine is None:
+        return 'dir' if os.path.isdir(url) else 'file'
+    return engine
+
+
+@lru_cache(maxsize=1000)
+def _url_engine(url: str) -> Union[str, None]:
+    '''Return 'sqlalchemy' or the protocol for a URL, or None if it's not a URL. Memoized'''
     try:
         url = sa.engine.url.make_url(url)
     except sa.exc.ArgumentError:
-        return 'dir' if os.path.isdir(url) else 'file'
+        return None
     try:
         url.get_driver_name()
         return 'sqlalchemy'
@@ -656,10 +653,55 @@ def create_engine(url: str, create: sa.engine.base.Engine = sa.create_engine, **
     *and* metadata *and* uses autoload=True. This makes sqlalchemy create a new
     database connection for every engine object, and not dispose it. So we
     re-use the engine objects within this module.
+
+    Engines are cached by `url` and `kwargs`. So connection pool options like `pool_size`,
+    `max_overflow`, `pool_pre_ping` and `pool_recycle` can be set per FormHandler. Up to
+    [ENGINE_CACHE_SIZE][] engines are cached. The least recently used engine is disposed first.
+    For example:
+
+        url:
+          data:
+            handler: FormHandler
+            kwargs:
+              url: postgresql://server/db
+              table: sales
+              pool_size: 20
+              max_overflow: 10
+              pool_pre_ping: true
     '''
-    if url not in _ENGINE_CACHE:
-        _ENGINE_CACHE[url] = create(url, **kwargs)
-    return _ENGINE_CACHE[url]
+    key = (url, repr(sorted(kwargs.items()))) if kwargs else url
+    with _ENGINE_LOCK:
+        engine = _ENGINE_CACHE.get(key, None)
+        if engine is not None:
+            _ENGINE_CACHE.move_to_end(key)
+            return engine
+        engine = _ENGINE_CACHE[key] = create(url, **kwargs)
+        while len(_ENGINE_CACHE) > ENGINE_CACHE_SIZE:
+            _key, old = _ENGINE_CACHE.popitem(last=False)
+            _METADATA_CACHE.pop(old, None)
+            # Close idle connections. Checked out connections close when returned to the pool.
+            # (Async engines dispose via a coroutine. Leave them to the garbage collector)
+            if isinstance(old, sa.engine.Engine):
+                old.dispose()
+    return engine
+
+
+def _reset_engines():
+    # A forked child (e.g. process: true schedules) must not share the parent's pooled DB
+    # connections, or wait on a lock held by a parent thread. Use a new lock and new pools
+    global _ENGINE_LOCK
+    _ENGINE_LOCK = threading.Lock()
+    for engine in list(_ENGINE_CACHE.values()):
+        # Async engines pool connections in their sync engine
+        engine = getattr(engine, 'sync_engine', engine)
+        if isinstance(engine, sa.engine.Engine):
+            # Like engine.dispose(close=False) in SQLAlchemy 1.4.33+: don't close the parent's
+            # connections. Just stop using them
+            engine.pool = engine.pool.recreate()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_engines)
 
 
 def get_table(engine: sa.engine.base.Engine, table: str, **kwargs: dict) -> sa.Table:
@@ -667,6 +709,9 @@ def get_table(engine: sa.engine.base.Engine, table: str, **kwargs: dict) -> sa.T
     if engine not in _METADATA_CACHE:
         _METADATA_CACHE[engine] = sa.MetaData(bind=engine)
     metadata = _METADATA_CACHE[engine]
+    # If the table is already loaded, return it. sa.Table() does the same, but slower
+    if not kwargs and table in metadata.tables:
+        return metadata.tables[table]
     if '.' in table:
         kwargs['schema'], table = table.rsplit('.', 1)
     return sa.Table(table, metadata, autoload=True, autoload_with=engine, **kwargs)
@@ -897,12 +942,18 @@ def download(
         return out.getvalue()
 
 
-def dirstat(url: str, timeout: int = 10, **kwargs: dict) -> pd.DataFrame:
+def dirstat(url: str, timeout: int = 10, watch: bool = False, **kwargs: dict) -> pd.DataFrame:
     '''Return a DataFrame with the list of all files & directories under the url.
 
+    Examples:
+        >>> gramex.data.dirstat('/path/to/dir')
+        >>> gramex.data.dirstat('dir:////root/dir/', timeout=None, watch=True)
+
     Parameters:
         url: path to a directory, or a URL like `dir:///c:/path/`, `dir:////root/dir/`
         timeout: max seconds to wait. `None` to wait forever
+        watch: if True, keep a snapshot of the directory, refreshed incrementally via the
+            [watcher service](https://gramener.com/gramex/guide/watch/)
 
     Raises:
         OSError: if url points to a missing location or is not a directory.
@@ -919,48 +970,179 @@ def dirstat(url: str, timeout: int = 10, **kwargs: dict) -> pd.DataFrame:
     - `size`: file size
     - `mtime`: last modified time in seconds since epoch
     - `level`: path depth (i.e. the number of paths in dir)
+
+    Sub-directories are scanned in parallel threads. Rows are in the same order as `os.walk`.
+    If the scan exceeds `timeout`, the partial result is returned.
+
+    With `watch=True`, the first call scans the directory and watches it for changes. Later calls
+    only re-scan directories that changed since the last call. Use this for large directories
+    that are queried often, e.g. via a FormHandler with `url: dir:///...` and `watch: true`.
+    The returned DataFrame is shared across calls. Do not modify it.
     '''
     target = url[7:] if url.startswith('dir:///') else url
     if not os.path.isdir(target):
         raise OSError(f'dirstat: {target} is not a directory')
     target = os.path.normpath(target)
-    result = []
-    start_time = time.time()
-    for dirpath, dirnames, filenames in os.walk(target):
-        if timeout and time.time() - start_time > timeout:
+    if not watch:
+        chunks = {}
+        _dirstat_walk(target, [target], timeout, chunks)
+        return _dirstat_frame(target, chunks)
+
+    snapshot = _DIRSTAT_SNAPSHOTS.get(target, None)
+    if snapshot is None:
+        snapshot = _DIRSTAT_SNAPSHOTS[target] = AttrDict(
+            lock=threading.Lock(), dirty_lock=threading.Lock(), dirty=set(), chunks={}, data=None
+        )
+    with snapshot.lock:
+        if snapshot.data is None:
+            # Watch BEFORE scanning, so that changes made during the scan are not lost
+            _dirstat_watch(target, snapshot)
+            if not _dirstat_walk(target, [target], timeout, snapshot.chunks):
+                data = _dirstat_frame(target, snapshot.chunks)
+                snapshot.chunks.clear()
+                return data
+        else:
+            with snapshot.dirty_lock:
+                dirty, snapshot.dirty = snapshot.dirty, set()
+            if not dirty:
+                return snapshot.data
+            if not _dirstat_refresh(target, dirty, timeout, snapshot.chunks):
+                data = _dirstat_frame(target, snapshot.chunks)
+                snapshot.chunks.clear()
+                snapshot.data = None
+                return data
+        snapshot.data = _dirstat_frame(target, snapshot.chunks)
+        return snapshot.data
+
+
+_DIRSTAT_COLUMNS = ('path', 'dir', 'name', 'type', 'size', 'mtime', 'level')
+# dirstat(watch=True) snapshots. {target: AttrDict(chunks={dirpath: (chunk, subdirs)}, ...)}
+_DIRSTAT_SNAPSHOTS = {}
+# Scan directories in a separate pool. Nesting in FormHandler's threadpool can deadlock
+_DIRSTAT_POOL = ThreadPoolExecutor(thread_name_prefix='dirstat')
+
+
+def _dirstat_dir(target: str, dirpath: str) -> Tuple[dict, List[str]]:
+    '''Return ({column: values}, [subdirs]) for the children of dirpath, or (None, [])'''
+    dirname = dirpath.replace(target, '').replace(os.sep, '/') + '/'
+    dirs, files, subdirs = [], [], []
+    try:
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                # Ignore files deleted during the scan, broken links, etc.
+                try:
+                    stat = entry.stat()
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                if is_dir:
+                    dirs.append((entry.path, entry.name, 'dir', stat))
+                    # Like os.walk(), list directory symlinks, but don't walk them
+                    if not entry.is_symlink():
+                        subdirs.append(entry.path)
+                else:
+                    files.append((entry.path, entry.name, os.path.splitext(entry.name)[-1], stat))
+    # Like os.walk(), ignore directories we can't read
+    except OSError:
+        return None, []
+    rows = dirs + files
+    chunk = {
+        'path': [row[0] for row in rows],
+        'dir': [dirname] * len(rows),
+        'name': [row[1] for row in rows],
+        'type': [row[2] for row in rows],
+        'size': [row[3].st_size for row in rows],
+        'mtime': [row[3].st_mtime for row in rows],
+        'level': [dirname.count('/')] * len(rows),
+    }
+    return chunk, subdirs
+
+
+def _dirstat_walk(target: str, dirpaths: List[str], timeout: float, chunks: dict) -> bool:
+    '''Scan dirpaths recursively in parallel into chunks. Return False on timeout'''
+    pool = _DIRSTAT_POOL
+    end_time = time.time() + timeout if timeout else None
+    pending = {pool.submit(_dirstat_dir, target, dirpath): dirpath for dirpath in dirpaths}
+    while pending:
+        remaining = None if end_time is None else end_time - time.time()
+        if remaining is not None and remaining <= 0:
             app_log.debug(f'dirstat: {target} timeout ({timeout:.1f}s)')
-            break
-        for name in dirnames:
-            path = os.path.join(dirpath, name)
-            stat = os.stat(path)
-            dirname = dirpath.replace(target, '').replace(os.sep, '/') + '/'
-            result.append(
-                {
-                    'path': path,
-                    'dir': dirname,
-                    'name': name,
-                    'type': 'dir',
-                    'size': stat.st_size,
-                    'mtime': stat.st_mtime,
-                    'level': dirname.count('/'),
-                }
-            )
-        for name in filenames:
-            path = os.path.join(dirpath, name)
-            stat = os.stat(path)
-            dirname = dirpath.replace(target, '').replace(os.sep, '/') + '/'
-            result.append(
-                {
-                    'path': path,
-                    'dir': dirname,
-                    'name': name,
-                    'type': os.path.splitext(name)[-1],
-                    'size': stat.st_size,
-                    'mtime': stat.st_mtime,
-                    'level': dirname.count('/'),
-                }
-            )
-    return pd.DataFrame(result)
+            for future in pending:
+                future.cancel()
+            return False
+        done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            dirpath = pending.pop(future)
+            chunk, subdirs = future.result()
+            if chunk is not None:
+                chunks[dirpath] = (chunk, subdirs)
+            for subdir in subdirs:
+                pending[pool.submit(_dirstat_dir, target, subdir)] = subdir
+    return True
+
+
+def _dirstat_frame(target: str, chunks: dict) -> pd.DataFrame:
+    '''Combine chunks into a DataFrame in os.walk() order, i.e. depth-first'''
+    columns = {col: [] for col in _DIRSTAT_COLUMNS}
+    stack = [target]
+    while stack:
+        dirpath = stack.pop()
+        # If the walk timed out, some directories may not have been scanned
+        if dirpath in chunks:
+            chunk, subdirs = chunks[dirpath]
+            for col, values in chunk.items():
+                columns[col].extend(values)
+            stack.extend(reversed(subdirs))
+    return pd.DataFrame(columns)
+
+
+def _dirstat_watch(target: str, snapshot: AttrDict) -> None:
+    '''Add the parent directory of every changed path under target to snapshot.dirty'''
+    from gramex.services import watcher
+
+    root = os.path.abspath(target)
+
+    def on_event(event):
+        # Ignore opened / closed events. Only these change dirstat()
+        if event.event_type not in {'created', 'deleted', 'modified', 'moved'}:
+            return
+        dirpaths = set()
+        for path in (event.src_path, getattr(event, 'dest_path', '')):
+            if path:
+                # Chunks are keyed by paths under target, which may be relative. Events have
+                # absolute paths. Convert them to target's form
+                dirpath = os.path.relpath(os.path.dirname(os.path.abspath(path)), root)
+                dirpaths.add(target if dirpath == os.curdir else os.path.join(target, dirpath))
+        with snapshot.dirty_lock:
+            snapshot.dirty.update(dirpaths)
+
+    watcher.watch(f'dirstat:{target}', [target], on_any_event=on_event)
+
+
+def _dirstat_refresh(target: str, dirty: set, timeout: float, chunks: dict) -> bool:
+    '''Re-scan only the dirty directories in chunks. Return False on timeout'''
+
+    def drop(dirpath):
+        prefix = os.path.join(dirpath, '')
+        for key in [key for key in chunks if key == dirpath or key.startswith(prefix)]:
+            del chunks[key]
+
+    # Sort to re-scan parents before children. New sub-directories are scanned via their parent
+    for dirpath in sorted(dirty):
+        if dirpath not in chunks:
+            continue
+        old_subdirs = set(chunks[dirpath][1])
+        chunk, subdirs = _dirstat_dir(target, dirpath)
+        if chunk is None:
+            drop(dirpath)
+            continue
+        chunks[dirpath] = (chunk, subdirs)
+        for subdir in old_subdirs - set(subdirs):
+            drop(subdir)
+        new_subdirs = [subdir for subdir in subdirs if subdir not in old_subdirs]
+        if not _dirstat_walk(target, new_subdirs, timeout, chunks):
+            return False
+    return True
 
 
 def filtercols(
@@ -1275,10 +1457,16 @@ def _transform_fn(transform, transform_kwargs):
 
 def _replace(engine, args, *vars, **kwargs):
     escape = _sql_safe if engine == 'sqlalchemy' else _path_safe
-    params = {k: v[0] for k, v in args.items() if len(v) > 0 and escape(v[0])}
+    params = None
 
     def _format(val):
+        nonlocal params
         if isinstance(val, str):
+            # Most strings have no {}. Skip formatting them, and computing params
+            if '{' not in val:
+                return val
+            if params is None:
+                params = {k: v[0] for k, v in args.items() if len(v) > 0 and escape(v[0])}
             return val.format(**params)
         if isinstance(val, list):
             return [_format(v) for v in val]
@@ -1286,7 +1474,42 @@ def _replace(engine, args, *vars, **kwargs):
             return AttrDict([(k, _format(v)) for k, v in val.items()])
         return val
 
-    return _format(list(vars)) + [_format(kwargs)]
+    # kwargs is only used as **kwargs. Return a dict, since creating an AttrDict is slow (~10us)
+    return _format(list(vars)) + [{k: _format(v) for k, v in kwargs.items()}]
+
+
+def _query_params(query: str, args: dict, argstype: Dict[str, dict]):
+    '''Return an `sa.text(query)` and its bind parameters from `args`'''
+    # sa.text() provides backend-neutral :name for bind parameters
+    # NOTE: sa.text() caches queries => .bindparams() UPDATES previous bindparams. So:
+    #   If query = "SELECT * FROM table WHERE x=:x" and we bind with bindparam('x'),
+    #   we can NEVER bind with x as bindparam('x', expanding=True) without restarting.
+    #   Therefore, create a new query each time.
+    sql = sa.text(f'{query.rstrip().rstrip(";")}; -- {time.time()}')
+    all_params = {}
+    for key, vals in args.items():
+        conv, expanding = _argstype(argstype, key, str)
+        if expanding:
+            all_params[key] = tuple(conv(val) for val in vals if val)
+            sql = sql.bindparams(sa.bindparam(key, expanding=True))
+        elif len(vals) > 0:
+            all_params[key] = conv(vals[0])
+    return sql, all_params
+
+
+def _insert_rows(args: dict) -> pd.DataFrame:
+    '''Convert insert `args` into a DataFrame of rows'''
+    # If values do not have equal number of elements, pad them and warn
+    rowcount = max(len(val) for val in args.values())
+    for key, val in args.items():
+        rows = len(val)
+        if 0 < rows < rowcount:
+            val += [val[-1]] * (rowcount - rows)
+            app_log.warning(
+                f'data.insert: column {key} has {rows} rows not {rowcount}. '
+                f'Extended last value {val[-1]}'
+            )
+    return pd.DataFrame.from_dict(args)
 
 
 def _pop_controls(args):
@@ -1704,6 +1927,33 @@ def _filter_db(
         id: list of keys specific to data using which values can be updated
     '''
     table = get_table(engine, table)
+    query = _filter_db_query(
+        table, engine.url.drivername, meta, controls, args, argstype, source, id
+    )
+    if query is None:
+        return pd.DataFrame()
+    if source in {'delete', 'update'}:
+        res = engine.execute(query)
+        return res.rowcount
+    return pd.read_sql(query, engine)
+
+
+def _filter_db_query(
+    table: sa.Table,
+    drivername: str,
+    meta: dict,
+    controls: dict,
+    args: dict,
+    argstype: Dict[str, dict] = {},
+    source: str = 'select',
+    id: List[str] = None,
+):
+    '''
+    Build the SQLAlchemy SELECT / UPDATE / DELETE statement for [_filter_db][].
+
+    Returns the statement, or `None` if the selection has no columns (i.e. an empty DataFrame).
+    This does not touch the database, so sync and async engines share it.
+    '''
     cols = table.columns
     colslist = cols.keys()
 
@@ -1743,80 +1993,369 @@ def _filter_db(
         else:
             meta['ignored'].append((key, vals))
     if source == 'delete':
-        res = engine.execute(query)
-        return res.rowcount
+        return query
     elif source == 'update':
-        query = query.values(cols_for_update)
-        res = engine.execute(query)
+        return query.values(cols_for_update)
+    # Apply controls
+    if '_by' in controls:
+        by = _filter_groupby_columns(controls['_by'], colslist, meta)
+        query = query.group_by(*by)
+        # If ?_c is not specified, use 'col|sum' for all numeric columns
+        # TODO: This does not support ?_c=-<col> to hide a column
+        col_list = controls.get('_c')
+        if col_list is None:
+            col_list = [
+                col + _agg_sep + 'sum'
+                for col, column in cols.items()
+                if column.type.python_type.__name__ in _numeric_types
+            ]
+        agg_cols = AttrDict([(col, cols[col]) for col in by])  # {label: ColumnElement}
+        typ = {}  # {label: python type}
+        for key in col_list:
+            col, agg, val = _filter_col(key, colslist)
+            if agg is not None:
+                # Convert aggregation into SQLAlchemy query
+                agg = agg.lower()
+                typ[key] = _agg_type.get(agg, cols[col].type.python_type)
+                agg_func = getattr(sa.sql.expression.func, agg)
+                agg_cols[key] = agg_func(cols[col]).label(key)
+        if not agg_cols:
+            return None
+        # SQLAlchemy 1.4+ only accepts positional arguments for .with_only_columns()
+        if version.parse(sa.__version__) >= version.parse('1.4'):
+            query = query.with_only_columns(*agg_cols.values())
+        # SQLAlchemy 1.3- only accepts a list for .with_only_columns()
+        else:
+            query = query.with_only_columns(agg_cols.values())
+        # Apply HAVING operators
+        for key, col, op, vals in cols_having:
+            query = _filter_db_col(
+                query, query.having, key, col, op, vals, agg_cols[col], typ[col], meta
+            )
+    elif '_c' in controls:
+        show_cols = _filter_select_columns(controls, colslist, meta)
+        query = query.with_only_columns([cols[col] for col in show_cols])
+        if len(show_cols) == 0:
+            return None
+    # SQLAlchemy 1.4+ deprecated SelectBase.columns in favor of SelectBase.selected_columns
+    try:
+        selected_columns = query.selected_columns
+    except AttributeError:
+        selected_columns = query.columns
+    sortable_columns = colslist + selected_columns.keys()
+    sorts = _filter_sort_columns(controls, sortable_columns, meta)
+    for col, asc in sorts:
+        orderby = sa.asc if asc else sa.desc
+        query = query.order_by(orderby(col))
+    offset, limit = _filter_offset_limit(controls, meta)
+    # MSSQL does not support OFFSET without ORDER BY. So sort by first column
+    if 'mssql' in drivername and (offset is not None or limit is not None) and not sorts:
+        query = query.order_by(sortable_columns[0])
+    if offset is not None:
+        query = query.offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+_VEGA_SCRIPT = os.path.join(_FOLDER, 'download.vega.js')
+
+
+# Async SQLAlchemy Operations
+# ----------------------------------------
+
+
+def is_async(url: Union[str, pd.DataFrame]) -> bool:
+    '''Return True if url is an SQLAlchemy URL with an asyncio driver.
+
+    Examples:
+        >>> gramex.data.is_async('sqlite+aiosqlite:///x.db')
+        True
+        >>> gramex.data.is_async('sqlite:///x.db')
+        False
+
+    Async drivers include `sqlite+aiosqlite`, `postgresql+asyncpg` and `mysql+aiomysql`.
+    '''
+    if not isinstance(url, str):
+        return False
+    try:
+        dialect = sa.engine.url.make_url(url).get_dialect()
+    except (sa.exc.ArgumentError, sa.exc.NoSuchModuleError):
+        return False
+    return bool(getattr(dialect, 'is_async', False))
+
+
+def _create_async_engine(url: str, **kwargs: dict):
+    # Import only when required. SQLAlchemy 1.3- does not have sqlalchemy.ext.asyncio
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    return create_async_engine(url, **kwargs)
+
+
+async def _get_table_async(engine, table: str) -> sa.Table:
+    '''Async version of [gramex.data.get_table][]. Reflects the table once per engine'''
+    if engine not in _METADATA_CACHE:
+        _METADATA_CACHE[engine] = sa.MetaData()
+    metadata = _METADATA_CACHE[engine]
+    schema = None
+    if '.' in table:
+        schema, table = table.rsplit('.', 1)
+    key = table if schema is None else f'{schema}.{table}'
+    if key not in metadata.tables:
+        async with engine.connect() as conn:
+            await conn.run_sync(
+                lambda sync_conn: sa.Table(table, metadata, schema=schema, autoload_with=sync_conn)
+            )
+    return metadata.tables[key]
+
+
+async def _read_sql_async(engine, query, params: dict = None) -> pd.DataFrame:
+    async with engine.connect() as conn:
+        result = await conn.execute(query, params)
+        return pd.DataFrame.from_records(
+            result.fetchall(), columns=list(result.keys()), coerce_float=True
+        )
+
+
+async def _filter_db_async(
+    engine,
+    table: str,
+    meta: dict,
+    controls: dict,
+    args: dict,
+    argstype: Dict[str, dict] = {},
+    source: str = 'select',
+    id: List[str] = None,
+):
+    '''Async version of [_filter_db][]. Uses the same statement builder'''
+    table = await _get_table_async(engine, table)
+    query = _filter_db_query(
+        table, engine.url.drivername, meta, controls, args, argstype, source, id
+    )
+    if query is None:
+        return pd.DataFrame()
+    if source in {'delete', 'update'}:
+        async with engine.begin() as conn:
+            res = await conn.execute(query)
         return res.rowcount
+    return await _read_sql_async(engine, query)
+
+
+def _async_engine(url: str, table: str, columns: dict, **kwargs: dict):
+    if not is_async(url):
+        raise ValueError(f'url: {url} is not an async SQLAlchemy URL')
+    if columns:
+        raise ValueError('columns: is not supported for async SQLAlchemy URLs')
+    return create_engine(url, create=_create_async_engine, **kwargs)
+
+
+async def filter_async(
+    url: str,
+    args: dict = {},
+    meta: dict = {},
+    engine: str = None,
+    table: str = None,
+    ext: str = None,
+    id: List[str] = None,
+    columns: Dict[str, Union[str, dict]] = None,
+    query: str = None,
+    queryfile: str = None,
+    transform: Callable = None,
+    transform_kwargs: dict = {},
+    argstype: Dict[str, dict] = {},
+    **kwargs: dict,
+) -> pd.DataFrame:
+    '''Async version of [gramex.data.filter][] for SQLAlchemy asyncio URLs.
+
+    Examples:
+        >>> data = await gramex.data.filter_async(
+        ...     'sqlite+aiosqlite:///x.db', table='sales', args=handler.args)
+
+    It accepts the same parameters as [gramex.data.filter][], and returns a DataFrame. But:
+
+    - `url` must use an async driver, e.g. `sqlite+aiosqlite://`, `postgresql+asyncpg://`,
+      `mysql+aiomysql://`. See [gramex.data.is_async][]
+    - The query runs on the IOLoop without using a thread. Connections are pooled by the engine.
+      Pool `kwargs` like `pool_size`, `max_overflow` are passed to `create_async_engine`
+    - `query:` results are not cached. `state:` and `state_ttl:` are ignored
+    - `columns:` is not supported
+
+    FormHandler uses this automatically when its `url:` has an async driver.
+    '''
+    meta.update(
+        {
+            'filters': [],  # Applied filters as [(col, op, val), ...]
+            'ignored': [],  # Ignored filters as [(col, vals), ...]
+            'sort': [],  # Sorted columns as [(col, asc), ...]
+            'offset': 0,  # Offset as integer
+            'limit': None,  # Limit as integer - None if not applied
+            'by': [],  # Group by columns as [col, ...]
+        }
+    )
+    args = dict(args)  # Do not modify the args -- keep a copy
+    controls = _pop_controls(args)
+    transform = _transform_fn(transform, transform_kwargs)
+    url, query, queryfile, table, kwargs = _replace(
+        'sqlalchemy', args, url, query, queryfile, table, **kwargs
+    )
+    kwargs.pop('state', None)
+    kwargs.pop('state_ttl', None)
+    engine = _async_engine(url, table, columns, **kwargs)
+    if query or queryfile:
+        if queryfile:
+            query = gramex.cache.open(queryfile, 'text')
+        sql, all_params = _query_params(query, args, argstype)
+        data = await _read_sql_async(engine, sql, all_params)
+        data = transform(data) if callable(transform) else data
+        return _filter_frame(data, meta, controls, args, argstype)
+    elif table:
+        if callable(transform):
+            data = await _read_sql_async(
+                engine, sa.select([await _get_table_async(engine, table)])
+            )
+            return _filter_frame(transform(data), meta, controls, args, argstype)
+        return await _filter_db_async(engine, table, meta, controls, args, argstype)
     else:
-        # Apply controls
-        if '_by' in controls:
-            by = _filter_groupby_columns(controls['_by'], colslist, meta)
-            query = query.group_by(*by)
-            # If ?_c is not specified, use 'col|sum' for all numeric columns
-            # TODO: This does not support ?_c=-<col> to hide a column
-            col_list = controls.get('_c')
-            if col_list is None:
-                col_list = [
-                    col + _agg_sep + 'sum'
-                    for col, column in cols.items()
-                    if column.type.python_type.__name__ in _numeric_types
-                ]
-            agg_cols = AttrDict([(col, cols[col]) for col in by])  # {label: ColumnElement}
-            typ = {}  # {label: python type}
-            for key in col_list:
-                col, agg, val = _filter_col(key, colslist)
-                if agg is not None:
-                    # Convert aggregation into SQLAlchemy query
-                    agg = agg.lower()
-                    typ[key] = _agg_type.get(agg, cols[col].type.python_type)
-                    agg_func = getattr(sa.sql.expression.func, agg)
-                    agg_cols[key] = agg_func(cols[col]).label(key)
-            if not agg_cols:
-                return pd.DataFrame()
-            # SQLAlchemy 1.4+ only accepts positional arguments for .with_only_columns()
-            if version.parse(sa.__version__) >= version.parse('1.4'):
-                query = query.with_only_columns(*agg_cols.values())
-            # SQLAlchemy 1.3- only accepts a list for .with_only_columns()
-            else:
-                query = query.with_only_columns(agg_cols.values())
-            # Apply HAVING operators
-            for key, col, op, vals in cols_having:
-                query = _filter_db_col(
-                    query, query.having, key, col, op, vals, agg_cols[col], typ[col], meta
-                )
-        elif '_c' in controls:
-            show_cols = _filter_select_columns(controls, colslist, meta)
-            query = query.with_only_columns([cols[col] for col in show_cols])
-            if len(show_cols) == 0:
-                return pd.DataFrame()
-        # SQLAlchemy 1.4+ deprecated SelectBase.columns in favor of SelectBase.selected_columns
-        try:
-            selected_columns = query.selected_columns
-        except AttributeError:
-            selected_columns = query.columns
-        sortable_columns = colslist + selected_columns.keys()
-        sorts = _filter_sort_columns(controls, sortable_columns, meta)
-        for col, asc in sorts:
-            orderby = sa.asc if asc else sa.desc
-            query = query.order_by(orderby(col))
-        offset, limit = _filter_offset_limit(controls, meta)
-        # MSSQL does not support OFFSET without ORDER BY. So sort by first column
-        if (
-            'mssql' in engine.url.drivername
-            and (offset is not None or limit is not None)
-            and not sorts
-        ):
-            query = query.order_by(sortable_columns[0])
-        if offset is not None:
-            query = query.offset(offset)
-        if limit is not None:
-            query = query.limit(limit)
-        return pd.read_sql(query, engine)
+        raise ValueError('No table: or query: specified')
 
 
-_VEGA_SCRIPT = os.path.join(_FOLDER, 'download.vega.js')
+async def delete_async(
+    url: str,
+    args: dict = {},
+    meta: dict = {},
+    engine: str = None,
+    table: str = None,
+    ext: str = None,
+    id: List[str] = None,
+    columns: Dict[str, Union[str, dict]] = None,
+    query: str = None,
+    queryfile: str = None,
+    transform: Callable = None,
+    transform_kwargs: dict = {},
+    argstype: Dict[str, dict] = {},
+    **kwargs: dict,
+) -> int:
+    '''Async version of [gramex.data.delete][] for SQLAlchemy asyncio URLs.
+
+    See [gramex.data.filter_async][]. Returns the number of deleted rows.
+    '''
+    meta.update({'filters': [], 'ignored': []})
+    args = dict(args)  # Do not modify the args -- keep a copy
+    controls = _pop_controls(args)
+    url, table, kwargs = _replace('sqlalchemy', args, url, table, **kwargs)
+    if table is None:
+        raise ValueError('No table: specified')
+    engine = _async_engine(url, table, columns, **kwargs)
+    return await _filter_db_async(
+        engine, table, meta, controls, args, argstype, source='delete', id=id
+    )
+
+
+async def update_async(
+    url: str,
+    args: dict = {},
+    meta: dict = {},
+    engine: str = None,
+    table: str = None,
+    ext: str = None,
+    id: List[str] = None,
+    columns: Dict[str, Union[str, dict]] = None,
+    query: str = None,
+    queryfile: str = None,
+    transform: Callable = None,
+    transform_kwargs: dict = {},
+    argstype: Dict[str, dict] = {},
+    **kwargs: dict,
+) -> int:
+    '''Async version of [gramex.data.update][] for SQLAlchemy asyncio URLs.
+
+    See [gramex.data.filter_async][]. Returns the number of updated rows.
+    '''
+    meta.update({'filters': [], 'ignored': []})
+    args = dict(args)  # Do not modify the args -- keep a copy
+    controls = _pop_controls(args)
+    url, table, kwargs = _replace('sqlalchemy', args, url, table, **kwargs)
+    if table is None:
+        raise ValueError('No table: specified')
+    engine = _async_engine(url, table, columns, **kwargs)
+    return await _filter_db_async(
+        engine, table, meta, controls, args, argstype, source='update', id=id
+    )
+
+
+async def insert_async(
+    url: str,
+    args: dict = {},
+    meta: dict = {},
+    engine: str = None,
+    table: str = None,
+    ext: str = None,
+    id: List[str] = None,
+    columns: Dict[str, Union[str, dict]] = None,
+    query: str = None,
+    queryfile: str = None,
+    transform: Callable = None,
+    transform_kwargs: dict = {},
+    argstype: Dict[str, dict] = {},
+    **kwargs: dict,
+) -> int:
+    '''Async version of [gramex.data.insert][] for SQLAlchemy asyncio URLs.
+
+    See [gramex.data.filter_async][]. Returns the number of inserted rows.
+
+    If the table does not exist, it is created with `id` as the primary key.
+    Values are converted to the column types, since async drivers like `asyncpg` are strict.
+    '''
+    args = dict(args)  # Do not modify the args -- keep a copy
+    _pop_controls(args)
+    if not args:
+        raise ValueError('No args: specified')
+    meta.update({'filters': [], 'ignored': [], 'inserted': []})
+    rows = _insert_rows(args)
+    url, table, kwargs = _replace('sqlalchemy', args, url, table, **kwargs)
+    if table is None:
+        raise ValueError('No table: specified')
+    engine = _async_engine(url, table, columns, **kwargs)
+    try:
+        sa_table = await _get_table_async(engine, table)
+    except sa.exc.NoSuchTableError:
+        # If the DB doesn't yet have the table, create it WITH THE PRIMARY KEYS.
+        name, schema = (table, None) if '.' not in table else table.rsplit('.', 1)[::-1]
+        async with engine.begin() as conn:
+            await conn.run_sync(
+                lambda sync_conn: sync_conn.execute(
+                    sa.text(
+                        pd.io.sql.get_schema(
+                            rows, name=name, keys=id, schema=schema, con=sync_conn
+                        )
+                    )
+                )
+            )
+        sa_table = await _get_table_async(engine, table)
+    rows = _pop_columns(rows, sa_table.columns.keys(), meta['ignored'])
+    data = rows.to_dict(orient='records')
+    for col in rows.columns:
+        try:
+            convert = _convertor(sa_table.columns[col].type.python_type)
+        except NotImplementedError:
+            continue
+        for row in data:
+            # If user passes ?col= with an empty string, replace with NULL
+            if row[col] == '':
+                row[col] = None
+            elif isinstance(row[col], str):
+                # If conversion fails, let the driver handle (or reject) the original value
+                try:
+                    row[col] = convert(row[col])
+                except (ValueError, TypeError):
+                    pass
+    async with engine.begin() as conn:
+        r = await conn.execute(sa_table.insert(), data)
+    id_cols = [col.name for col in sa_table.primary_key]
+    for row in getattr(r, 'inserted_primary_key_rows', []):
+        if row:
+            meta['inserted'].append(dict(zip(id_cols, row)))
+    return len(rows)
 
 
 # MongoDB Operations
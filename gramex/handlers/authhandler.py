@@ -12,6 +12,7 @@ from collections import Counter
 from orderedattrdict import AttrDict
 import gramex
 import gramex.cache
+import gramex.services
 from gramex.http import UNAUTHORIZED, FORBIDDEN
 from gramex.config import app_log, objectpath, merge, CustomJSONEncoder, CustomJSONDecoder
 from gramex.transforms import build_transform
@@ -116,7 +117,8 @@ class AuthHandler(BaseHandler):
         info = self.log_info(event)
         logging.getLogger('gramex.user').info(info)
         args = {key: [val] for key, val in self.user_log_info(event).items()}
-        gramex.data.insert(**gramex.service.storelocations.userlog, args=args)
+        # Write the log in the background, so that logins don't wait for it
+        gramex.services.storelocations_insert('userlog', args)
 
     @coroutine
     def prepare(self):
@@ -23,6 +23,7 @@ from gramex.transforms import build_transform, build_log_info, handler_expr, tim
 from gramex.transforms.template import CacheLoader
 from gramex.http import UNAUTHORIZED, FORBIDDEN, BAD_REQUEST, METHOD_NOT_ALLOWED, TOO_MANY_REQUESTS
 from gramex.cache import get_store
+from gramex.services.urlcache import write_cached
 
 # We don't use these, but these stores used to be defined here. Programs may import these
 from gramex.cache import KeyStore, JSONStore, HDF5Store, SQLiteStore, RedisStore  # noqa
@@ -339,16 +340,31 @@ class BaseMixin:
                 app_log.warning(f'Store key: {key} has value type {type(val)} (not dict)')
         return keys
 
+    @staticmethod
+    def _session_expire(session):
+        '''
+        Returns the time (seconds since epoch) after which the store can delete a session, i.e.
+        the expiry time _t, or a week after the session is inactive (like _purge_keys).
+        '''
+        expire = session.get('_t', 0)
+        if '_i' in session and '_l' in session:
+            expire = min(expire, session['_l'] + session['_i'] + 7 * 24 * 60 * 60)
+        return expire
+
     @classmethod
     def _get_store(cls, conf):
-        key = store_type, store_path = conf.get('type'), conf.get('path')
+        # prefix: namespaces keys, e.g. when sessions and ratelimits share a Redis DB
+        store_type, store_path, prefix = conf.get('type'), conf.get('path'), conf.get('prefix')
+        key = store_type, store_path, prefix
         if key not in _store_cache:
+            kwargs = {} if prefix is None else {'prefix': prefix}
             _store_cache[key] = get_store(
                 type=store_type,
                 path=store_path,
                 flush=conf.get('flush'),
                 purge=conf.get('purge'),
                 purge_keys=cls._purge_keys,
+                **kwargs,
             )
         return _store_cache[key]
 
@@ -361,6 +377,11 @@ class BaseMixin:
         cls.session = property(cls.get_session)
         cls._session_expiry = session_conf.get('expiry')
         cls._session_cookie_id = session_conf.get('cookie', 'sid')
+        # Update last visited time (_l) at most every `touch` seconds. This avoids a session
+        # write on every request when tracking inactive expiry
+        cls._session_touch = session_conf.get('touch', 0)
+        # lazy: true sets the session cookie only when the session has data, e.g. after login
+        cls._session_lazy = session_conf.get('lazy', False)
         cls._session_cookie = {
             key: session_conf[key]
             for key in ('httponly', 'secure', 'samesite', 'domain')
@@ -491,7 +512,7 @@ class BaseMixin:
         val = store.load(key, None)
         if val is not None and 'n' in val:
             val['n'] = value
-            store.dump(key, val)
+            store.dump(key, val, expire=val.get('_t'))
         else:
             return False
 
@@ -764,9 +785,7 @@ class BaseMixin:
     def _cached_get(self, *args, **kwargs):
         cached = self.cachefile.get()
         if cached is not None:
-            self.set_status(cached['status'])
-            self._write_headers(cached['headers'])
-            self.write(cached['body'])
+            write_cached(self, cached)
         else:
             self.cachefile.wrap(self)
             yield self.original_get(*args, **kwargs)
@@ -825,8 +844,12 @@ class BaseMixin:
         '''
         raise NotImplementedError('Specify a session: section in gramex.yaml')
 
-    def _set_new_session_id(self, expires_days):
-        '''Sets a new random session ID as the sid: cookie. Returns a bytes object'''
+    def _set_new_session_id(self, expires_days, lazy=False):
+        '''Sets a new random session ID as the sid: cookie. Returns a bytes object.
+
+        If `lazy` is True, the cookie is set just before the response is sent, and only if the
+        session has data.
+        '''
         session_id = b2a_base64(os.urandom(24))[:-1]
         kwargs = dict(self._session_cookie)
         kwargs['expires_days'] = expires_days
@@ -836,9 +859,12 @@ class BaseMixin:
         # Use Secure cookies on HTTPS to prevent leakage into HTTP
         if self.request.protocol == 'https':
             kwargs['secure'] = True
-        # Websockets cannot set cookies. They raise a RuntimeError. Ignore those.
-        with contextlib.suppress(RuntimeError):
-            self.set_secure_cookie(self._session_cookie_id, session_id, **kwargs)
+        if lazy:
+            self._session_cookie_pending = (session_id, kwargs)
+        else:
+            # Websockets cannot set cookies. They raise a RuntimeError. Ignore those.
+            with contextlib.suppress(RuntimeError):
+                self.set_secure_cookie(self._session_cookie_id, session_id, **kwargs)
         # Warn if app.session.domain is x.com but request comes from y.com.
         host = self.request.host_name
         if (
@@ -888,7 +914,7 @@ class BaseMixin:
             session_id = self.get_secure_cookie(self._session_cookie_id, max_age_days=9999999)
             # If there's no session id cookie "sid", create a random 32-char cookie
             if session_id is None:
-                session_id = self._set_new_session_id(expires_days)
+                session_id = self._set_new_session_id(expires_days, lazy=self._session_lazy)
                 created_new_sid = True
             # Convert bytes session to unicode before using
             session_id = session_id.decode('ascii')
@@ -896,6 +922,9 @@ class BaseMixin:
             self._session = self._session_store.load(session_id, {'_t': store_expires})
             # Overwrite id to the session ID even if a handler has changed it
             self._session['id'] = session_id
+            # save_session() saves only if the session has changed since it was loaded.
+            # So new sessions are not saved until they have data, e.g. a user logs in.
+            self._session_saved = self._session_key()
         # At this point, the "sid" cookie and self._session exist and are synced
         s = self._session
         old_sid = s['id']
@@ -908,14 +937,28 @@ class BaseMixin:
             # Update expiry and new SID on session
             s.update(id=new_sid, _t=store_expires)
             # Delete old contents. No _t also means expired
-            self._session_store.dump(old_sid, {})
+            self._session_store.dump(old_sid, {}, expire=0)
 
         return s
 
+    def _session_key(self):
+        # Return a snapshot of the session to check if it has changed, or None if it's not JSON
+        try:
+            return gramex.cache.cache_key(self._session)
+        except (TypeError, ValueError):
+            return None
+
     def save_session(self):
-        '''Persist the session object as a JSON'''
+        '''Persist the session object as a JSON, if it has changed since it was loaded'''
         if getattr(self, '_session', None) is not None:
-            self._session_store.dump(self._session['id'], self._session)
+            # Compare the entire session (not just top-level keys) since handlers may modify
+            # nested values, e.g. handler.session['user']['role'] = 'admin'
+            saved = getattr(self, '_session_saved', None)
+            if saved is None or saved != self._session_key():
+                self._session_store.dump(
+                    self._session['id'], self._session, expire=self._session_expire(self._session)
+                )
+                self._session_saved = self._session_key()
 
     def otp(
         self,
@@ -1076,6 +1119,9 @@ class BaseMixin:
         - `session._l` is the last time the user accessed a page.
         - `session._i` is the seconds of inactivity after which the session expires.
         - If `session._i` is set (we track inactive expiry), we set `session._l` to now.
+
+        To reduce session writes, `session._l` is updated only if it's older than
+        `app.session.touch` seconds, or 10% of `session._i`, whichever is lower.
         '''
         # Called by BaseHandler.prepare() when any user accesses a page.
         # For efficiency reasons, don't call get_session every time. Check
@@ -1083,7 +1129,10 @@ class BaseMixin:
         if self.get_secure_cookie(self._session_cookie_id, max_age_days=9999999):
             session = self.get_session()
             if '_i' in session:
-                session['_l'] = time.time()
+                now = time.time()
+                touch = min(self._session_touch, session['_i'] / 10)
+                if now - session.get('_l', 0) >= touch:
+                    session['_l'] = now
 
     def check_ratelimit(self):
         '''Raise HTTP 429 if usage exceeds rate limit. Set X-Ratelimit-* HTTP headers'''
@@ -1130,7 +1179,7 @@ class BaseMixin:
             usage_obj = ratelimit.store.load(ratelimit.key, {'n': 0})
             usage_obj['n'] += 1
             usage_obj['_t'] = time.time() + ratelimit.expiry
-            ratelimit.store.dump(ratelimit.key, usage_obj)
+            ratelimit.store.dump(ratelimit.key, usage_obj, expire=usage_obj['_t'])
 
     def get_ratelimit(self):
         '''Get the rate limit with the least remaining usage for the current request.
@@ -1288,6 +1337,16 @@ class BaseHandler(RequestHandler, BaseMixin):
         headers += list(objectpath(conf, 'handlers.BaseHandler.headers', {}).items())
         self._write_headers(headers)
 
+    def flush(self, include_footers=False):
+        # If app.session.lazy is true, set the new session cookie before sending headers, but
+        # only if the session has data. Data added after the first flush() won't set a cookie.
+        pending = getattr(self, '_session_cookie_pending', None)
+        if pending is not None and not self._headers_written:
+            self._session_cookie_pending = None
+            if set(self._session) - {'id', '_t'}:
+                self.set_secure_cookie(self._session_cookie_id, pending[0], **pending[1])
+        return super(BaseHandler, self).flush(include_footers)
+
     def on_finish(self):
         # Loop through class-level callbacks
         for callback in self._on_finish_methods:
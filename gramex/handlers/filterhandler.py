@@ -3,5 +3,8 @@ from .formhandler import FormHandler
 
 
 class FilterHandler(FormHandler):
+    # filtercols has no async version. Always run it in a thread
+    data_filter_method_async = None
+
     def data_filter_method(self, *args, **kwargs):
         return gramex.data.filtercols(*args, **kwargs)
@@ -43,9 +43,19 @@ class FormHandler(BaseHandler):
         'state': {'args': None, 'key': None, 'handler': None},
     }
 
+    # Async versions of gramex.data methods, used if the url: has an async SQLAlchemy driver
+    async_methods = {
+        gramex.data.insert: gramex.data.insert_async,
+        gramex.data.update: gramex.data.update_async,
+        gramex.data.delete: gramex.data.delete_async,
+    }
+
     def data_filter_method(self, *args, **kwargs):
         return gramex.data.filter(*args, **kwargs)
 
+    def data_filter_method_async(self, *args, **kwargs):
+        return gramex.data.filter_async(*args, **kwargs)
+
     @classmethod
     def setup(cls, **kwargs):
         super(FormHandler, cls).setup(**kwargs)
@@ -155,10 +165,17 @@ class FormHandler(BaseHandler):
         for key, dataset in self.datasets.items():
             meta[key] = AttrDict()
             opt = self._options(dataset, self.args, path_args, path_kwargs, key)
-            # Run query in a separate threadthread
-            futures[key] = gramex.service.threadpool.submit(
-                self.data_filter_method, args=opt.args, meta=meta[key], **opt.filter_kwargs
-            )
+            # Async SQLAlchemy URLs run on the IOLoop. Others run in a separate thread
+            if self.data_filter_method_async is not None and gramex.data.is_async(dataset['url']):
+                futures[key] = tornado.gen.convert_yielded(
+                    self.data_filter_method_async(
+                        args=opt.args, meta=meta[key], **opt.filter_kwargs
+                    )
+                )
+            else:
+                futures[key] = gramex.service.threadpool.submit(
+                    self.data_filter_method, args=opt.args, meta=meta[key], **opt.filter_kwargs
+                )
             # gramex.data.filter() should set the schema only on first load. Pop it once done
             dataset.pop('schema', None)
         self.pre_modify()
@@ -227,7 +244,12 @@ class FormHandler(BaseHandler):
                     f'{self.name}: missing column(s) in URL query: ' + ', '.join(missing_args),
                 )
             # Execute the query. This returns the count of records updated
-            result[key] = method(meta=meta[key], args=opt.args, **opt.filter_kwargs)
+            if method in self.async_methods and gramex.data.is_async(dataset['url']):
+                result[key] = yield self.async_methods[method](
+                    meta=meta[key], args=opt.args, **opt.filter_kwargs
+                )
+            else:
+                result[key] = method(meta=meta[key], args=opt.args, **opt.filter_kwargs)
             # method() should set the schema only on first load. Pop it once done
             dataset.pop('schema', None)
         self.pre_modify()
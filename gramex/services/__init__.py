@@ -21,12 +21,18 @@ import signal
 import socket
 import logging
 import datetime
+import functools
 import posixpath
 import mimetypes
 import threading
 import webbrowser
+import multiprocessing
 import tornado.web
 import tornado.ioloop
+import tornado.netutil
+import tornado.process
+import tornado.routing
+import tornado.httpserver
 import gramex.data
 import gramex.cache
 import gramex.license
@@ -39,9 +45,11 @@ from orderedattrdict import AttrDict
 from gramex import console, debug, shutdown, __version__
 from gramex.transforms import build_transform
 from gramex.config import locate, app_log, ioloop_running, app_log_extra, merge, walk
+from gramex.config import QueueHandler
 from gramex.cache import urlfetch, cache_key
 from gramex.http import OK, NOT_MODIFIED
 from . import urlcache
+from .urlrouter import URLRouter
 from .ttlcache import MAXTTL
 from .emailer import SMTPMailer
 from .sms import AmazonSNS, Exotel, Twilio
@@ -54,6 +62,8 @@ info = AttrDict(
     cache=AttrDict(),
     # Initialise with a single worker by default. threadpool.workers overrides this
     threadpool=concurrent.futures.ThreadPoolExecutor(1),
+    # Process pool for schedules and alerts with process: true. Set by the processpool: service
+    processpool=None,
     eventlog=AttrDict(),
     email=AttrDict(),
     sms=AttrDict(),
@@ -61,6 +71,9 @@ info = AttrDict(
     url=AttrDict(),
     main_ioloop=None,
     storelocations=AttrDict(),
+    # With app.listen.processes, the sockets workers share, and the parent process ID
+    sockets=None,
+    ppid=None,
     _md=None,
 )
 _cache, _tmpl_cache = AttrDict(), AttrDict()
@@ -89,10 +102,29 @@ def log(conf: dict) -> None:
                         os.makedirs(folder)
                     except OSError:
                         app_log.exception(f'log: {handler}: cannot create folder {folder}')
+    # handlers with a queue: true or queue: {batch: ..., interval: ...} write via a background
+    # thread. Remove the key before dictConfig(), and wrap these handlers after
+    queues = {}
+    handlers = {}
+    for name, handler_conf in conf.get('handlers', {}).items():
+        queue = handler_conf.get('queue', False)
+        if queue:
+            queues[name] = queue if isinstance(queue, dict) else {}
+        handlers[name] = {key: val for key, val in handler_conf.items() if key != 'queue'}
+    conf = dict(conf, handlers=handlers)
     try:
         logging.config.dictConfig(conf)
     except (ValueError, TypeError, AttributeError, ImportError):
         app_log.exception('Error in log: configuration')
+        return
+    wrapped = {}
+    loggers = [logging.getLogger()] + [logging.getLogger(name) for name in conf.get('loggers', {})]
+    for logger in loggers:
+        for index, handler in enumerate(logger.handlers):
+            if handler.name in queues:
+                if handler.name not in wrapped:
+                    wrapped[handler.name] = QueueHandler(handler, **queues[handler.name])
+                logger.handlers[index] = wrapped[handler.name]
 
 
 def app(conf: dict) -> None:
@@ -102,14 +134,17 @@ def app(conf: dict) -> None:
         app_log.warning('Ignoring app config change when running')
     else:
         info.app = GramexApp(**conf.settings)
-        try:
-            info.app.listen(**conf.listen)
-        except socket.error as e:
-            port_used_codes = {'windows': 10048, 'linux': 98}
-            if e.errno not in port_used_codes.values():
-                raise
-            logging.error(f'Port {conf.listen.port} is busy. Use --listen.port=<new-port>')
-            sys.exit(1)
+        listen = {key: val for key, val in conf.listen.items() if key != 'processes'}
+        # If fork() has bound the sockets, serve them. Else bind and serve conf.listen.port
+        if info.sockets:
+            kwargs = {key: val for key, val in listen.items() if key not in _bind_keys}
+            server = tornado.httpserver.HTTPServer(info.app, **kwargs)
+            server.add_sockets(info.sockets)
+        else:
+            try:
+                info.app.listen(**listen)
+            except socket.error as e:
+                _port_error(e, conf.listen.port)
 
         def callback():
             '''Called after all services are started. Opens browser if required'''
@@ -124,14 +159,21 @@ def app(conf: dict) -> None:
             except ImportError:
                 pass
 
-            app_log.info(f'Listening on port {conf.listen.port}')
+            worker = tornado.process.task_id()
+            if worker is None:
+                app_log.info(f'Listening on port {conf.listen.port}')
+            else:
+                app_log.info(
+                    f'Worker {worker} (pid {os.getpid()}) listening on {conf.listen.port}'
+                )
             app_log_extra['port'] = conf.listen.port
             msg = f'Gramex {__version__} listening on http://127.0.0.1:{conf.listen.port}/. '
 
             # browser: True opens the application home page on localhost.
             # browser: url opens the application to a specific URL
             url = f'http://127.0.0.1:{conf.listen.port}/'
-            if conf.browser:
+            # With app.listen.processes, only the first worker opens the browser
+            if conf.browser and not worker:
                 if isinstance(conf.browser, str):
                     url = urljoin(url, conf.browser)
                 try:
@@ -143,7 +185,8 @@ def app(conf: dict) -> None:
             else:
                 msg += '<Ctrl-B> opens browser, <Ctrl-D> starts debugger'
 
-            console(msg)
+            if not worker:
+                console(msg)
 
             # Ensure that we call shutdown() on Ctrl-C.
             # On Windows, Tornado does not exit on Ctrl-C. This also fixes that.
@@ -161,6 +204,12 @@ def app(conf: dict) -> None:
                 def check_exit():
                     if exit[0] is True:
                         shutdown()
+                    # If the parent process of a worker exits (e.g. is killed), stop the worker
+                    if info.ppid is not None and os.getppid() != info.ppid:
+                        shutdown()
+                    # Only the first worker reads the console
+                    if worker:
+                        return
                     # If Ctrl-D is pressed, run the Python debugger
                     char = debug.getch()
                     if char == b'\x04':
@@ -189,12 +238,62 @@ def app(conf: dict) -> None:
         return callback
 
 
+def fork(conf: dict) -> None:
+    '''Bind to `app.listen.port` and fork `app.listen.processes` worker processes that serve it.
+
+    `gramex.init()` calls this with the `app:` config before starting other services. If
+    `listen.processes` is 1 (the default), it does nothing. If it's 0, it forks one per CPU.
+
+    The parent process only restarts workers that crash, and exits when all workers exit. Ctrl-C
+    stops all workers. Only the first worker runs schedules and alerts, and reads the console.
+
+    Each worker has its own memory caches, sessions, etc. To share these, use `redis` or `disk`
+    caches, and `redis` or `sqlite` session stores.
+    '''
+    listen = conf.get('listen', {})
+    processes = listen.get('processes', 1)
+    if processes == 1 or info.sockets is not None or info.app is not None:
+        return
+    if not hasattr(os, 'fork'):
+        app_log.warning(f'app.listen.processes: {processes} ignored. This OS cannot fork')
+        return
+    for key in ('session', 'ratelimit'):
+        store = conf.get(key) or {}
+        if store.get('type') not in {'redis', 'sqlite', None}:
+            app_log.warning(f'app.{key}.type: {store["type"]} is not shared across processes')
+    try:
+        info.sockets = tornado.netutil.bind_sockets(
+            **{key: val for key, val in listen.items() if key in _bind_keys}
+        )
+    except socket.error as e:
+        _port_error(e, listen.port)
+    # Ctrl-C stops the workers. The parent ignores it, and exits when the workers exit
+    ppid, sigint = os.getpid(), signal.signal(signal.SIGINT, signal.SIG_IGN)
+    tornado.process.fork_processes(processes)
+    signal.signal(signal.SIGINT, sigint)
+    info.ppid = ppid
+
+
+_bind_keys = {'port', 'address', 'family', 'backlog', 'flags', 'reuse_port'}
+
+
+def _port_error(e: OSError, port: int) -> None:
+    port_used_codes = {'windows': 10048, 'linux': 98}
+    if e.errno not in port_used_codes.values():
+        raise e
+    logging.error(f'Port {port} is busy. Use --listen.port=<new-port>')
+    sys.exit(1)
+
+
 def schedule(conf: dict) -> None:
     '''Set up the Gramex scheduler'''
     # Create tasks running on ioloop for the given schedule, store it in info.schedule
     from . import scheduler
 
     _stop_all_tasks(info.schedule)
+    # With app.listen.processes, only the first worker runs schedules
+    if tornado.process.task_id():
+        return
     for name, sched in conf.items():
         _key = cache_key('schedule', sched)
         if _key in _cache:
@@ -203,7 +302,9 @@ def schedule(conf: dict) -> None:
             continue
         try:
             app_log.info(f'Initialising schedule:{name}')
-            _cache[_key] = scheduler.Task(name, sched, info.threadpool, ioloop=info.main_ioloop)
+            _cache[_key] = scheduler.Task(
+                name, sched, info.threadpool, ioloop=info.main_ioloop, processpool=_processpool
+            )
             info.schedule[name] = _cache[_key]
         except Exception as e:
             app_log.exception(e)
@@ -216,7 +317,11 @@ def alert(conf: dict) -> None:
     from . import scheduler
 
     _stop_all_tasks(info.alert)
+    # With app.listen.processes, only the first worker runs alerts
+    if tornado.process.task_id():
+        return
     schedule_keys = ['minutes', 'hours', 'dates', 'months', 'weekdays', 'years', 'startup', 'utc']
+    schedule_keys += ['overlap', 'max_instances', 'lock']
 
     for name, alert in conf.items():
         _key = cache_key('alert', alert)
@@ -229,16 +334,52 @@ def alert(conf: dict) -> None:
         if 'thread' in alert:
             schedule['thread'] = alert['thread']
         schedule['function'] = create_alert(name, alert)
+        # With process: true, the alert is re-created in the process pool worker. Pass a
+        # function that can be pickled, not the alert function
+        if schedule['function'] is not None and alert.get('process'):
+            schedule['process'], schedule['timeout'] = True, alert.get('timeout')
+            schedule['function'] = functools.partial(_run_alert, name, alert)
         if schedule['function'] is not None:
             try:
                 _cache[_key] = scheduler.Task(
-                    name, schedule, info.threadpool, ioloop=info.main_ioloop
+                    name,
+                    schedule,
+                    info.threadpool,
+                    ioloop=info.main_ioloop,
+                    processpool=_processpool,
                 )
                 info.alert[name] = _cache[_key]
             except Exception:
                 app_log.exception(f'Failed to initialize alert: {name}')
 
 
+def _run_alert(name: str, alert: dict, **kwargs):
+    '''Create and run an alert. Used by alerts that run in the process pool'''
+    return create_alert(name, alert)(**kwargs)
+
+
+def processpool(conf: dict) -> None:
+    '''Set up a global process pool executor for schedules and alerts with `process: true`'''
+    # By default, use a single worker. If a different value is specified, use it
+    workers = 1
+    if conf and hasattr(conf, 'get'):
+        workers = conf.get('workers', workers)
+    # Running tasks complete in the old pool. New tasks use the new pool via _processpool()
+    if info.processpool is not None:
+        info.processpool.shutdown(wait=False)
+    else:
+        atexit.register(lambda: info.processpool.shutdown())
+    # Fork workers where possible, so that they inherit Gramex's configuration and services
+    fork = 'fork' in multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if fork else None)
+    info.processpool = concurrent.futures.ProcessPoolExecutor(workers, mp_context=context)
+
+
+def _processpool() -> concurrent.futures.ProcessPoolExecutor:
+    # Tasks with process: true use the current process pool, even if processpool: is reconfigured
+    return info.processpool
+
+
 def threadpool(conf: dict) -> None:
     '''Set up a global threadpool executor'''
     # By default, use a single worker. If a different value is specified, use it
@@ -383,7 +524,11 @@ def cache(conf: dict) -> None:
         config = merge(dict(config), _cache_defaults[cache_type], mode='setdefault')
         if cache_type == 'memory':
             info.cache[name] = urlcache.MemoryCache(
-                maxsize=config['size'], getsizeof=gramex.cache.sizeof
+                maxsize=config['size'],
+                getsizeof=gramex.cache.sizeof,
+                admission=config.get('admission', False),
+                maxentry=config.get('max_entry'),
+                quota=config.get('quota'),
             )
         elif cache_type == 'disk':
             path = config.get('path', '.cache-' + name)
@@ -414,38 +559,91 @@ def cache(conf: dict) -> None:
 
 def eventlog(conf: dict) -> None:
     '''Set up the application event logger'''
-    if not conf.path:
+    # Reloading the config re-runs this. Keep the event log if the path is unchanged. Else close it
+    path = os.path.abspath(conf.path) if conf.get('path') else None
+    if info.eventlog.get('path') == path:
+        return
+    if 'close' in info.eventlog:
+        info.eventlog.close()
+        info.eventlog.clear()
+    if not path:
         return
 
     import time
+    import queue
     import sqlite3
 
-    folder = os.path.dirname(os.path.abspath(conf.path))
+    folder = os.path.dirname(path)
     if not os.path.exists(folder):
         os.makedirs(folder)
 
-    def query(q, *args, **kwargs):
-        conn = sqlite3.connect(conf.path, check_same_thread=False)
+    def connect():
+        conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
         conn.row_factory = sqlite3.Row
-        result = list(conn.execute(q, *args, **kwargs))
-        conn.commit()
-        conn.close()
+        # WAL lets queries read while the writer thread writes
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    # add() queues events. A writer thread inserts all queued events in a single transaction.
+    # query() runs on a separate connection, after queued events are written
+    events = queue.Queue()
+    read_conn, read_lock = connect(), threading.Lock()
+
+    def write():
+        conn = connect()
+        while True:
+            rows = [events.get()]
+            while not events.empty():
+                rows.append(events.get())
+            # close() queues None to stop the writer
+            count, stop = len(rows), None in rows
+            rows = [row for row in rows if row is not None]
+            try:
+                with conn:
+                    conn.executemany('INSERT INTO events VALUES (?, ?, ?)', rows)
+            except sqlite3.Error:
+                app_log.exception(f'eventlog: cannot write {len(rows)} events')
+            for _index in range(count):
+                events.task_done()
+            if stop:
+                return conn.close()
+
+    def query(q, *args, **kwargs):
+        events.join()
+        with read_lock:
+            result = list(read_conn.execute(q, *args, **kwargs))
+            read_conn.commit()
         return result
 
     def add(event_name, data):
         '''Write a message into the application event log'''
         data = json.dumps(data, ensure_ascii=True, separators=(',', ':'))
-        query('INSERT INTO events VALUES (?, ?, ?)', [time.time(), event_name, data])
+        events.put((time.time(), event_name, data))
 
     def shutdown():
         add('shutdown', {'version': __version__, 'pid': os.getpid()})
+        events.join()
         # Don't conn.close() here. gramex.gramex_update() runs in a thread. If we start and
         # stop gramex quickly, allow gramex_update to add too this entry
 
-    info.eventlog.query = query
-    info.eventlog.add = add
+    def close():
+        '''Write queued events, stop the writer thread and close the connections'''
+        atexit.unregister(shutdown)
+        events.join()
+        events.put(None)
+        writer.join()
+        with read_lock:
+            read_conn.close()
+
+    writer = threading.Thread(target=write, name='eventlog', daemon=True)
+    info.eventlog.update(path=path, query=query, add=add, close=close)
 
     query('CREATE TABLE IF NOT EXISTS events (time REAL, event TEXT, data TEXT)')
+    # gramex_update() filters by event and time. Keep these fast as events grow
+    query('CREATE INDEX IF NOT EXISTS events_event_time ON events (event, time)')
+    query('CREATE INDEX IF NOT EXISTS events_time ON events (time)')
+    writer.start()
     add(
         'startup',
         {'version': __version__, 'pid': os.getpid(), 'args': sys.argv, 'cwd': os.getcwd()},
@@ -508,6 +706,7 @@ def test(conf: dict) -> None:
 def gramexlog(conf: dict) -> None:
     '''Set up gramexlog service'''
     from gramex.transforms import build_log_info
+    from .logqueue import LogQueue
 
     try:
         from elasticsearch7 import Elasticsearch, helpers
@@ -515,40 +714,55 @@ def gramexlog(conf: dict) -> None:
         app_log.error('gramexlog: elasticsearch7 missing. pip install elasticsearch7')
         return
 
-    # We call push() every 'flush' seconds on the main IOLoop. Defaults to every 5 seconds
+    # A background thread pushes logs every 'flush' seconds. Defaults to every 5 seconds
     flush = conf.pop('flush', 5)
-    ioloop = info.main_ioloop or tornado.ioloop.IOLoop.current()
     # Set the defaultapp to the first config key under gramexlog:
     if conf:
         info.gramexlog.defaultapp = next(iter(conf.keys()))
     for app, app_conf in conf.items():
+        # Stop the previous queue for this app. Re-queue its pending logs in the new queue
+        old = info.gramexlog.apps.get(app, {}).get('queue', None)
         app_config = info.gramexlog.apps[app] = AttrDict()
-        app_config.queue = []
         keys = app_conf.pop('keys', [])
         # If user specifies keys: [port, args.x, ...], these are captured as additional keys.
         # The keys use same spec as Gramex logging.
         app_config.extra_keys = build_log_info(keys)
+        app_config.index = app_conf.pop('index', app)
+        queue_conf = {
+            key: app_conf.pop(key)
+            for key in ('maxsize', 'batch', 'spill', 'backoff', 'max_backoff')
+            if key in app_conf
+        }
+        if 'spill' in queue_conf:
+            queue_conf['spill'] = os.path.abspath(queue_conf['spill'])
+            os.makedirs(os.path.dirname(queue_conf['spill']), exist_ok=True)
         # Ensure all gramexlog keys are popped from app_conf, leaving only Elasticsearch keys
         app_config.conn = Elasticsearch(**app_conf)
 
-    def push():
-        for app, app_config in info.gramexlog.apps.items():
-            for item in app_config.queue:
-                item['_index'] = app_config.get('index', app)
-            try:
-                helpers.bulk(app_config.conn, app_config.queue)
-                app_config.queue.clear()
-            except Exception:
-                # TODO: If the connection broke, re-create it
-                # This generic exception should be caught for thread to continue its execution
-                app_log.exception(f'gramexlog: push to {app} failed')
-        if 'handle' in info.gramexlog:
-            ioloop.remove_timeout(info.gramexlog.handle)
-        # Call again after flush seconds
-        info.gramexlog.handle = ioloop.call_later(flush, push)
-
-    info.gramexlog.handle = ioloop.call_later(flush, push)
+        def send(docs, conn=app_config.conn, index=app_config.index):
+            for doc in docs:
+                doc['_index'] = index
+            # Connection errors raise an exception, and are retried. Invalid docs are not
+            success, errors = helpers.bulk(conn, docs, raise_on_error=False)
+            return len(errors)
+
+        app_config.queue = LogQueue(app, send, flush=flush, **queue_conf)
+        atexit.register(app_config.queue.close, 5)
+        if old is not None:
+            app_config.queue.extend(old.clear())
+            old.close(timeout=0)
+
+    def push(timeout=10):
+        '''Push all queued logs now. Wait up to timeout seconds'''
+        for app_config in info.gramexlog.apps.values():
+            app_config.queue.push(timeout)
+
+    def stats():
+        '''Return {app: {queued: ..., sent: ..., dropped: ...}} for each gramexlog app'''
+        return {app: app_config.queue.stats() for app, app_config in info.gramexlog.apps.items()}
+
     info.gramexlog.push = push
+    info.gramexlog.stats = stats
 
 
 def storelocations(conf: dict) -> None:
@@ -566,6 +780,76 @@ def storelocations(conf: dict) -> None:
         gramex.data.alter(**subconf)
 
 
+# storelocations_insert() queues rows here as {(location, repr(kwargs)): [kwargs, [args, ...]]}.
+# storelocations_flush() inserts them into each location in a single gramex.data.insert() per
+# distinct kwargs
+STORELOCATIONS_FLUSH = 1  # Flush queued rows these many seconds after the first row is queued
+_storelocations_rows = {}
+_storelocations_lock, _storelocations_flush_lock = threading.Lock(), threading.Lock()
+
+
+def storelocations_insert(location: str, args: dict, **kwargs) -> None:
+    '''Queue rows to insert into a store location, e.g. audit logs. Returns immediately.
+
+    Examples:
+        >>> storelocations_insert('userlog', {'event': ['login'], 'user': ['alpha']})
+
+    Parameters:
+        location: key in [gramex.services.info.storelocations][]
+        args: dict of lists, as in [gramex.data.insert][]
+        **kwargs: additional parameters to [gramex.data.insert][], e.g. `id=['name']`
+
+    A background thread inserts all rows queued for each location (and kwargs) in a single
+    [gramex.data.insert][] call, [STORELOCATIONS_FLUSH][] seconds after the first row is queued.
+    Queued rows are also inserted on shutdown, or via [storelocations_flush][]. If the insert
+    fails twice, the rows queued by each call are inserted separately.
+    '''
+    with _storelocations_lock:
+        if not _storelocations_rows:
+            timer = threading.Timer(STORELOCATIONS_FLUSH, storelocations_flush)
+            timer.daemon = True
+            timer.start()
+        key = location, repr(sorted(kwargs.items()))
+        _storelocations_rows.setdefault(key, [kwargs, []])[1].append(args)
+
+
+def storelocations_flush() -> None:
+    '''Insert all rows queued by [storelocations_insert][]'''
+    with _storelocations_flush_lock:
+        with _storelocations_lock:
+            queued = dict(_storelocations_rows)
+            _storelocations_rows.clear()
+        for (location, _key), (kwargs, rows) in queued.items():
+            # Merge the rows into a single dict of lists. Fill missing keys with None
+            args, total = {}, 0
+            for row in rows:
+                size = len(next(iter(row.values()), []))
+                for key in row:
+                    if key not in args:
+                        args[key] = [None] * total
+                for key, values in args.items():
+                    values.extend(row.get(key, [None] * size))
+                total += size
+            # Retry the batch once. If it fails again, insert the rows queued by each call
+            # separately, so that a bad row doesn't lose other rows
+            conf, msg = info.storelocations[location], f'storelocations.{location}: cannot insert'
+            for action in ('Retrying', 'Inserting rows separately'):
+                try:
+                    gramex.data.insert(**conf, args=args, **kwargs)
+                    break
+                except Exception:
+                    app_log.exception(f'{msg} {total} rows. {action}')
+            else:
+                for row in rows:
+                    try:
+                        gramex.data.insert(**conf, args=row, **kwargs)
+                    except Exception:
+                        app_log.exception(f'{msg} {row}')
+
+
+atexit.register(storelocations_flush)
+
+
 def _storelocations_purge() -> None:
     import time
 
@@ -584,21 +868,35 @@ class GramexApp(tornado.web.Application):
         # Log the request with the handler name at the end.
         status = handler.get_status()
         if status < 400:
-            log_method = gramex.cache.app_log.info
+            level = logging.INFO
         elif status < 500:
-            log_method = gramex.cache.app_log.warning
+            level = logging.WARNING
         else:  # 500+ is a server error
-            log_method = gramex.cache.app_log.error
+            level = logging.ERROR
+        if not gramex.cache.app_log.isEnabledFor(level):
+            return
         request_time = 1000.0 * handler.request.request_time()
         handler_name = getattr(handler, 'name', handler.__class__.__name__)
         summary = handler._request_summary()
-        log_method(f"{handler.get_status()} {summary} {request_time:.2f}ms {handler_name}")
+        # Pass args instead of an f-string. Queued handlers format the message off the IOLoop
+        gramex.cache.app_log.log(
+            level, '%d %s %.2fms %s', status, summary, request_time, handler_name
+        )
 
     def clear_handlers(self):
         # Clear all handlers in the application
         del self.default_router.rules[:]
         del self.wildcard_router.rules[:]
 
+    def add_handlers(self, host_pattern, host_handlers):
+        # Same as Tornado's add_handlers, but route via a URLRouter that indexes URL patterns
+        host_matcher = tornado.routing.HostMatches(host_pattern)
+        router = URLRouter(self, host_handlers)
+        self.default_router.rules.insert(-1, tornado.routing.Rule(host_matcher, router))
+        if self.default_host is not None:
+            matcher = tornado.web.DefaultHostMatches(self, host_matcher.host_pattern)
+            self.wildcard_router.add_rules([(matcher, router)])
+
 
 def get_mailer(config, name=''):
     '''Return the email service config and corresponding mailer for a given config.'''
@@ -0,0 +1,223 @@
+'''
+LogQueue sends [gramex.log][] documents to a store (e.g. Elasticsearch) via a background thread.
+
+- `.append(doc)` queues a document. It never blocks on the network or disk.
+- A thread sends queued docs in batches, when `batch` docs are queued or every `flush` seconds.
+- If sending fails, it retries after `backoff` seconds, doubling up to `max_backoff` seconds.
+- At most `maxsize` docs are queued in memory. Beyond that, docs are written to a `spill` file
+  and sent when the queue is empty. If there's no `spill` file, they're dropped.
+- `.stats()` reports the queue depth, and the docs sent, failed, spilled and dropped.
+'''
+
+import json
+import os
+import threading
+from collections import deque
+from itertools import islice
+from typing import Callable
+from gramex.config import app_log, CustomJSONEncoder
+
+
+class LogQueue:
+    def __init__(
+        self,
+        name: str,
+        send: Callable,
+        maxsize: int = 100000,
+        batch: int = 1000,
+        flush: float = 5,
+        spill: str = None,
+        backoff: float = 1,
+        max_backoff: float = 60,
+    ):
+        '''
+        Queue documents and send them in batches via a background thread.
+
+        Examples:
+            >>> queue = LogQueue('app', send=lambda docs: 0, batch=100, flush=1, spill='app.jsonl')
+            >>> queue.append({'x': 1})      # Sent within 1 second, or when 100 docs are queued
+            >>> queue.stats()
+            {'queued': 1, 'spill': 0, 'sent': 0, 'failed': 0, 'spilled': 0, 'dropped': 0, ...}
+            >>> queue.close()               # Send pending docs and stop the thread
+
+        Parameters:
+            name: name used in log messages and the thread name
+            send: `send(docs)` sends a list of docs and returns the number of docs that failed
+                (e.g. invalid docs). These are not retried. If it raises an Exception (e.g. server
+                down), the same docs are re-sent after a backoff.
+            maxsize: max docs to queue in memory
+            batch: max docs to send at a time. Send as soon as these many docs are queued
+            flush: send queued docs at least every `flush` seconds
+            spill: path to a JSON Lines file. When the queue is full, docs are appended here, and
+                sent when the queue is empty. If `None`, drop docs when the queue is full
+            backoff: seconds to wait after the first failure. Doubles after each failure
+            max_backoff: max seconds to wait between retries
+        '''
+        self.name, self.send = name, send
+        self.maxsize, self.batch, self.flush = maxsize, batch, flush
+        self.spill, self.backoff, self.max_backoff = spill, backoff, max_backoff
+        self.queue, self.overflow = deque(), []
+        self.cond = threading.Condition()
+        self.counts = {'sent': 0, 'failed': 0, 'spilled': 0, 'dropped': 0, 'retries': 0}
+        self.delay, self.attempts, self.ok = 0, 0, True
+        # Docs in the spill file before _offset have been sent
+        self._offset, self._now, self._closed, self._dropping = 0, False, False, False
+        # .clear() increments _generation, so that docs being sent are not popped again
+        self._generation = 0
+        self.thread = threading.Thread(target=self._run, name=f'gramexlog-{name}', daemon=True)
+        self.thread.start()
+
+    def append(self, doc: dict) -> None:
+        '''Queue a doc. Spill or drop it if the queue is full'''
+        with self.cond:
+            if len(self.queue) < self.maxsize:
+                self.queue.append(doc)
+                if len(self.queue) == self.batch:
+                    self.cond.notify_all()
+            elif self.spill:
+                self.overflow.append(doc)
+            else:
+                self.counts['dropped'] += 1
+                if not self._dropping:
+                    self._dropping = True
+                    app_log.warning(f'gramexlog: {self.name} queue full. Dropping logs')
+
+    def extend(self, docs) -> None:
+        for doc in docs:
+            self.append(doc)
+
+    def clear(self) -> list:
+        '''Remove and return all queued docs'''
+        with self.cond:
+            docs = list(self.queue) + self.overflow
+            self.queue.clear()
+            self.overflow.clear()
+            self._generation += 1
+        return docs
+
+    def stats(self) -> dict:
+        '''Return queue depth, spill file size, counts of docs sent, failed, etc.'''
+        with self.cond:
+            spill = os.path.getsize(self.spill) if self.spill and os.path.exists(self.spill) else 0
+            return dict(
+                queued=len(self.queue) + len(self.overflow),
+                spill=max(spill - self._offset, 0),
+                backoff=self.delay,
+                **self.counts,
+            )
+
+    def push(self, timeout: float = None) -> bool:
+        '''
+        Send queued docs now, even when backing off. Wait until the queue is empty or a send
+        fails, for up to `timeout` seconds. Return True if the queue is empty.
+        '''
+        with self.cond:
+            attempts = self.attempts
+            self._now = True
+            self.cond.notify_all()
+            self.cond.wait_for(
+                lambda: not self.queue or (self.attempts > attempts and not self.ok), timeout
+            )
+            return not self.queue
+
+    def close(self, timeout: float = None) -> None:
+        '''Send queued docs, spill unsent docs, and stop the thread. Wait up to timeout seconds'''
+        with self.cond:
+            self._closed = True
+            self.cond.notify_all()
+        self.thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if not self._now and not self._closed:
+                    self.cond.wait_for(
+                        lambda: self._now
+                        or self._closed
+                        or (not self.delay and len(self.queue) >= self.batch),
+                        self.delay or self.flush,
+                    )
+                self._now, closed = False, self._closed
+                overflow, self.overflow = self.overflow, []
+                docs, generation = list(islice(self.queue, self.batch)), self._generation
+            if overflow:
+                self._write(overflow)
+            # Send spilled docs only when the queue is empty, and not when closing
+            end = None
+            if not docs and not closed and self.spill:
+                docs, end = self._read()
+            if docs:
+                self._send(docs, end, generation)
+            if closed and (not self.queue or not self.ok):
+                break
+        docs = self.clear()
+        if docs and self.spill:
+            self._write(docs)
+        elif docs:
+            with self.cond:
+                self.counts['dropped'] += len(docs)
+            app_log.warning(f'gramexlog: {self.name} dropped {len(docs)} unsent logs on close')
+
+    def _send(self, docs, end, generation):
+        try:
+            failed = self.send(docs)
+        except Exception:
+            with self.cond:
+                self.delay = min(max(self.delay * 2, self.backoff), self.max_backoff)
+                self.counts['retries'] += 1
+                self.attempts, self.ok = self.attempts + 1, False
+                self.cond.notify_all()
+            app_log.exception(f'gramexlog: push to {self.name} failed. Retry in {self.delay}s')
+            return
+        with self.cond:
+            if end is not None:
+                self._offset = end
+            elif generation == self._generation:
+                for _ in range(len(docs)):
+                    self.queue.popleft()
+            self.counts['sent'] += len(docs) - failed
+            self.counts['failed'] += failed
+            self.delay, self._dropping = 0, False
+            self.attempts, self.ok = self.attempts + 1, True
+            self.cond.notify_all()
+        if failed:
+            app_log.warning(f'gramexlog: {self.name} rejected {failed} of {len(docs)} logs')
+        # Once all spilled docs are sent, empty the spill file. Else send the rest right away
+        if end is not None:
+            with self.cond:
+                if end >= os.path.getsize(self.spill):
+                    with open(self.spill, 'w'):
+                        self._offset = 0
+                else:
+                    self._now = True
+
+    def _write(self, docs):
+        '''Append docs to the spill file'''
+        try:
+            with open(self.spill, 'a', encoding='utf-8') as handle:
+                for doc in docs:
+                    handle.write(json.dumps(doc, cls=CustomJSONEncoder) + '\n')
+            key = 'spilled'
+        except (OSError, TypeError, ValueError):
+            key = 'dropped'
+            app_log.exception(f'gramexlog: {self.name} cannot spill to {self.spill}')
+        with self.cond:
+            self.counts[key] += len(docs)
+
+    def _read(self):
+        '''Return up to batch docs from the spill file, and the offset after them'''
+        if not os.path.exists(self.spill):
+            return [], None
+        docs, end = [], self._offset
+        with open(self.spill, 'rb') as handle:
+            handle.seek(end)
+            for line in islice(handle, self.batch):
+                # Stop at a partial line, e.g. if the last write was interrupted
+                if not line.endswith(b'\n'):
+                    break
+                end += len(line)
+                try:
+                    docs.append(json.loads(line))
+                except ValueError:
+                    app_log.warning(f'gramexlog: {self.name} skipped invalid log in {self.spill}')
+        return docs, end
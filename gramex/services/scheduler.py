@@ -2,10 +2,16 @@
 
 import re
 import time
+import signal
+import asyncio
+import threading
 import tornado.ioloop
 from crontab import CronTab
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Union
 from gramex.transforms import build_transform
+from gramex.services.tasklock import create_lock
 from gramex.config import app_log, ioloop_running
 
 
@@ -18,6 +24,7 @@ class Task:
         schedule: dict,
         threadpool: ThreadPoolExecutor,
         ioloop: tornado.ioloop = None,
+        processpool: Union[Executor, Callable[[], Executor]] = None,
     ):
         '''Create a new task based on a schedule.
 
@@ -26,6 +33,7 @@ class Task:
             schedule: Schedule configuration (see below)
             threadpool: Threadpool to use for running the task
             ioloop: IOLoop to run the task on. If None, use main IOLoop
+            processpool: Process pool (or a function that returns it) to use if `process: true`
 
         Schedule configurations are dicts with these keys:
 
@@ -39,6 +47,25 @@ class Task:
         - `every`: interval to run at (e.g. "3h 30m" or "90s")
         - `startup`: `True` to run at startup, `'*'` to run on every config change
         - `thread`: `True` to run in a separate thread (default: False)
+        - `process`: `True` to run in the process pool, e.g. for CPU-heavy tasks (default: False)
+        - `timeout`: with `process: true`, raise a TimeoutError after `timeout` seconds
+        - `overlap`: what to do if the previous run hasn't finished (default: `allow`)
+            - `allow`: run anyway
+            - `skip`: skip this run
+            - `queue`: run once the previous run finishes. Multiple queued runs run only once
+        - `max_instances`: max runs at the same time. More runs are handled as per `overlap`.
+            (default: 1 if `overlap` is `skip` or `queue`, else no limit)
+        - `lock`: run only on one of many Gramex instances that share a lock store. It has keys:
+            - `type`: `sqlite` (default) or `redis`
+            - `path`: SQLite file (default: `$GRAMEXDATA/schedule-lock.db`) or Redis
+                `host:port:db` (default: `localhost:6379:0`)
+            - `ttl`: seconds after which a crashed instance's lock expires (default: 60)
+            - `hold`: seconds to hold the lock after a run starts, so that instances whose clocks
+                differ by up to `hold` seconds don't re-run it (default: 10). With `every:`,
+                instances started at different times fire at different times. So the default
+                is 0.9 * `every`, and only one instance runs in each interval
+            - `key`: lock name (default: the schedule name)
+            `lock: true` uses the defaults.
 
         The minutes, hours, dates, months, weekdays, years keys can take these values:
 
@@ -57,6 +84,32 @@ class Task:
         self.name = name
         self.utc = schedule.get('utc', False)
         self.thread = schedule.get('thread', False)
+        self.process = schedule.get('process', False)
+        self.overlap = schedule.get('overlap', 'allow')
+        if self.overlap not in {'allow', 'skip', 'queue'}:
+            raise ValueError(f'schedule {name} has invalid overlap: {self.overlap}')
+        self.max_instances = schedule.get('max_instances', None if self.overlap == 'allow' else 1)
+        self.running, self.queued = 0, False
+        # Run statistics, e.g. for the admin page. Durations are in seconds
+        self.stats = {
+            'runs': 0,
+            'errors': 0,
+            'skipped': 0,
+            'queued': 0,
+            'locked': 0,
+            'last_start': None,
+            'last_duration': None,
+            'max_duration': 0,
+            'total_duration': 0,
+        }
+        self._lock = threading.Lock()
+        # Lease-based lock shared by Gramex instances. Only the instance that acquires it runs
+        self.lock, self.lock_key, self.lock_hold = None, name, None
+        if schedule.get('lock'):
+            lock = dict(schedule['lock']) if isinstance(schedule['lock'], dict) else {}
+            self.lock_key = lock.pop('key', name)
+            self.lock_hold = lock.pop('hold', None)
+            self.lock = create_lock(lock)
         startup = schedule.get('startup')
         if 'function' not in schedule:
             raise ValueError(f'schedule {name} has no function:')
@@ -66,19 +119,46 @@ class Task:
             self.function = build_transform(
                 schedule, vars={}, iter=False, filename=f'schedule:{name}'
             )
+        # The function to run, without the thread / process pool wrapper
+        self.target = self.function
         self.ioloop = ioloop or tornado.ioloop.IOLoop.current()
         self.every = None  # If set, Task runs every self.every seconds
         self.cron = None  # If set, Task runs on cron.next()
         self.callback = None  # Handle for next scheduled run (or None)
         self.next = None  # Time of next scheduled run (for tests/test_schedule.py)
 
-        if self.thread:
-            fn = self.function
+        def on_done(future):
+            exception = None if future.cancelled() else future.exception(timeout=0)
+            if exception:
+                app_log.exception(f'schedule:{name}: {exception}', exc_info=exception)
+            elif self.process and not future.cancelled():
+                app_log.debug(f'schedule:{name}: returned {future.result()!r:.200}')
+
+        if self.process:
+            if processpool is None:
+                raise ValueError(f'schedule {name} has process: true but no processpool')
+            # Functions compiled by build_transform can't be pickled. Send the configuration
+            # instead. The worker process compiles it. Callables are sent as-is
+            if callable(schedule['function']):
+                fn = schedule['function']
+            else:
+                keys = ('function', 'args', 'kwargs')
+                fn = partial(_run_transform, name, {k: schedule[k] for k in keys if k in schedule})
+            timeout = schedule.get('timeout')
+
+            def run_function(*args, **kwargs):
+                # If processpool is a function, get the current pool. It may be re-created
+                pool = processpool() if callable(processpool) else processpool
+                if pool is None:
+                    raise ValueError(f'schedule {name} has process: true but no processpool')
+                future = pool.submit(_run_with_timeout, timeout, fn, *args, **kwargs)
+                future.add_done_callback(on_done)
+                return future
 
-            def on_done(future):
-                exception = future.exception(timeout=0)
-                if exception:
-                    app_log.exception(f'schedule:{name}: {exception}', exc_info=exception)
+            self.function = run_function
+
+        elif self.thread:
+            fn = self.function
 
             def run_function(*args, **kwargs):
                 future = threadpool.submit(fn, *args, **kwargs)
@@ -123,18 +203,92 @@ class Task:
 
         # Run now if the task is to be run on startup. Don't re-run if the config was reloaded
         if startup == '*' or (startup is True and not ioloop_running(self.ioloop)):
-            self.function()
+            self.start()
 
     def run(self, *args, **kwargs):
         '''Run task. Then set up next callback.'''
-        app_log.info(f'Running {self.name}')
         try:
-            self.result = self.function(*args, **kwargs)
+            self.result = self.start(*args, **kwargs)
         finally:
             # Run again, if not stopped via self.stop() or end of schedule
             if self.callback is not None:
                 self.call_later()
 
+    def start(self, *args, **kwargs):
+        '''Run the function now, unless max_instances are running. Track its run duration.
+
+        Returns the function's result (a Future if `thread: true`), or None if the run is
+        skipped, queued, or another instance holds the `lock`.
+        '''
+        with self._lock:
+            if self.max_instances is not None and self.running >= self.max_instances:
+                key = 'queued' if self.overlap == 'queue' else 'skipped'
+                self.stats[key] += 1
+                if self.overlap == 'queue':
+                    self.queued = args, kwargs
+                app_log.warning(f'schedule:{self.name}: {self.running} runs not finished. {key}')
+                return None
+            self.running += 1
+        token = None
+        if self.lock is not None:
+            try:
+                token = self.lock.acquire(self.lock_key)
+            except Exception:
+                with self._lock:
+                    self.running -= 1
+                    self.stats['errors'] += 1
+                raise
+            if token is None:
+                with self._lock:
+                    self.running -= 1
+                    self.stats['locked'] += 1
+                app_log.info(f'schedule:{self.name}: skipped. Another instance has the lock')
+                return None
+        app_log.info(f'Running {self.name}')
+        start = time.time()
+        try:
+            result = self.function(*args, **kwargs)
+        except Exception:
+            self._done(start, True, token)
+            raise
+        # If the function runs in a thread (or is async), track when the future is done
+        if isinstance(result, (Future, asyncio.Future)):
+            result.add_done_callback(
+                lambda future: self._done(
+                    start, not future.cancelled() and future.exception() is not None, token
+                )
+            )
+        else:
+            self._done(start, False, token)
+        return result
+
+    def _done(self, start, error, token=None):
+        '''Update run statistics. Release the lock. Start a queued run, if any'''
+        duration = time.time() - start
+        if token is not None:
+            hold = self.lock_hold
+            if hold is None:
+                hold = 0.9 * self.every if self.every else 10
+            try:
+                if not self.lock.release(self.lock_key, token, start + hold - time.time()):
+                    app_log.warning(f'schedule:{self.name}: lost lock before the run ended')
+            except Exception:
+                app_log.exception(f'schedule:{self.name}: cannot release lock')
+        with self._lock:
+            self.running -= 1
+            stats = self.stats
+            stats['runs'] += 1
+            stats['errors'] += error
+            stats['last_start'], stats['last_duration'] = start, duration
+            stats['max_duration'] = max(stats['max_duration'], duration)
+            stats['total_duration'] += duration
+            queued, self.queued = self.queued, False
+        if self.every and duration > self.every:
+            app_log.warning(f'schedule:{self.name} took {duration:.1f}s > every: {self.every}s')
+        # Functions must be run from the IOLoop. _done() may be called from a thread
+        if queued:
+            self.ioloop.add_callback(self.start, *queued[0], **queued[1])
+
     def stop(self):
         '''Suspend task, clearing any pending callbacks'''
         if self.callback is not None:
@@ -173,3 +327,32 @@ class Task:
             self.next = time.time() + delay
         else:
             self.callback, self.next = None, None
+
+
+_transforms = {}
+
+
+def _run_transform(name, conf, *args, **kwargs):
+    '''Compile a schedule's function: in a process pool worker (once), and run it'''
+    key = name, repr(conf)
+    if key not in _transforms:
+        _transforms[key] = build_transform(conf, vars={}, iter=False, filename=f'schedule:{name}')
+    return _transforms[key](*args, **kwargs)
+
+
+def _raise_timeout(signum, frame):
+    raise TimeoutError('schedule timed out')
+
+
+def _run_with_timeout(timeout, fn, *args, **kwargs):
+    '''Run fn(*args, **kwargs) in a process pool worker. Raise TimeoutError after timeout secs'''
+    # Process pool workers run tasks in their main thread, so a SIGALRM can interrupt them
+    if not timeout or not hasattr(signal, 'setitimer'):
+        return fn(*args, **kwargs)
+    handler = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, handler)
@@ -0,0 +1,189 @@
+'''
+Lease-based locks that let multiple Gramex instances run a `schedule:` or `alert:` only once.
+
+When N Gramex instances share a config, each runs every schedule. A task with a `lock:` acquires a
+lease on a key in a shared store before it runs. Only one instance gets the lease. Others skip it.
+
+The lease expires after `ttl` seconds. The holder renews it every `ttl / 3` seconds while the task
+runs. If the holder crashes, it stops renewing, and the lease expires. Each lease has a unique
+token, so an instance can only renew or release its own lease, not another instance's.
+
+Stores:
+
+- `sqlite`: a SQLite file, e.g. on a shared volume. Expiry uses each instance's clock
+- `redis`: a Redis server. Expiry uses Redis TTLs
+'''
+
+import os
+import time
+import uuid
+import socket
+import threading
+from typing import Optional
+from gramex.config import app_log, variables
+
+
+class TaskLock:
+    '''
+    Base class for lease-based locks. Typical usage:
+
+        >>> lock = SQLiteLock(path='locks.db', ttl=60)
+        >>> token = lock.acquire('key')     # Returns None if another instance holds the lease
+        >>> if token:
+        ...     run_task()
+        ...     lock.release('key', token)  # Or lock.release('key', token, hold=10)
+
+    Sub-classes implement `_acquire(key, token, ttl)` and `_expire(key, token, ttl)`.
+    '''
+
+    def __init__(self, ttl: float = 60):
+        self.ttl = ttl
+        # {token: renewal timer} for each lease this instance holds
+        self._timers, self._lock = {}, threading.RLock()
+
+    def acquire(self, key: str) -> Optional[str]:
+        '''Acquire a lease on key. Return a unique token if acquired, else None'''
+        token = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}'
+        with self._lock:
+            if not self._acquire(key, token, self.ttl):
+                return None
+            self._schedule_renewal(key, token)
+        return token
+
+    def release(self, key: str, token: str, hold: float = 0) -> bool:
+        '''Release the lease on key after `hold` seconds. Return False if token lost the lease'''
+        with self._lock:
+            timer = self._timers.pop(token, None)
+            if timer is not None:
+                timer.cancel()
+            return self._expire(key, token, hold)
+
+    def _schedule_renewal(self, key, token):
+        timer = self._timers[token] = threading.Timer(self.ttl / 3, self._renew, (key, token))
+        timer.daemon = True
+        timer.start()
+
+    def _renew(self, key, token):
+        # Extend the lease every ttl / 3 seconds until it is released. Renewing and releasing
+        # hold self._lock, so a renewal can't extend a lease after it is released
+        with self._lock:
+            if token not in self._timers:
+                return
+            try:
+                held = self._expire(key, token, self.ttl)
+            except Exception:
+                app_log.exception(f'lock:{key}: cannot renew lease. Retrying')
+                held = True
+            if held:
+                self._schedule_renewal(key, token)
+            else:
+                app_log.warning(f'lock:{key}: lease lost. Another instance may run the task')
+                del self._timers[token]
+
+    def _acquire(self, key: str, token: str, ttl: float) -> bool:
+        '''Save token as key's holder for ttl seconds if no one holds it. Return True if saved'''
+        raise NotImplementedError()
+
+    def _expire(self, key: str, token: str, ttl: float) -> bool:
+        '''If token holds key, expire it after ttl seconds (now if ttl <= 0). Return True if so'''
+        raise NotImplementedError()
+
+
+class SQLiteLock(TaskLock):
+    '''
+    A TaskLock that stores leases in a SQLite file. Typical usage:
+
+        >>> lock = SQLiteLock(path='/shared/locks.db', table='lock', ttl=60)
+
+    `path` defaults to `$GRAMEXDATA/schedule-lock.db`, which is shared by instances on one server.
+    This uses SQLite's default rollback journal, not WAL, which does not work on network volumes.
+    '''
+
+    def __init__(self, path: str = None, table: str = 'lock', timeout: float = 10, **kwargs):
+        super(SQLiteLock, self).__init__(**kwargs)
+        import sqlite3
+        from gramex.cache import _create_path
+
+        self.path = _create_path(path or os.path.join(variables['GRAMEXDATA'], 'schedule-lock.db'))
+        self.table = table
+        self.store = sqlite3.connect(
+            self.path, timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        self.store.execute(
+            f'CREATE TABLE IF NOT EXISTS "{table}" (key TEXT PRIMARY KEY, token TEXT, expire REAL)'
+        )
+
+    def _acquire(self, key, token, ttl):
+        now = time.time()
+        # Insert the lease, or replace it if it has expired, in a single atomic statement
+        with self._lock:
+            cursor = self.store.execute(
+                f'INSERT INTO "{self.table}" VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE SET '
+                f'token=excluded.token, expire=excluded.expire WHERE "{self.table}".expire <= ?',
+                (key, token, now + ttl, now),
+            )
+        return cursor.rowcount == 1
+
+    def _expire(self, key, token, ttl):
+        with self._lock:
+            if ttl > 0:
+                cursor = self.store.execute(
+                    f'UPDATE "{self.table}" SET expire=? WHERE key=? AND token=?',
+                    (time.time() + ttl, key, token),
+                )
+            else:
+                cursor = self.store.execute(
+                    f'DELETE FROM "{self.table}" WHERE key=? AND token=?', (key, token)
+                )
+        return cursor.rowcount == 1
+
+
+class RedisLock(TaskLock):
+    '''
+    A TaskLock that stores leases in Redis. Typical usage:
+
+        >>> lock = RedisLock(path='localhost:6379:0', prefix='gramex:lock:', ttl=60)
+
+    The path is `host:port:db:params` like RedisStore. `prefix` is prepended to each key.
+    '''
+
+    def __init__(self, path: str = None, prefix: str = 'gramex:lock:', **kwargs):
+        super(RedisLock, self).__init__(**kwargs)
+        from gramex.services.rediscache import get_redis
+
+        self.store = get_redis(path, decode_responses=True, encoding='utf-8')
+        self.prefix = prefix
+
+    def _acquire(self, key, token, ttl):
+        return bool(self.store.set(self.prefix + key, token, nx=True, px=int(ttl * 1000)))
+
+    def _expire(self, key, token, ttl):
+        from redis.exceptions import WatchError
+
+        key = self.prefix + key
+        # Change the key only if token holds it. WATCH aborts if another client changes it
+        with self.store.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.get(key) != token:
+                    return False
+                pipe.multi()
+                if ttl > 0:
+                    pipe.pexpire(key, max(int(ttl * 1000), 1))
+                else:
+                    pipe.delete(key)
+                pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+
+def create_lock(conf: dict) -> TaskLock:
+    '''Create a TaskLock from a `lock:` configuration, e.g. `{type: redis, path: host:port}`'''
+    conf = dict(conf)
+    lock_type = conf.pop('type', 'sqlite')
+    if lock_type == 'sqlite':
+        return SQLiteLock(**conf)
+    elif lock_type == 'redis':
+        return RedisLock(**conf)
+    raise ValueError(f'lock type: {lock_type} not supported. Use sqlite or redis')
@@ -1,5 +1,17 @@
 '''
 Same as cachetools/ttl.py 3.0.0, but with option to specify an expiry for EACH key.
+
+Keys are expired via a heap of expiry times instead of a linked list, since keys with different
+expiry times are not in expiry order. `len()`, `currsize`, get and set are O(1) amortized, and
+the value sizes are computed once per set.
+
+It also supports (all optional):
+
+- `admission=True`: TinyLFU admission. New keys are cached only if they're accessed more often
+  than the keys they would evict. So scans of one-off keys don't flush frequently used keys
+- `maxentry=N`: don't cache values larger than `N`
+- `quota={prefix: N}`: keys whose namespace starts with `prefix` use at most `N` in total. The
+  namespace is the first item of tuple keys (e.g. file path for gramex.cache.open) or the key
 '''
 
 # Modifications are marked with CHANGE:
@@ -7,6 +19,9 @@ Same as cachetools/ttl.py 3.0.0, but with option to specify an expiry for EACH k
 from __future__ import absolute_import
 
 import collections
+import contextlib
+import heapq
+import threading
 import time
 
 # CHANGE: import from cachetools instead of .cache
@@ -14,23 +29,46 @@ from cachetools import Cache
 
 # CHANGE: MAXTTL is the default TTL = 10 years
 MAXTTL = 60 * 60 * 24 * 365 * 10
+# CHANGE: Lookup table to halve every byte in a bytearray via .translate()
+_HALF = bytes(i >> 1 for i in range(256))
+# CHANGE: (cache, size) of the value that TTLCache.__setitem__ is setting in this thread
+_setting = threading.local()
 
 
-class _Link:
-    __slots__ = ('key', 'expire', 'next', 'prev')
+class _Sketch:
+    '''
+    Count-Min sketch of 4-bit counters that estimates how often each key was accessed. This is
+    the frequency estimator in TinyLFU. https://arxiv.org/abs/1512.00727
 
-    def __init__(self, key=None, expire=None):
-        self.key = key
-        self.expire = expire
+    After `10 * width` accesses, all counters are halved, so that old accesses age out.
+    '''
 
-    def __reduce__(self):
-        return _Link, (self.key, self.expire)
+    __slots__ = ('rows', 'mask', 'count', 'limit')
 
-    def unlink(self):
-        next = self.next
-        prev = self.prev
-        prev.next = next
-        next.prev = prev
+    def __init__(self, width=65536):
+        # Round width to a power of 2, so that indices can be computed with a bit mask
+        width = 1 << (width - 1).bit_length()
+        self.rows = [bytearray(width) for _ in range(4)]
+        self.mask = width - 1
+        self.count, self.limit = 0, 10 * width
+
+    def _indices(self, key):
+        # Derive 4 indices from a single hash via double hashing
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [(h1 + i * h2) & self.mask for i in range(4)]
+
+    def add(self, key):
+        for row, index in zip(self.rows, self._indices(key)):
+            if row[index] < 15:
+                row[index] += 1
+        self.count += 1
+        if self.count >= self.limit:
+            self.count //= 2
+            self.rows = [row.translate(_HALF) for row in self.rows]
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self._indices(key)))
 
 
 class _Timer:
@@ -66,31 +104,57 @@ class TTLCache(Cache):
     """LRU Cache implementation with per-item time-to-live (TTL) value."""
 
     # CHANGE: ttl parameter defaults to MAXTTL
-    def __init__(self, maxsize, ttl=MAXTTL, timer=time.time, getsizeof=None):
+    # CHANGE: admission, maxentry, quota parameters added
+    def __init__(
+        self,
+        maxsize,
+        ttl=MAXTTL,
+        timer=time.time,
+        getsizeof=None,
+        admission=False,
+        maxentry=None,
+        quota=None,
+    ):
         Cache.__init__(self, maxsize, getsizeof)
-        self.__root = root = _Link()
-        root.prev = root.next = root
+        # CHANGE: getsizeof() is a method that returns the size computed by __setitem__
+        self.__getsizeof = self.__dict__.pop('getsizeof', Cache.getsizeof)
+        # CHANGE: __links is {key: expiry time} in LRU order. __heap has (expiry, count, key).
+        # Re-set keys leave stale entries in the heap, which expire() ignores
         self.__links = collections.OrderedDict()
+        self.__heap, self.__count = [], 0
         self.__timer = _Timer(timer)
         self.__ttl = ttl
         # CHANGE: .set() is the same as setitem
         self.set = self.__setitem__
+        # CHANGE: admission, maxentry and quota
+        self.__sketch = _Sketch() if admission else None
+        self.__maxentry = maxentry
+        self.__quota = dict(quota or {})
+        # Match the longest namespace prefix first
+        self.__prefixes = sorted(self.__quota, key=len, reverse=True)
+        self.__sizes = {}  # {key: size}
+        self.__ns = {}  # {key: namespace}, for keys in a namespace with a quota
+        self.__nskeys = {prefix: collections.OrderedDict() for prefix in self.__quota}
+        self.__nssize = {prefix: 0 for prefix in self.__quota}
 
     def __contains__(self, key):
+        # CHANGE: count accesses for admission. Cache.get() also calls this
+        if self.__sketch is not None:
+            self.__sketch.add(key)
         try:
-            link = self.__links[key]  # no reordering
+            expire = self.__links[key]  # no reordering
         except KeyError:
             return False
         else:
-            return not (link.expire < self.__timer())
+            return not (expire < self.__timer())
 
     def __getitem__(self, key, cache_getitem=Cache.__getitem__):
         try:
-            link = self.__getlink(key)
+            expire = self.__getlink(key)
         except KeyError:
             expired = False
         else:
-            expired = link.expire < self.__timer()
+            expired = expire < self.__timer()
         if expired:
             return self.__missing__(key)
         else:
@@ -100,54 +164,70 @@ class TTLCache(Cache):
     def __setitem__(self, key, value, expire=None, cache_setitem=Cache.__setitem__):
         with self.__timer as time:
             self.expire(time)
-            cache_setitem(self, key, value)
-        try:
-            link = self.__getlink(key)
-        except KeyError:
-            self.__links[key] = link = _Link(key)
-        else:
-            link.unlink()
+            # CHANGE: compute size once. Don't cache large values, or keys that aren't admitted
+            size = self.getsizeof(value)
+            ns = self.__namespace(key)
+            if not self.__admit(key, size, ns):
+                # Remove the old value. __delitem__ raises KeyError (after deleting) if expired
+                if key in self.__links:
+                    with contextlib.suppress(KeyError):
+                        self.__delitem__(key)
+                return
+            self.__fit_quota(key, size, ns)
+            # Cache.__setitem__ calls getsizeof(). Re-use the size. Caches are set from many
+            # threads, so save it per thread, not on the cache
+            _setting.size = self, size
+            try:
+                cache_setitem(self, key, value)
+            finally:
+                _setting.size = None
+            self.__forget(key)
+            self.__sizes[key] = size
+            if ns is not None:
+                self.__ns[key] = ns
+                self.__nskeys[ns][key] = None
+                self.__nssize[ns] += size
         # CHANGE: Expire time based on expire parameter, or default TTL
-        link.expire = time + (self.__ttl if expire is None else expire)
-        link.next = root = self.__root
-        link.prev = prev = root.prev
-        prev.next = root.prev = link
+        expire = time + (self.__ttl if expire is None else expire)
+        self.__links[key] = expire
+        self.__links.move_to_end(key)
+        # The count breaks ties between equal expiry times, so that keys are never compared
+        self.__count += 1
+        heapq.heappush(self.__heap, (expire, self.__count, key))
+        # Rebuild the heap if it has too many stale entries
+        if len(self.__heap) > 2 * len(self.__links) + 1000:
+            # Copy links via list(), since other threads may change them while we iterate
+            links = list(self.__links.items())
+            self.__heap = [(exp, i, k) for i, (k, exp) in enumerate(links)]
+            heapq.heapify(self.__heap)
+
+    # CHANGE: return the size computed by __setitem__ in this thread, if it's setting a value
+    def getsizeof(self, value):
+        setting = getattr(_setting, 'size', None)
+        if setting is not None and setting[0] is self:
+            return setting[1]
+        return self.__getsizeof(value)
 
     def __delitem__(self, key, cache_delitem=Cache.__delitem__):
         cache_delitem(self, key)
-        link = self.__links.pop(key)
-        link.unlink()
-        if link.expire < self.__timer():
+        self.__forget(key)
+        expire = self.__links.pop(key)
+        if expire < self.__timer():
             raise KeyError(key)
 
     def __iter__(self):
-        root = self.__root
-        curr = root.next
-        while curr is not root:
-            # "freeze" time for iterator access
-            with self.__timer as time:
-                if not (curr.expire < time):
-                    yield curr.key
-            curr = curr.next
+        # CHANGE: iterate over a copy, so that the cache can be used while iterating
+        with self.__timer as time:
+            keys = [key for key, expire in self.__links.items() if not (expire < time)]
+        return iter(keys)
 
+    # CHANGE: expire keys and count the rest. This is O(1) amortized
     def __len__(self):
-        root = self.__root
-        curr = root.next
-        time = self.__timer()
-        count = len(self.__links)
-        while curr is not root and curr.expire < time:
-            count -= 1
-            curr = curr.next
-        return count
+        self.expire()
+        return len(self.__links)
 
     def __setstate__(self, state):
         self.__dict__.update(state)
-        root = self.__root
-        root.prev = root.next = root
-        for link in sorted(self.__links.values(), key=lambda obj: obj.expire):
-            link.next = root
-            link.prev = prev = root.prev
-            prev.next = root.prev = link
         self.expire(self.__timer())
 
     def __repr__(self, cache_repr=Cache.__repr__):
@@ -175,21 +255,28 @@ class TTLCache(Cache):
         """Remove expired items from the cache."""
         if time is None:
             time = self.__timer()
-        root = self.__root
-        curr = root.next
-        links = self.__links
+        heap, links = self.__heap, self.__links
         cache_delitem = Cache.__delitem__
-        while curr is not root and curr.expire < time:
-            cache_delitem(self, curr.key)
-            del links[curr.key]
-            next = curr.next
-            curr.unlink()
-            curr = next
+        # CHANGE: pop expired keys from the heap, ignoring stale entries of re-set keys
+        while heap and heap[0][0] < time:
+            expire, count, key = heapq.heappop(heap)
+            if links.get(key) == expire:
+                cache_delitem(self, key)
+                self.__forget(key)
+                del links[key]
 
     def clear(self):
         with self.__timer as time:
             self.expire(time)
             Cache.clear(self)
+            # CHANGE: newer cachetools versions don't clear via popitem(). Clear links explicitly
+            self.__links.clear()
+            self.__heap.clear()
+            self.__sizes.clear()
+            self.__ns.clear()
+            for prefix in self.__nskeys:
+                self.__nskeys[prefix].clear()
+                self.__nssize[prefix] = 0
 
     def get(self, *args, **kwargs):
         with self.__timer:
@@ -215,9 +302,68 @@ class TTLCache(Cache):
             except StopIteration:
                 raise KeyError(f'{self.__class__.__name__} is empty')
             else:
-                return (key, self.pop(key))
+                # CHANGE: don't use .pop(), which counts as an access for admission
+                value = Cache.__getitem__(self, key)
+                self.__delitem__(key)
+                return (key, value)
 
     def __getlink(self, key):
         value = self.__links[key]
         self.__links.move_to_end(key)
+        # CHANGE: keys in a namespace with a quota are also tracked in LRU order
+        ns = self.__ns.get(key)
+        if ns is not None:
+            self.__nskeys[ns].move_to_end(key)
         return value
+
+    # CHANGE: admission, maxentry and quota methods added
+    def __namespace(self, key):
+        '''Return the quota prefix that the key's namespace starts with, or None'''
+        if self.__prefixes:
+            name = str(key[0] if isinstance(key, tuple) and key else key)
+            for prefix in self.__prefixes:
+                if name.startswith(prefix):
+                    return prefix
+        return None
+
+    def __admit(self, key, size, ns):
+        '''Return True if a value of this size may be cached against the key'''
+        if self.__maxentry is not None and size > self.__maxentry:
+            return False
+        if ns is not None and size > self.__quota[ns]:
+            return False
+        # Always admit existing keys, or if there's space, or if there's no admission policy
+        sketch = self.__sketch
+        excess = Cache.currsize.fget(self) + size - self.maxsize
+        if sketch is None or key in self.__links or excess <= 0:
+            return True
+        # Admit only if the key is accessed more often than every key it would evict
+        freq = sketch.estimate(key)
+        for victim in self.__links:
+            if excess <= 0:
+                break
+            if sketch.estimate(victim) >= freq:
+                return False
+            excess -= self.__sizes.get(victim, 0)
+        return True
+
+    def __fit_quota(self, key, size, ns):
+        '''Evict least recently used keys in the namespace until the value fits its quota'''
+        if ns is not None:
+            keys, quota = self.__nskeys[ns], self.__quota[ns]
+            size -= self.__sizes.get(key, 0) if key in keys else 0
+            while self.__nssize[ns] + size > quota and keys:
+                victim = next(iter(keys))
+                if victim == key:
+                    keys.move_to_end(key)
+                    continue
+                with contextlib.suppress(KeyError):
+                    self.__delitem__(victim)
+
+    def __forget(self, key):
+        '''Remove size and namespace tracking for a key'''
+        size = self.__sizes.pop(key, 0)
+        ns = self.__ns.pop(key, None)
+        if ns is not None:
+            del self.__nskeys[ns][key]
+            self.__nssize[ns] -= size
@@ -8,16 +8,23 @@ The CacheFile object exposes a get, wrap and close interface to handlers.
 Each type of store has a separate CacheFile. (MemoryCacheFile, DiskCacheFile,
 etc.) The parent CacheFile implements the no-caching behaviour.
 
+If the app compresses responses (`app.settings.compress_response`), compressible
+responses are stored gzipped (and brotli-compressed if `brotli` is installed).
+Each entry stores the ETag of the original body. Cache hits serve the stored
+bytes as-is, or a 304 if the request's `If-None-Match` matches the ETag.
+
 See gramex.handlers.BaseHandler for examples on how to use these objects.
 '''
 
 # B403:import_public we only pickle Gramex internal objects
+import gzip
 import pickle  # noqa S403
 from diskcache import Cache as DiskCache
 from .ttlcache import TTLCache as MemoryCache
 from .rediscache import RedisCache
 from gramex.config import app_log
 from gramex.http import OK, NOT_MODIFIED
+from tornado.web import GZipContentEncoding
 
 # HTTP Headers that should not be cached
 ignore_headers = {
@@ -37,6 +44,59 @@ ignore_headers = {
 }
 
 
+def _compress(body):
+    '''Return {encoding: compressed body} for each encoding available, best first'''
+    result = {}
+    try:
+        import brotli
+
+        result['br'] = brotli.compress(body, quality=9)
+    except ImportError:
+        pass
+    # mtime=0 returns the same bytes for the same body
+    result['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+    return result
+
+
+def _entry(handler, status, headers, body, etag):
+    '''Return the cache entry for a response. Compress the body if the app compresses it'''
+    entry = {'status': OK if status == NOT_MODIFIED else status, 'headers': headers, 'etag': etag}
+    ctype = handler._headers.get('Content-Type', '').split(';')[0]
+    if (
+        handler.settings.get('compress_response', handler.settings.get('gzip'))
+        and (ctype.startswith('text/') or ctype in GZipContentEncoding.CONTENT_TYPES)
+        and len(body) >= GZipContentEncoding.MIN_LENGTH
+    ):
+        entry['encoded'] = _compress(body)
+    else:
+        entry['body'] = body
+    return entry
+
+
+def write_cached(handler, entry):
+    '''
+    Write a cache entry into the handler. Return a 304 if the request's ETag matches. Else
+    write the compressed body in an encoding the client accepts, or the original body.
+    '''
+    handler.set_status(entry['status'])
+    handler._write_headers(entry['headers'])
+    # Entries cached by older versions have no etag, and are not compressed
+    etag = entry.get('etag')
+    if etag and entry['status'] == OK:
+        handler.set_header('Etag', etag)
+        if handler.check_etag_header():
+            handler.set_status(NOT_MODIFIED)
+            return
+    if 'body' in entry:
+        return handler.write(entry['body'])
+    accept = handler.request.headers.get('Accept-Encoding', '')
+    for encoding, body in entry['encoded'].items():
+        if encoding in accept:
+            handler.set_header('Content-Encoding', encoding)
+            return handler.write(body)
+    handler.write(gzip.decompress(entry['encoded']['gzip']))
+
+
 def get_cachefile(store):
     if isinstance(store, MemoryCache):
         return MemoryCacheFile
@@ -80,7 +140,11 @@ class MemoryCacheFile(CacheFile):
                 for name, value in handler._headers.get_all()
                 if name not in ignore_headers
             ]
+            if chunk is not None:
+                handler.write(chunk)
+                chunk = None
             body = b''.join(handler._write_buffer)
+            etag = handler.compute_etag()
 
             # Call the original finish
             self._finish(chunk)
@@ -91,12 +155,7 @@ class MemoryCacheFile(CacheFile):
                 self.store.set(
                     key=self.key,
                     value=pickle.dumps(
-                        {
-                            'status': OK if status == NOT_MODIFIED else status,
-                            'headers': headers,
-                            'body': body,
-                        },
-                        pickle.HIGHEST_PROTOCOL,
+                        _entry(handler, status, headers, body, etag), pickle.HIGHEST_PROTOCOL
                     ),
                     expire=self.expire,
                 )
@@ -124,7 +183,11 @@ class RedisCacheFile(CacheFile):
                 for name, value in handler._headers.get_all()
                 if name not in ignore_headers
             ]
+            if chunk is not None:
+                handler.write(chunk)
+                chunk = None
             body = b''.join(handler._write_buffer)
+            etag = handler.compute_etag()
 
             # Call the original finish
             self._finish(chunk)
@@ -134,11 +197,7 @@ class RedisCacheFile(CacheFile):
             if status in self.statuses:
                 self.store.set(
                     key=self.key,
-                    value={
-                        'status': OK if status == NOT_MODIFIED else status,
-                        'headers': headers,
-                        'body': body,
-                    },
+                    value=_entry(handler, status, headers, body, etag),
                     expire=self.expire,
                 )
 
@@ -0,0 +1,109 @@
+'''
+URLRouter routes requests to `url:` handlers without testing every pattern.
+
+Tornado's router tests each URL pattern's regex in priority order until one matches. With
+hundreds of patterns, requests to low priority patterns run hundreds of regex matches.
+
+URLRouter indexes each pattern by its literal prefix (e.g. `/app/api/` for `/app/api/(.*)`) in a
+trie. A request is tested only against patterns whose prefix matches its path, in the same
+priority order. So the routing cost depends on the number of candidate patterns, not all patterns.
+'''
+
+import re
+from heapq import merge
+from typing import Any, List, Optional
+from tornado.httputil import HTTPServerRequest
+from tornado.routing import PathMatches
+from tornado.web import _ApplicationRouter
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+
+def literal_prefix(regex: re.Pattern) -> str:
+    '''
+    Return the literal string that every match of `regex` starts with.
+
+    Examples:
+        >>> literal_prefix(re.compile(r'/app/api/(.*)'))
+        '/app/api/'
+        >>> literal_prefix(re.compile(r'/app/x?'))
+        '/app/'
+        >>> literal_prefix(re.compile(r'a|/b'))
+        ''
+
+    Case-insensitive patterns, or patterns that cannot be parsed, return `''`, which matches all.
+    '''
+    if regex.flags & re.IGNORECASE:
+        return ''
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except Exception:
+        return ''
+    prefix = []
+    for op, value in parsed:
+        if op != sre_parse.LITERAL:
+            break
+        prefix.append(chr(value))
+    return ''.join(prefix)
+
+
+class URLRouter(_ApplicationRouter):
+    '''
+    Tornado's application router, but indexed by the literal prefix of each URL pattern.
+
+    Rules are matched in the order they are added, like Tornado. Rules that don't match on the
+    path (e.g. host matchers) have an empty prefix, and are tested for every request.
+    '''
+
+    _trie = None
+
+    def add_rules(self, rules) -> None:
+        super().add_rules(rules)
+        self._trie = None
+
+    def _index(self) -> dict:
+        # Each trie node is a dict of {char: child node}. Key '' has indices of rules whose
+        # literal prefix is the node's path, or a prefix of it, in priority order
+        trie = {}
+        for index, rule in enumerate(self.rules):
+            prefix = (
+                literal_prefix(rule.matcher.regex) if type(rule.matcher) is PathMatches else ''
+            )
+            node = trie
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node.setdefault('', []).append(index)
+        stack = [(trie, [])]
+        while stack:
+            node, parent = stack.pop()
+            node[''] = list(merge(parent, node[''])) if '' in node else parent
+            stack.extend((child, node['']) for char, child in node.items() if char)
+        return trie
+
+    def candidates(self, path: str) -> List[int]:
+        '''Return indices of rules whose literal prefix matches path, in priority order'''
+        if self._trie is None:
+            self._trie = self._index()
+        node = self._trie
+        for char in path:
+            child = node.get(char)
+            if child is None:
+                break
+            node = child
+        return node['']
+
+    def find_handler(self, request: HTTPServerRequest, **kwargs: Any) -> Optional[Any]:
+        rules = self.rules
+        for index in self.candidates(request.path):
+            rule = rules[index]
+            target_params = rule.matcher.match(request)
+            if target_params is not None:
+                if rule.target_kwargs:
+                    target_params['target_kwargs'] = rule.target_kwargs
+                delegate = self.get_target_delegate(rule.target, request, **target_params)
+                if delegate is not None:
+                    return delegate
+        return None
@@ -38,5 +38,7 @@ def ensure_single_session(handler):
         if isinstance(other_user, dict) and other_user.get('id') == user_id:
             other_session = dict(other_session)
             other_session.pop(handler.session_user_key)
-            handler._session_store.dump(key, other_session)
+            handler._session_store.dump(
+                key, other_session, expire=handler._session_expire(other_session)
+            )
             app_log.debug(f'ensure_single_session: dropped user {user_id} from session {key}')
@@ -436,26 +436,16 @@ def build_pipeline(
             # but raise the original Exception
             raise
         finally:
-            # Log pipeline execution (and error, if any)
-            from gramex.services import info
+            # Log pipeline execution (and error, if any) in the background
+            from gramex.services import info, storelocations_insert
 
             if 'pipeline' in info.storelocations:
-                from gramex.data import insert
-
                 end = datetime.datetime.utcnow().isoformat()
-                try:
-                    insert(
-                        **info.storelocations.pipeline,
-                        id=['name', 'start'],
-                        args={
-                            'name': [filename],
-                            'start': [start],
-                            'end': [end],
-                            'error': [error],
-                        },
-                    )
-                except Exception:
-                    app_log.exception(f'pipeline:{filename} exception logging failed')
+                storelocations_insert(
+                    'pipeline',
+                    id=['name', 'start'],
+                    args={'name': [filename], 'start': [start], 'end': [end], 'error': [error]},
+                )
 
     return run_pipeline
 
@@ -0,0 +1,55 @@
+'''Replay a synthetic workload on the memory cache with and without TinyLFU admission / quotas.
+
+Usage: python cache_admission.py [requests=200000]
+
+The workload mixes:
+
+- an app reading 2,000 small files with a Zipf-like popularity (its working set)
+- a FormHandler scanning distinct parameterized queries that are never repeated
+- an occasional large spreadsheet load that's a fifth of the cache
+
+Prints the hit rate overall and for the app's working set.
+'''
+
+import random
+import sys
+from gramex.services.ttlcache import TTLCache
+
+
+def workload(requests, seed=0):
+    rand = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(2000)]
+    hot = rand.choices(range(2000), weights, k=requests)
+    for index in range(requests):
+        pick = rand.random()
+        if pick < 0.6:
+            yield ('/app/file%d' % hot[index], 'hot'), 1000
+        elif pick < 0.9995:
+            yield ('/scan/query%d' % index, 'scan'), 1000
+        else:
+            yield ('/big/file%d' % index, 'big'), 200000
+
+
+def replay(name, requests, **kwargs):
+    cache = TTLCache(maxsize=1000000, getsizeof=len, **kwargs)
+    hits, total = {}, {}
+    for key, size in workload(requests):
+        kind = key[1]
+        total[kind] = total.get(kind, 0) + 1
+        if cache.get(key) is None:
+            cache[key] = 'x' * size
+        else:
+            hits[kind] = hits.get(kind, 0) + 1
+    overall = sum(hits.values()) / sum(total.values())
+    print(f'{name}: hit rate {overall:.1%} overall, {hits.get("hot", 0) / total["hot"]:.1%} hot')
+
+
+def main(requests=200000):
+    replay('LRU', requests)
+    replay('TinyLFU', requests, admission=True)
+    replay('LRU + quotas', requests, quota={'/scan/': 100000, '/big/': 200000})
+    replay('TinyLFU + max_entry', requests, admission=True, maxentry=100000)
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
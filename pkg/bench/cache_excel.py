@@ -0,0 +1,55 @@
+'''Measure gramex.cache.read_excel on a range / table of a large workbook.
+
+Usage: python cache_excel.py [rows=20000]
+
+Creates a workbook with a large "data" sheet and a small "lookup" table, then prints the time and
+peak memory to read a small range, the table, and the entire sheet.
+'''
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import gramex.cache
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.worksheet.table import Table
+
+
+def measure(name, fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    data = fn()
+    duration = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'{name}: {duration:0.2f}s, {peak / 1e6:0.0f}MB peak, shape={data.shape}')
+
+
+def main(rows=20000):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.xlsx')
+    wb = Workbook(write_only=True)
+    data = wb.create_sheet('data')
+    data.append(['a', 'b', 'c', 'd'])
+    for i in range(rows):
+        data.append([i, f'row {i}', i * 0.5, i % 7])
+    wb.save(path)
+    # Write-only workbooks can't add tables. Add a small one to a separate sheet
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'lookup'
+    for row in [['key', 'value']] + [[i, i * i] for i in range(10)]:
+        ws.append(row)
+    ws.add_table(Table(displayName='Lookup', ref='A1:B11'))
+    small = path.replace('.xlsx', '-small.xlsx')
+    wb.save(small)
+
+    measure('range A1:D100', lambda: gramex.cache.read_excel(path, range='A1:D100'))
+    measure('table Lookup', lambda: gramex.cache.read_excel(small, table='Lookup'))
+    measure('entire sheet', lambda: gramex.cache.read_excel(path, range=f'A1:D{rows + 1}'))
+    measure('pd.read_excel', lambda: pd.read_excel(path, engine='openpyxl'))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,37 @@
+'''Measure cached gramex.cache.query calls with and without state_ttl.
+
+Usage: python cache_query.py [calls=1000]
+
+Creates a SQLite table and prints the time per cached query() call when the state is a query,
+a table list, and with state_ttl=60 (which skips the state check).
+'''
+
+import os
+import sys
+import tempfile
+import time
+import gramex.cache
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+
+def measure(name, calls, **kwargs):
+    gramex.cache.query('SELECT * FROM t', **kwargs)
+    start = time.perf_counter()
+    for _ in range(calls):
+        gramex.cache.query('SELECT * FROM t', **kwargs)
+    print(f'{name}: {(time.perf_counter() - start) / calls * 1e6:0.0f}us per call')
+
+
+def main(calls=1000):
+    path = os.path.join(tempfile.mkdtemp(), 'data.db')
+    engine = sa.create_engine(f'sqlite:///{path}')
+    pd.DataFrame({'a': np.arange(10000), 'b': np.random.rand(10000)}).to_sql('t', engine)
+    measure('state=query', calls, engine=engine, state='SELECT max(a) FROM t')
+    measure('state=[table]', calls, engine=engine, state=['t'])
+    measure('state_ttl=60', calls, engine=engine, state='SELECT max(a) FROM t', state_ttl=60)
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
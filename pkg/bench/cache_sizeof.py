@@ -0,0 +1,38 @@
+'''Measure the time to size a DataFrame for the memory cache, as rows grow.
+
+Usage: python cache_sizeof.py [rows=1000000]
+
+Creates a DataFrame with string, int, float and category columns. Prints the time taken and size
+reported by sys.getsizeof() (which scans every string), and by gramex.cache.sizeof().
+'''
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+import gramex.cache
+
+
+def main(rows=1000000):
+    data = pd.DataFrame(
+        {
+            'city': [f'city {i % 5000}' * (i % 3 + 1) for i in range(rows)],
+            'id': np.arange(rows),
+            'sales': np.random.rand(rows),
+            'region': pd.Categorical(
+                np.array(['north', 'south', 'east', 'west'])[np.arange(rows) % 4]
+            ),
+        }
+    )
+    for name, fn in (
+        ('sys.getsizeof', sys.getsizeof),
+        ('gramex.cache.sizeof', gramex.cache.sizeof),
+    ):
+        start = time.perf_counter()
+        size = fn(data)
+        duration = time.perf_counter() - start
+        print(f'{name:20s}: {duration * 1000:8.2f}ms for {rows} rows. {size / 1e6:0.1f} MB')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,41 @@
+'''Measure gramex.cache.open with and without snapshot=True, as after a restart.
+
+Usage: python cache_snapshot.py [rows=1000000]
+
+Creates a CSV and an XLSX file, then prints the time to open each by parsing the file, and by
+memory-mapping its snapshot. Each open() uses an empty in-memory cache, like a new process.
+'''
+
+import os
+import sys
+import tempfile
+import time
+import gramex.cache
+import numpy as np
+import pandas as pd
+
+
+def measure(name, path, **kwargs):
+    start = time.perf_counter()
+    gramex.cache.open(path, _cache={}, **kwargs)
+    print(f'{name}: {time.perf_counter() - start:0.3f}s')
+
+
+def main(rows=1000000):
+    folder = tempfile.mkdtemp()
+    data = pd.DataFrame(
+        {'a': np.arange(rows), 'b': np.random.rand(rows), 'c': np.random.choice(list('xyz'), rows)}
+    )
+    csv, xlsx = os.path.join(folder, 'data.csv'), os.path.join(folder, 'data.xlsx')
+    data.to_csv(csv, index=False)
+    data.head(rows // 20).to_excel(xlsx, index=False)
+    snapshot = os.path.join(folder, 'snapshot')
+    for path in (csv, xlsx):
+        name = os.path.basename(path)
+        measure(f'{name} parse', path)
+        measure(f'{name} first snapshot', path, snapshot=snapshot)
+        measure(f'{name} from snapshot', path, snapshot=snapshot)
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
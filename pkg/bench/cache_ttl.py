@@ -0,0 +1,55 @@
+'''Measure MemoryCache (TTLCache) get / set / len() time as the number of entries grows.
+
+Usage: python cache_ttl.py [max_entries=1000000]
+
+Fills the cache with 10x more entries at each step, with a mix of expiry times, and prints the
+time per set(), get(), len() and currsize at each size.
+
+Then adds a long-lived key followed by `max_entries` keys that expire in a second, and prints the
+len() after they expire (which should be 1) and the time to expire them.
+'''
+
+import random
+import sys
+import time
+from gramex.services.ttlcache import TTLCache
+
+
+def per_op(fn, ops):
+    start = time.perf_counter()
+    for index in range(ops):
+        fn(index)
+    return (time.perf_counter() - start) / ops * 1e6
+
+
+def main(max_entries=1000000):
+    cache = TTLCache(maxsize=max_entries * 10, getsizeof=len)
+    rand = random.Random(0)
+    size, ops = 0, 1000
+    while size < max_entries:
+        target = max(size * 10, 10000)
+        for index in range(size, target):
+            cache.set(f'key{index}', 'x' * 10, rand.choice([60, 600, 3600]))
+        size = target
+        keys = [f'key{rand.randrange(size)}' for index in range(ops)]
+        set_time = per_op(lambda i, keys=keys: cache.set(keys[i], 'y' * 10, 3600), ops)
+        get_time = per_op(lambda i, keys=keys: cache.get(keys[i]), ops)
+        len_time = per_op(lambda i: len(cache), ops)
+        size_time = per_op(lambda i: cache.currsize, ops)
+        print(
+            f'{size:>9,} entries: set {set_time:0.1f}us, get {get_time:0.1f}us, '
+            f'len {len_time:0.1f}us, currsize {size_time:0.1f}us'
+        )
+
+    cache = TTLCache(maxsize=max_entries * 10, getsizeof=len)
+    cache.set('long-lived', 'x', 3600)
+    for index in range(max_entries):
+        cache.set(f'key{index}', 'x', 1)
+    time.sleep(1)
+    start = time.perf_counter()
+    count = len(cache)
+    print(f'len() after expiry: {count:,} in {time.perf_counter() - start:0.3f}s')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
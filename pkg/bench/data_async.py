@@ -0,0 +1,54 @@
+'''Compare gramex.data.filter in a threadpool with gramex.data.filter_async on SQLite.
+
+Usage: python data_async.py [concurrency=200] [workers=16]
+
+Runs offline. Needs `pip install aiosqlite`. Each query runs a slow recursive CTE so that the
+database, not Python, is the bottleneck. The threadpool is capped at `workers` threads like
+Gramex's `threadpool.workers`. The async version runs all queries on one event loop.
+'''
+
+import asyncio
+import os
+import sys
+import tempfile
+import timeit
+import gramex.data
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+query = '''
+    WITH RECURSIVE cnt(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM cnt WHERE x < 200000)
+    SELECT COUNT(*) AS n, :key AS key FROM cnt
+'''
+
+
+def main(concurrency=200, workers=16):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    args = [{'key': [str(i)]} for i in range(concurrency)]
+
+    pool = ThreadPoolExecutor(workers)
+    start = timeit.default_timer()
+    futures = [
+        pool.submit(gramex.data.filter, f'sqlite:///{path}', query=query, args=arg) for arg in args
+    ]
+    sync = [future.result() for future in futures]
+    sync_time = timeit.default_timer() - start
+
+    async def run():
+        return await asyncio.gather(
+            *(
+                gramex.data.filter_async(f'sqlite+aiosqlite:///{path}', query=query, args=arg)
+                for arg in args
+            )
+        )
+
+    start = timeit.default_timer()
+    result = asyncio.run(run())
+    async_time = timeit.default_timer() - start
+    assert pd.concat(sync).equals(pd.concat(result))
+    print(f'{concurrency} queries, threadpool({workers}): {sync_time:0.3f}s')
+    print(f'{concurrency} queries, async: {async_time:0.3f}s')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,63 @@
+'''Compare gramex.data.dirstat with an os.walk + os.stat scan, and with watch=True.
+
+Usage: python data_dirstat.py [path]
+
+If path is not specified, creates a temporary tree of 100 dirs x 200 files.
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import timeit
+import gramex.data
+import pandas as pd
+
+
+def walk(target):
+    '''The original dirstat() implementation: os.walk + os.stat + list of dicts'''
+    result = []
+    for dirpath, dirnames, filenames in os.walk(target):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            stat = os.stat(path)
+            dirname = dirpath.replace(target, '').replace(os.sep, '/') + '/'
+            result.append(
+                {
+                    'path': path,
+                    'dir': dirname,
+                    'name': name,
+                    'type': 'dir' if name in dirnames else os.path.splitext(name)[-1],
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime,
+                    'level': dirname.count('/'),
+                }
+            )
+    return pd.DataFrame(result)
+
+
+def main(path=None):
+    tmp = path is None
+    if tmp:
+        path = tempfile.mkdtemp()
+        for i in range(100):
+            os.makedirs(os.path.join(path, f'd{i // 10}', f'd{i}'))
+            for j in range(200):
+                with open(os.path.join(path, f'd{i // 10}', f'd{i}', f'f{j}.txt'), 'w') as h:
+                    h.write('x' * j)
+    n = len(walk(path))
+    for name, fn in (
+        ('os.walk', lambda: walk(path)),
+        ('dirstat', lambda: gramex.data.dirstat(path, timeout=None)),
+        ('dirstat(watch=True), 1st call', lambda: gramex.data.dirstat(path, watch=True)),
+        ('dirstat(watch=True), cached', lambda: gramex.data.dirstat(path, watch=True)),
+    ):
+        start = timeit.default_timer()
+        fn()
+        print(f'{name}: {timeit.default_timer() - start:0.3f}s for {n} entries')
+    if tmp:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
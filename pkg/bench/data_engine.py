@@ -0,0 +1,41 @@
+'''Measure per-call overhead of gramex.data.filter on a trivial, small SQLite query.
+
+Usage: python data_engine.py [iterations=1000]
+
+Prints the time per call in microseconds for filter() and the helpers it calls on every request.
+'''
+
+import os
+import sys
+import tempfile
+import timeit
+import gramex.data
+import pandas as pd
+import sqlalchemy as sa
+
+
+def main(n=1000):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    url = f'sqlite:///{path}'
+    data = pd.DataFrame({'a': range(10), 'b': list('abcdefghij')})
+    data.to_sql('t', sa.create_engine(url), index=False)
+    engine = gramex.data.create_engine(url)
+    args = {'a': ['3'], 'b': ['d']}
+    for name, fn in (
+        ('get_engine', lambda: gramex.data.get_engine(url)),
+        ('_replace', lambda: gramex.data._replace('sqlalchemy', args, url, 't', None, None)),
+        ('create_engine', lambda: gramex.data.create_engine(url)),
+        (
+            'create_engine(pool_pre_ping)',
+            lambda: gramex.data.create_engine(url, pool_pre_ping=True),
+        ),
+        ('get_table', lambda: gramex.data.get_table(engine, 't')),
+        ('alter', lambda: gramex.data.alter(url, 't')),
+        ('filter', lambda: gramex.data.filter(url, table='t', args=args)),
+    ):
+        fn()
+        print(f'{name}: {timeit.timeit(fn, number=n) / n * 1e6:0.1f}us')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,46 @@
+'''Measure the eventlog service's add() time, and gramex_update()'s queries as events grow.
+
+Usage: python eventlog.py [rows=1000000] [adds=2000]
+
+Creates an events.db with `rows` events, and prints the time per eventlog add() call, and the
+time for the queries that gramex.gramex_update() runs.
+'''
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import gramex.services
+from orderedattrdict import AttrDict
+
+
+def main(rows=1000000, adds=2000):
+    path = os.path.join(tempfile.mkdtemp(), 'events.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE events (time REAL, event TEXT, data TEXT)')
+    events = ['startup', 'shutdown', 'update']
+    conn.executemany(
+        'INSERT INTO events VALUES (?, ?, ?)',
+        ((i, events[i % 3] if i % 1000 else 'update', '{}') for i in range(rows)),
+    )
+    conn.commit()
+    conn.close()
+    gramex.services.eventlog(AttrDict(path=path))
+    query, add = gramex.services.info.eventlog.query, gramex.services.info.eventlog.add
+
+    start = time.perf_counter()
+    for i in range(adds):
+        add('bench', {'i': i})
+    duration = time.perf_counter() - start
+    print(f'add(): {duration / adds * 1e6:0.1f}us per call')
+    start = time.perf_counter()
+    update = query("SELECT * FROM events WHERE event='update' ORDER BY time DESC LIMIT 1")
+    print(f'last update: {(time.perf_counter() - start) * 1000:0.2f}ms (incl. writing adds)')
+    start = time.perf_counter()
+    since = query('SELECT * FROM events WHERE time > ? ORDER BY time', (update[0]['time'],))
+    print(f'{len(since)} events since update: {(time.perf_counter() - start) * 1000:0.2f}ms')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
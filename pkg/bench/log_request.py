@@ -0,0 +1,83 @@
+'''Measure the per-request logging cost of GramexApp.log_request, with and without queue:.
+
+Usage: python log_request.py [requests=100000] [write_delay_us=0]
+
+Logs `requests` requests to the requests.csv and gramex.log handlers in gramex.yaml, and
+prints the CPU time per request on the calling thread (i.e. the IOLoop), and the wall time.
+`write_delay_us` adds a delay to every flush to mimic a slow disk.
+'''
+
+import logging
+import os
+import sys
+import tempfile
+import time
+import gramex
+import gramex.services
+from orderedattrdict import AttrDict
+from tornado.httputil import HTTPServerRequest
+from gramex.config import PathConfig, objectpath
+from gramex.transforms import build_log_info
+
+
+class Handler:
+    name = 'bench'
+    current_user = None
+
+    def __init__(self, log_info):
+        self.request = HTTPServerRequest(method='GET', uri='/bench?x=1', host='localhost')
+        self.request.remote_ip = '127.0.0.1'
+        self.log_info = log_info
+
+    def get_status(self):
+        return 200
+
+    def _request_summary(self):
+        return f'{self.request.method} {self.request.uri} ({self.request.remote_ip})'
+
+    def log_request(self):
+        logging.getLogger('gramex.requests').info(self.log_info(self))
+
+
+def main(requests=100000, write_delay_us=0):
+    folder = tempfile.mkdtemp()
+    os.environ['GRAMEXDATA'] = folder
+    base = PathConfig(os.path.join(os.path.dirname(gramex.__file__), 'gramex.yaml'))
+    log_info = build_log_info(objectpath(base, 'log.handlers.requests.keys'))
+    handler = Handler(log_info)
+    flush = logging.StreamHandler.flush
+
+    def slow_flush(self):
+        time.sleep(write_delay_us / 1e6)
+        flush(self)
+
+    logging.StreamHandler.flush = slow_flush
+    for queue in (False, True):
+        conf = AttrDict(
+            version=1,
+            loggers={
+                'gramex': {'level': 'INFO', 'propagate': False, 'handlers': ['gramex-logfile']},
+                'gramex.requests': {'level': 'INFO', 'propagate': False, 'handlers': ['requests']},
+            },
+            handlers=AttrDict(),
+            formatters=dict(base.log.formatters),
+        )
+        for name in ('gramex-logfile', 'requests'):
+            conf.handlers[name] = AttrDict(base.log.handlers[name], queue=queue)
+        gramex.services.log(conf)
+        app = gramex.services.GramexApp()
+        start, cpu = time.perf_counter(), time.thread_time()
+        for _ in range(requests):
+            app.log_request(handler)
+        duration, cpu = time.perf_counter() - start, time.thread_time() - cpu
+        logging.shutdown(logging._handlerList[:])
+        total = time.perf_counter() - start
+        print(
+            f'{"queue" if queue else "no queue"}: '
+            f'{cpu / requests * 1e6:0.1f}us CPU per request on the calling thread, '
+            f'{duration / requests * 1e6:0.1f}us wall. Written in {total:0.2f}s'
+        )
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,71 @@
+'''Measure requests/second for a CPU-bound handler as app.listen.processes increases.
+
+Usage: python processes.py [max_processes=4] [count=400] [concurrency=16]
+
+Runs Gramex on a temp folder with app.listen.processes = 1, 2, ... max_processes, and fetches
+`count` URLs via `concurrency` client processes. Throughput should scale with CPU cores.
+'''
+
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import requests
+from multiprocessing import Pool
+
+PORT = 9997
+CONFIG = '''
+url:
+  cpu:
+    pattern: /cpu
+    handler: FunctionHandler
+    kwargs:
+      function: str(sum(i * i for i in range(200000)))
+schedule:
+  gramex_update: null
+'''
+
+
+def fetch(i):
+    return requests.get(f'http://localhost:{PORT}/cpu', timeout=60).status_code
+
+
+def main(max_processes=4, count=400, concurrency=16):
+    folder = tempfile.mkdtemp()
+    with open(os.path.join(folder, 'gramex.yaml'), 'w') as handle:
+        handle.write(CONFIG)
+    print(f'CPUs: {os.cpu_count()}')
+    with Pool(concurrency) as pool:
+        for n in range(1, max_processes + 1):
+            proc = subprocess.Popen(
+                [
+                    sys.executable,
+                    '-m',
+                    'gramex',
+                    f'--listen.port={PORT}',
+                    f'--listen.processes={n}',
+                ],
+                cwd=folder,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+            for _ in range(120):
+                try:
+                    fetch(0)
+                    break
+                except requests.exceptions.RequestException:
+                    time.sleep(0.5)
+            start = time.perf_counter()
+            codes = pool.map(fetch, range(count))
+            duration = time.perf_counter() - start
+            os.killpg(proc.pid, signal.SIGINT)
+            proc.wait()
+            ok = sum(code == 200 for code in codes)
+            print(f'processes: {n}: {ok / duration:0.1f} requests/s ({ok} OK)')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,50 @@
+'''Measure IOLoop latency while a CPU-heavy schedule runs in a thread vs in a process.
+
+Usage: python schedule_process.py [loops=30000000]
+
+Runs a pure-Python loop as a schedule with `thread: true` and with `process: true`. Meanwhile, the
+IOLoop runs a callback every 10ms (like a request handler) and reports how late the callbacks ran.
+'''
+
+import sys
+import time
+import multiprocessing
+import tornado.gen
+import tornado.ioloop
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from gramex.services.scheduler import Task
+
+
+def main(loops=30000000):
+    threadpool = ThreadPoolExecutor(1)
+    context = multiprocessing.get_context('fork')
+    processpool = ProcessPoolExecutor(1, mp_context=context)
+    # Start the worker process before timing
+    processpool.submit(int).result()
+    ioloop = tornado.ioloop.IOLoop.current()
+    function = f'sum(i * i for i in range({loops}))'
+    for key in ('thread', 'process'):
+        conf = {'function': function, key: True, 'startup': False}
+        task = Task(key, conf, threadpool, ioloop=ioloop, processpool=processpool)
+
+        async def run(task=task):
+            delays, start = [], time.perf_counter()
+            future = task.start()
+            while not future.done():
+                expected = time.perf_counter() + 0.01
+                await tornado.gen.sleep(0.01)
+                delays.append(time.perf_counter() - expected)
+            return delays, time.perf_counter() - start
+
+        delays, duration = ioloop.run_sync(run)
+        delays.sort()
+        avg, p99 = sum(delays) / len(delays), delays[int(len(delays) * 0.99)]
+        print(
+            f'{key:8s}: task {duration:0.2f}s. IOLoop delay avg {avg * 1000:0.1f}ms, '
+            f'p99 {p99 * 1000:0.1f}ms, max {delays[-1] * 1000:0.1f}ms'
+        )
+    processpool.shutdown()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,44 @@
+'''Measure JSONStore flush time on a large store with a few changed keys.
+
+Usage: python store_json.py [keys=100000] [changes=10]
+
+Creates a JSONStore with `keys` session-like keys, then prints the time to flush `changes`
+changed keys (which appends to the journal), and to purge (which rewrites the whole file, like
+every flush did earlier).
+'''
+
+import os
+import sys
+import tempfile
+import time
+from gramex.cache import JSONStore
+
+
+def measure(name, fn):
+    start = time.perf_counter()
+    fn()
+    print(f'{name}: {time.perf_counter() - start:0.3f}s')
+
+
+def main(keys=100000, changes=10):
+    path = os.path.join(tempfile.mkdtemp(), 'store.json')
+    store = JSONStore(path)
+    expiry = time.time() + 3600
+    for i in range(keys):
+        store.dump(f'key{i}', {'user': {'id': f'user{i}', 'role': 'admin'}, '_t': expiry})
+    measure('first flush', store.flush)
+    print(f'file size: {os.stat(path).st_size / 1e6:0.1f}MB')
+    measure('load', lambda: JSONStore(path))
+
+    def change():
+        for i in range(changes):
+            store.dump(f'key{i}', {'user': {'id': f'new{i}'}, '_t': expiry})
+        store.flush()
+
+    measure(f'flush {changes} changed keys', change)
+    measure(f'flush {changes} unchanged keys', change)
+    measure('purge', store.purge)
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,58 @@
+'''Measure RedisStore batch operations against per-key round trips.
+
+Usage: python store_redis.py [keys=10000] [host:port]
+
+Uses the Redis server at host:port. If not specified, starts a fakeredis server. Prints the
+time to save, load and purge `keys` keys one at a time vs in batches.
+'''
+
+import sys
+import time
+from threading import Thread
+from gramex.cache import RedisStore
+
+
+def measure(name, fn):
+    start = time.perf_counter()
+    fn()
+    print(f'{name}: {time.perf_counter() - start:0.3f}s')
+
+
+def main(keys=10000, path=None):
+    if path is None:
+        from fakeredis import TcpFakeServer
+
+        server = TcpFakeServer(('127.0.0.1', 0))
+        server.daemon_threads = True
+        Thread(target=server.serve_forever, daemon=True).start()
+        path = '%s:%d' % server.server_address
+    store = RedisStore(path, prefix='bench:')
+    items = {f'key{i}': {'user': f'user{i}'} for i in range(keys)}
+
+    def dump():
+        for key, value in items.items():
+            store.dump(key, value)
+
+    def load():
+        for key in items:
+            store.load(key)
+
+    def purge():
+        # This is how RedisStore.purge() worked earlier
+        data = {}
+        for key in store.store.scan_iter(match='bench:*'):
+            if store.store.ttl(key) == -1:
+                data[key] = store.load(key[len(store.prefix) :])
+        store.purge_keys(data)
+
+    measure('dump one by one', dump)
+    measure('set_many', lambda: store.set_many(items))
+    measure('load one by one', load)
+    measure('get_many', lambda: store.get_many(items))
+    measure('purge one by one', purge)
+    measure('purge', store.purge)
+    store.store.delete(*(f'bench:{key}' for key in items))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) if arg.isdigit() else arg for arg in sys.argv[1:]))
@@ -0,0 +1,52 @@
+'''Measure SQLiteStore write throughput from multiple processes.
+
+Usage: python store_sqlite.py [processes=4] [writes=500]
+
+Each process writes `writes` session-like keys into the same SQLite file, like Gramex instances
+sharing a session store. Prints the writes/second when committing every write to a rollback
+journal (as SQLiteStore used to), committing every write in WAL mode, and with SQLiteStore's
+default batched WAL commits.
+'''
+
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+from gramex.cache import SQLiteStore
+
+
+def write(args):
+    path, index, writes, each, kwargs = args
+    store = SQLiteStore(path, **kwargs)
+    for i in range(writes):
+        store.dump(f'{index}-{i}', {'user': {'id': f'user{i}'}, '_t': time.time() + 3600})
+        if each:
+            store.flush()
+    store.close()
+
+
+def measure(name, processes, writes, each, **kwargs):
+    path = os.path.join(tempfile.mkdtemp(), 'store.db')
+    # Create the database before measuring
+    SQLiteStore(path).close()
+    start = time.perf_counter()
+    with Pool(processes) as pool:
+        pool.map(write, [(path, index, writes, each, kwargs) for index in range(processes)])
+    duration = time.perf_counter() - start
+    total = processes * writes
+    check = SQLiteStore(path)
+    assert len(list(check.keys())) == total
+    check.close()
+    print(f'{name}: {total} writes in {duration:0.2f}s = {total / duration:0.0f} writes/s')
+
+
+def main(processes=4, writes=500):
+    old = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+    measure('journal, commit every write', processes, writes, True, **old)
+    measure('WAL, commit every write', processes, writes, True)
+    measure('WAL, batched commits', processes, writes, False)
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,45 @@
+'''Measure the time to log user events into a storelocation, e.g. userlog, per event.
+
+Usage: python storelocations.py [events=2000]
+
+Compares a synchronous gramex.data.insert() per event with gramex.services.storelocations_insert(),
+which queues events and inserts them in a single batch via storelocations_flush().
+'''
+
+import os
+import sys
+import tempfile
+import time
+import gramex.data
+import gramex.services
+from orderedattrdict import AttrDict
+
+
+def main(events=2000):
+    url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'userlog.db')
+    conf = AttrDict(url=url, table='userlog', columns={'event': 'TEXT', 'user': 'TEXT'})
+    gramex.services.storelocations({'userlog': conf})
+
+    def row(i):
+        return {'event': ['login'], 'user': [f'user{i}']}
+
+    start = time.perf_counter()
+    for i in range(events):
+        gramex.data.insert(**conf, args=row(i))
+    duration = time.perf_counter() - start
+    print(f'insert(): {duration / events * 1e6:0.1f}us per event')
+
+    start = time.perf_counter()
+    for i in range(events):
+        gramex.services.storelocations_insert('userlog', row(i))
+    queued = time.perf_counter() - start
+    gramex.services.storelocations_flush()
+    total = time.perf_counter() - start
+    print(f'storelocations_insert(): {queued / events * 1e6:0.1f}us per event')
+    print(f'storelocations_insert() + flush: {total / events * 1e6:0.1f}us per event')
+    count = len(gramex.data.filter(**conf))
+    print(f'rows: {count} (expected {2 * events})')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,50 @@
+'''Measure the URL cache entry size and the time to serve a cache hit, with gzip.
+
+Usage: python url_cache.py [rows=10000]
+
+Creates a JSON response with `rows` rows. Prints the pickled cache entry size, and the time
+to load the entry and gzip the raw body on each hit, vs loading the pre-compressed body.
+'''
+
+import gzip
+import pickle
+import sys
+import timeit
+import numpy as np
+import pandas as pd
+from types import SimpleNamespace
+from tornado.httputil import HTTPHeaders
+from tornado.web import GZipContentEncoding
+from gramex.services.urlcache import _entry
+
+
+def main(rows=10000):
+    data = pd.DataFrame(
+        {'a': np.arange(rows), 'b': np.random.rand(rows), 'c': np.random.choice(list('xyz'), rows)}
+    )
+    body = data.to_json(orient='records').encode('utf-8')
+    headers = HTTPHeaders({'Content-Type': 'application/json'})
+    handler = SimpleNamespace(_headers=headers, settings={'compress_response': True})
+    raw = {'status': 200, 'headers': list(headers.get_all()), 'body': body}
+    entry = _entry(handler, 200, raw['headers'], body, '"etag"')
+    raw, entry = (pickle.dumps(value, pickle.HIGHEST_PROTOCOL) for value in (raw, entry))
+    print(f'raw entry: {len(raw):,d} bytes')
+    print(f'compressed entry: {len(entry):,d} bytes')
+
+    request = SimpleNamespace(headers={'Accept-Encoding': 'gzip'})
+
+    def gzip_hit():
+        transform = GZipContentEncoding(request)
+        transform.transform_first_chunk(200, HTTPHeaders(headers), pickle.loads(raw)['body'], True)
+
+    def cached_hit():
+        pickle.loads(entry)['encoded']['gzip']
+
+    for name, fn in (('gzip per hit', gzip_hit), ('pre-compressed hit', cached_hit)):
+        count, duration = timeit.Timer(fn).autorange()
+        print(f'{name}: {duration / count * 1000:0.3f}ms')
+    assert gzip.decompress(pickle.loads(entry)['encoded']['gzip']) == body
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
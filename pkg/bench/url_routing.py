@@ -0,0 +1,47 @@
+'''Measure the time to route a request among many url: patterns.
+
+Usage: python url_routing.py [patterns=1000] [requests=2000]
+
+Creates `patterns` URL patterns like imported apps do (e.g. `/app12/api/(.*)`), sorted by
+gramex's url: priority. Prints the time per request for Tornado's router and gramex's URLRouter,
+for the highest and lowest priority patterns, and a path that matches no pattern.
+'''
+
+import sys
+import time
+import tornado.web
+from tornado.httputil import HTTPServerRequest
+from gramex.services import GramexApp, _sort_url_patterns
+from gramex.services.urlrouter import URLRouter
+
+
+class Handler(tornado.web.RequestHandler):
+    pass
+
+
+def main(patterns=1000, requests=2000):
+    conf, suffixes = {}, ['', 'api/(.*)', 'data', 'static/(.*)', '(.*)']
+    for i in range(patterns):
+        conf[f'url{i}'] = {'pattern': f'/app{i // len(suffixes)}/{suffixes[i % len(suffixes)]}'}
+    specs = sorted(conf.items(), key=_sort_url_patterns, reverse=True)
+    rules = [tornado.web.URLSpec(spec['pattern'], Handler, name=name) for name, spec in specs]
+    app = GramexApp()
+    routers = {
+        'tornado': tornado.web._ApplicationRouter(app, rules),
+        'URLRouter': URLRouter(app, rules),
+    }
+    last = specs[-1][1]['pattern'].replace('(.*)', 'x')
+    paths = {'first': specs[0][1]['pattern'].replace('(.*)', 'x'), 'last': last, '404': '/nomatch'}
+    for label, path in paths.items():
+        request = HTTPServerRequest(method='GET', uri=path)
+        for name, router in routers.items():
+            router.find_handler(request)
+            start = time.perf_counter()
+            for _ in range(requests):
+                router.find_handler(request)
+            duration = time.perf_counter() - start
+            print(f'{label:5s} {path:20s} {name:10s}: {duration / requests * 1e6:8.1f}us')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
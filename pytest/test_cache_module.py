@@ -1,9 +1,11 @@
 import gramex.cache
 import io
 import json
+import numpy as np
 import os
 import pandas as pd
 import pytest
+import sys
 import time
 import yaml
 from collections import OrderedDict
@@ -188,8 +190,38 @@ class TestOpen:
             gramex.cache.open(path, sheet_name='sales', range='B1', header=None),
             pd.DataFrame([['city']]),
         )
+        # Ranges can be entire columns, and extend beyond the data
+        afe(
+            gramex.cache.open(path, sheet_name='sales', range='B:C'),
+            gramex.cache.open(path, sheet_name='sales')[['city', 'product']],
+        )
+        assert len(gramex.cache.open(path, sheet_name='sales', range='A1:E40')) == 39
+        # Tables can be read from file objects too
+        with io.open(path, 'rb') as handle:
+            afe(
+                gramex.cache.read_excel(handle, sheet_name='table', table='SalesTable'),
+                gramex.cache.open(path, sheet_name='table', range='A1:$B$11'),
+            )
+        with pytest.raises(ValueError, match='missing table'):
+            gramex.cache.open(path, sheet_name='sales', table='SalesTable')
+        with pytest.raises(ValueError, match='missing name'):
+            gramex.cache.open(path, sheet_name='table', name='sales')
         # TODO: Test failure conditions, edge cases, etc.
 
+    def test_open_chunksize(self):
+        path = os.path.join(cache_dir, 'data.csv')
+        expected = pd.read_csv(path, encoding='utf-8')
+        # chunksize= and iterator=True return a fresh iterator every time. They're not cached
+        for kwargs in ({'chunksize': 3}, {'iterator': True}):
+            for _ in range(2):
+                result, reloaded = gramex.cache.open(path, 'csv', _reload_status=True, **kwargs)
+                assert reloaded
+                with result as reader:
+                    afe(pd.concat(reader if 'chunksize' in kwargs else [reader.read()]), expected)
+        # transform applies to the iterator
+        chunks = gramex.cache.open(path, 'csv', chunksize=3, transform=list)
+        assert [len(chunk) for chunk in chunks][:1] == [3]
+
     def test_open_yaml(self):
         path = os.path.join(cache_dir, 'data.yaml')
         with io.open(path, encoding='utf-8') as handle:
@@ -286,6 +318,37 @@ class TestOpen:
             finally:
                 remove_if_possible(target)
 
+    def test_open_snapshot(self, tmp_path):
+        path = str(tmp_path / 'data.csv')
+        folder = str(tmp_path / 'snapshot')
+        expected = pd.read_csv(os.path.join(cache_dir, 'data.csv'), encoding='utf-8')
+        expected.to_csv(path, index=False)
+
+        def transform(data):
+            return data[data.index % 2 == 0]
+
+        # The first open() parses the file and saves a snapshot
+        kwargs = {'snapshot': folder, 'transform': transform, 'encoding': 'utf-8'}
+        afe(gramex.cache.open(path, 'csv', _cache={}, **kwargs), transform(expected))
+        snapshots = os.listdir(folder)
+        assert len(snapshots) == 1 and snapshots[0].endswith('.feather')
+        # Later open()s (e.g. other processes) read the snapshot, not the file
+        snapshot = os.path.join(folder, snapshots[0])
+        pd.DataFrame({'x': [1]}).to_feather(snapshot)
+        afe(gramex.cache.open(path, 'csv', _cache={}, **kwargs), pd.DataFrame({'x': [1]}))
+        # Different kwargs or transforms use a different snapshot
+        afe(gramex.cache.open(path, 'csv', _cache={}, snapshot=folder), expected)
+        assert len(os.listdir(folder)) == 2
+        # When the file changes, it's parsed again, and the old snapshot is replaced
+        touch(path, data=b'')
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        afe(gramex.cache.open(path, 'csv', _cache={}, **kwargs), transform(expected))
+        assert len(os.listdir(folder)) == 2
+        assert not os.path.exists(snapshot)
+        # Non-DataFrames are not snapshotted
+        gramex.cache.open(os.path.join(cache_dir, 'data.json'), 'json', snapshot=folder)
+        assert len(os.listdir(folder)) == 2
+
     def test_custom_cache(self):
         path = os.path.join(cache_dir, 'data.csv')
         cache = {}
@@ -425,3 +488,26 @@ class TestOpen:
         v = 2
         data = gramex.cache.open(path, 'csv', lambda x: v, _cache=cache)
         assert data == 2
+
+
+def test_sizeof():
+    sizeof = gramex.cache.sizeof
+    # Small frames, series and arrays are measured exactly
+    df = pd.DataFrame({'s': ['a', 'bb', None], 'x': [1, 2, 3]}, index=['p', 'q', 'r'])
+    assert sizeof(df) == df.memory_usage(index=True, deep=True).sum()
+    assert sizeof(df['s']) == df['s'].memory_usage(index=True, deep=True)
+    arr = np.array(['a', 'bb', 'ccc'], dtype=object)
+    assert sizeof(arr) == sys.getsizeof(arr) + sum(sys.getsizeof(v) for v in arr)
+    # Views count the data they refer to
+    arr = np.arange(1000)
+    assert sizeof(arr[10:]) >= arr[10:].nbytes
+    assert sizeof(b'abc') == sys.getsizeof(b'abc')
+    # Large frames are sampled. The size is close to the actual size, and stable
+    n = 100000
+    df = pd.DataFrame({'s': [f'val{i}' * (i % 7 + 1) for i in range(n)], 'x': range(n)})
+    df['t'] = df['s'].astype('string')
+    actual = df.memory_usage(index=True, deep=True).sum()
+    assert abs(sizeof(df) / actual - 1) < 0.05
+    assert sizeof(df) == sizeof(df)
+    # Dicts, lists, etc. (e.g. gramex.cache.open entries) include their contents
+    assert sizeof({'data': df, 'stat': (1, 2)}) > sizeof(df)
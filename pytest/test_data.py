@@ -1,4 +1,6 @@
+import asyncio
 import os
+import time
 import gramex.data
 import pandas as pd
 import pytest
@@ -182,3 +184,121 @@ def test_filtercols(args, setup):
         result = gramex.data.filtercols(args={'_c': [args['_c']]}, **kwargs)
         expected = pd.DataFrame(args['out'])
         afe(result[args['_c']], expected)
+
+
+async_filter_args = [
+    {},
+    {'देश': ['भारत'], '_sort': ['-sales']},
+    {'sales>': ['100'], '_c': ['city', 'sales']},
+    {'_by': ['देश'], '_c': ['sales|sum']},
+    {'_limit': ['3'], '_offset': ['2'], '_sort': ['city']},
+]
+
+
+@pytest.mark.parametrize('args', async_filter_args)
+def test_filter_async(args):
+    pytest.importorskip('aiosqlite')
+    url = utils.sqlite_create_db('test_async.db', sales=sales_data)
+    aurl = url.replace('sqlite://', 'sqlite+aiosqlite://')
+    assert gramex.data.is_async(aurl)
+    assert not gramex.data.is_async(url)
+    meta, async_meta = {}, {}
+    expected = gramex.data.filter(url, table='sales', args=args, meta=meta)
+    actual = asyncio.run(gramex.data.filter_async(aurl, table='sales', args=args, meta=async_meta))
+    afe(actual, expected)
+    assert async_meta == meta
+    utils.sqlite_drop_db('test_async.db')
+
+
+def test_update_async():
+    pytest.importorskip('aiosqlite')
+    url = utils.sqlite_create_db('test_async.db', sales=sales_data)
+    url = url.replace('sqlite://', 'sqlite+aiosqlite://')
+
+    async def run():
+        args = {'city': ['Hyderabad', 'Bangalore']}
+        count = await gramex.data.delete_async(url, table='sales', args=args)
+        assert count == sales_data['city'].isin(args['city']).sum()
+        args = {'city': ['Singapore'], 'product': ['Async']}
+        count = await gramex.data.update_async(url, table='sales', id=['city'], args=args)
+        assert count == (sales_data['city'] == 'Singapore').sum()
+        args = {'city': ['Kolkata', 'Mumbai'], 'sales': ['10', '20'], 'nonexistent': ['x']}
+        meta = {}
+        count = await gramex.data.insert_async(url, table='sales', args=args, meta=meta)
+        assert count == 2
+        assert meta['ignored'] == [['nonexistent', ['x', 'x']]]
+        return await gramex.data.filter_async(url, table='sales')
+
+    result = asyncio.run(run())
+    expected = sales_data[~sales_data['city'].isin(['Hyderabad', 'Bangalore'])].copy()
+    expected.loc[expected['city'] == 'Singapore', 'product'] = 'Async'
+    assert len(result) == len(expected) + 2
+    afe(result.iloc[: len(expected)], expected.reset_index(drop=True), check_dtype=False)
+    assert result['sales'].tolist()[-2:] == [10, 20]
+    utils.sqlite_drop_db('test_async.db')
+
+
+@pytest.mark.parametrize('relative', [False, True])
+def test_dirstat_watch(tmp_path, monkeypatch, relative):
+    def walk(path):
+        return sorted(
+            os.path.join(root, name)
+            for root, dirs, files in os.walk(path)
+            for name in dirs + files
+        )
+
+    # The watcher reports absolute paths. Check that relative paths are refreshed too
+    target = str(tmp_path)
+    if relative:
+        monkeypatch.chdir(tmp_path.parent)
+        target = tmp_path.name
+    os.makedirs(tmp_path / 'a' / 'b')
+    (tmp_path / 'a' / 'x.txt').write_text('x')
+    result = gramex.data.dirstat(target, watch=True)
+    assert sorted(result['path']) == walk(target)
+    # Unchanged directories return the cached snapshot
+    assert gramex.data.dirstat(target, watch=True) is result
+    # Changes are picked up incrementally
+    os.makedirs(tmp_path / 'c' / 'd')
+    (tmp_path / 'c' / 'd' / 'y.txt').write_text('yy')
+    (tmp_path / 'a' / 'x.txt').write_text('xyz')
+    os.rmdir(tmp_path / 'a' / 'b')
+    for _ in range(50):
+        result = gramex.data.dirstat(target, watch=True)
+        if sorted(result['path']) == walk(target):
+            break
+        time.sleep(0.1)
+    assert sorted(result['path']) == walk(target)
+    afe(result, gramex.data.dirstat(target))
+    assert result.set_index('name')['size']['x.txt'] == 3
+
+
+def test_engine_cache(tmp_path):
+    url = f'sqlite:///{tmp_path}/engine.db'
+    assert gramex.data.get_engine(url) == 'sqlalchemy'
+    assert gramex.data.get_engine(url) == gramex.data.get_engine(url)
+    # Paths are not cached. They may be created after the first call
+    path = str(tmp_path / 'engine')
+    assert gramex.data.get_engine(path) == 'file'
+    os.makedirs(path)
+    assert gramex.data.get_engine(path) == 'dir'
+    # Engines are cached by URL and kwargs
+    engine = gramex.data.create_engine(url)
+    assert gramex.data.create_engine(url) is engine
+    ping = gramex.data.create_engine(url, pool_pre_ping=True)
+    assert ping is not engine
+    assert ping.pool._pre_ping
+    assert gramex.data.create_engine(url, pool_pre_ping=True) is ping
+
+
+def test_engine_cache_size(tmp_path, monkeypatch):
+    # Templated kwargs can create many engines. Only ENGINE_CACHE_SIZE are cached, LRU first
+    monkeypatch.setattr(gramex.data, 'ENGINE_CACHE_SIZE', 2)
+    url = f'sqlite:///{tmp_path}/engine.db'
+    first = gramex.data.create_engine(url, pool_recycle=1)
+    second = gramex.data.create_engine(url, pool_recycle=2)
+    assert gramex.data.create_engine(url, pool_recycle=1) is first
+    gramex.data.create_engine(url, pool_recycle=3)
+    assert len(gramex.data._ENGINE_CACHE) == 2
+    assert gramex.data.create_engine(url, pool_recycle=1) is first
+    assert gramex.data.create_engine(url, pool_recycle=2) is not second
@@ -0,0 +1,37 @@
+import json
+import sqlite3
+import threading
+import pytest
+from gramex.config import AttrDict
+from gramex.services import eventlog, info
+
+
+def writers():
+    return sum(thread.name == 'eventlog' for thread in threading.enumerate())
+
+
+def test_eventlog(tmp_path):
+    path = str(tmp_path / 'eventlog.db')
+    eventlog(AttrDict(path=path))
+    query = info.eventlog.query
+    # query() sees events add()-ed before it
+    info.eventlog.add('test', {'x': 1})
+    rows = query('SELECT * FROM events WHERE event=?', ('test',))
+    assert [json.loads(row['data']) for row in rows] == [{'x': 1}]
+    # gramex_update() queries use the (event, time) index
+    plan = query("EXPLAIN QUERY PLAN SELECT * FROM events WHERE event='update' ORDER BY time DESC")
+    assert any('events_event_time' in row['detail'] for row in plan)
+    # Reloading the same config keeps the event log
+    eventlog(AttrDict(path=path))
+    assert info.eventlog.query is query
+    assert writers() == 1
+    # Changing the path stops the old writer and closes the old connection
+    eventlog(AttrDict(path=str(tmp_path / 'other.db')))
+    assert info.eventlog.query is not query
+    assert writers() == 1
+    with pytest.raises(sqlite3.ProgrammingError):
+        query('SELECT 1')
+    # Removing the path stops the event log
+    eventlog(AttrDict())
+    assert writers() == 0
+    assert not info.eventlog
@@ -0,0 +1,148 @@
+import json
+import threading
+import time
+import gramex
+import gramex.services
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+pytest.importorskip('elasticsearch7')
+
+
+class BulkStub(BaseHTTPRequestHandler):
+    '''Mimics Elasticsearch's / and _bulk endpoints. mode is ok, down or reject'''
+
+    mode, docs = 'ok', []
+
+    def reply(self, status, result):
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.reply(200, {'version': {'number': '7.17.0', 'build_flavor': 'default'}})
+
+    def do_POST(self):
+        lines = self.rfile.read(int(self.headers['Content-Length'])).splitlines()
+        if self.mode == 'down':
+            return self.reply(503, {'error': 'down'})
+        actions, docs = lines[::2], [json.loads(line) for line in lines[1::2]]
+        status = 400 if self.mode == 'reject' else 201
+        items = [{'index': dict(json.loads(action)['index'], status=status)} for action in actions]
+        if status == 400:
+            for item in items:
+                item['index']['error'] = {'type': 'mapper_parsing_exception'}
+        else:
+            BulkStub.docs += [
+                dict(doc, _index=json.loads(a)['index']['_index']) for a, doc in zip(actions, docs)
+            ]
+        self.reply(200, {'took': 1, 'errors': status == 400, 'items': items})
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    BulkStub.mode, BulkStub.docs = 'ok', []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), BulkStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def setup(stub, flush=10, **conf):
+    gramex.services.gramexlog(
+        {'flush': flush, 'stub': dict(hosts=[stub], max_retries=0, index='logs', **conf)}
+    )
+    return gramex.services.info.gramexlog.apps.stub.queue
+
+
+def wait(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_batch(stub):
+    # Logs are pushed when batch: logs are queued
+    queue = setup(stub, batch=3)
+    gramex.log(x=1)
+    gramex.log(x=2)
+    assert not wait(lambda: BulkStub.docs, timeout=0.3)
+    gramex.log(x=3)
+    assert wait(lambda: len(BulkStub.docs) == 3)
+    assert BulkStub.docs == [
+        {'x': 1, '_index': 'logs'},
+        {'x': 2, '_index': 'logs'},
+        {'x': 3, '_index': 'logs'},
+    ]
+    assert wait(lambda: queue.stats()['sent'] == 3)
+    assert queue.stats()['queued'] == 0
+    queue.close()
+
+
+def test_flush(stub):
+    # ... or every flush: seconds
+    queue = setup(stub, flush=0.1, batch=100)
+    gramex.log(x=1)
+    assert wait(lambda: len(BulkStub.docs) == 1)
+    queue.close()
+
+
+def test_drop(stub):
+    # When the server is down, retry with a backoff. Drop logs beyond maxsize
+    BulkStub.mode = 'down'
+    queue = setup(stub, flush=0.1, batch=10, maxsize=5, backoff=0.1, max_backoff=0.2)
+    for x in range(8):
+        gramex.log(x=x)
+    stats = queue.stats()
+    assert stats['queued'] == 5
+    assert stats['dropped'] == 3
+    assert wait(lambda: queue.stats()['retries'] >= 2)
+    assert queue.stats()['backoff'] == 0.2
+    # When the server is back, the queued logs are sent
+    BulkStub.mode = 'ok'
+    assert wait(lambda: len(BulkStub.docs) == 5)
+    assert [doc['x'] for doc in BulkStub.docs] == [0, 1, 2, 3, 4]
+    assert wait(lambda: queue.stats()['backoff'] == 0)
+    queue.close()
+
+
+def test_spill(stub, tmp_path):
+    # Logs beyond maxsize are spilled to disk, and sent later
+    BulkStub.mode = 'down'
+    spill = tmp_path / 'spill.jsonl'
+    queue = setup(stub, flush=0.1, batch=2, maxsize=2, spill=str(spill), backoff=0.1)
+    for x in range(5):
+        gramex.log(x=x)
+    assert wait(lambda: queue.stats()['spilled'] == 3)
+    assert len(spill.read_text().splitlines()) == 3
+    assert queue.stats()['dropped'] == 0
+    BulkStub.mode = 'ok'
+    assert wait(lambda: len(BulkStub.docs) == 5)
+    assert sorted(doc['x'] for doc in BulkStub.docs) == [0, 1, 2, 3, 4]
+    assert wait(lambda: spill.read_text() == '')
+    # On close, unsent logs are spilled
+    BulkStub.mode = 'down'
+    gramex.log(x=5)
+    queue.close()
+    assert json.loads(spill.read_text()) == {'x': 5, '_index': 'logs'}
+
+
+def test_reject(stub):
+    # Logs that the server rejects are counted, and not retried
+    BulkStub.mode = 'reject'
+    queue = setup(stub, batch=2)
+    gramex.log(x=1)
+    gramex.log(x=2)
+    assert wait(lambda: queue.stats()['failed'] == 2)
+    assert queue.stats()['retries'] == 0
+    assert queue.stats()['queued'] == 0
+    queue.close()
@@ -0,0 +1,80 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+import pytest
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+if not hasattr(os, 'fork'):
+    pytest.skip('app.listen.processes needs os.fork()', allow_module_level=True)
+
+PORT = 9996
+CONFIG = '''
+url:
+  pid:
+    pattern: /pid
+    handler: FunctionHandler
+    kwargs:
+      function: "__import__('time').sleep(0.5) or str(__import__('os').getpid())"
+schedule:
+  gramex_update: null
+  startup-pid:
+    function: "open('schedule.txt', 'a').write('%d ' % __import__('os').getpid())"
+    startup: true
+app:
+  session:
+    type: sqlite
+    path: $YAMLPATH/session.db
+  ratelimit:
+    type: sqlite
+    path: $YAMLPATH/ratelimit.db
+'''
+
+
+def get_pid(timeout=10):
+    return requests.get(f'http://localhost:{PORT}/pid', timeout=timeout).text
+
+
+@pytest.fixture
+def gramex(tmp_path):
+    (tmp_path / 'gramex.yaml').write_text(CONFIG)
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gramex', f'--listen.port={PORT}', '--listen.processes=3'],
+        cwd=tmp_path,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    end = time.time() + 60
+    while time.time() < end:
+        try:
+            get_pid(timeout=1)
+            break
+        except requests.exceptions.RequestException:
+            time.sleep(0.5)
+    yield proc, tmp_path
+    os.killpg(proc.pid, signal.SIGKILL)
+
+
+def test_processes(gramex):
+    proc, path = gramex
+    # Workers serve concurrent requests on the same port
+    with ThreadPoolExecutor(6) as pool:
+        pids = set(pool.map(lambda i: get_pid(), range(6)))
+    assert len(pids) > 1
+    assert str(proc.pid) not in pids
+    # Only one worker runs schedules
+    assert (path / 'schedule.txt').read_text().split() in [[pid] for pid in pids]
+    # If the parent is killed, the workers stop
+    os.kill(proc.pid, signal.SIGKILL)
+    end = time.time() + 5
+    while time.time() < end:
+        try:
+            get_pid(timeout=1)
+            time.sleep(0.2)
+        except requests.exceptions.RequestException:
+            break
+    else:
+        pytest.fail('Workers did not stop when the parent was killed')
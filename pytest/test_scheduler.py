@@ -0,0 +1,204 @@
+import os
+import time
+import asyncio
+import threading
+import multiprocessing
+import pytest
+import sqlalchemy as sa
+import tornado.ioloop
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from gramex.services.scheduler import Task
+
+
+@pytest.fixture
+def ioloop():
+    loop = tornado.ioloop.IOLoop()
+    yield loop
+    loop.close()
+
+
+def create(ioloop, **schedule):
+    '''Create a threaded task that runs until .release is set. .calls has its args'''
+    calls, release = [], threading.Event()
+
+    def function(*args):
+        calls.append(args)
+        release.wait(5)
+
+    task = Task('test', dict(function=function, thread=True, **schedule), pool, ioloop=ioloop)
+    task.calls, task.release = calls, release
+    return task
+
+
+async def wait(condition, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return True
+        await asyncio.sleep(0.01)
+    return condition()
+
+
+pool = ThreadPoolExecutor(10)
+
+
+def test_allow(ioloop):
+    # By default, runs overlap
+    task = create(ioloop)
+    task.start()
+    task.start()
+    assert task.running == 2
+    task.release.set()
+    assert ioloop.run_sync(lambda: wait(lambda: task.running == 0))
+    assert task.stats['runs'] == 2
+    assert task.stats['skipped'] == 0
+
+
+def test_skip(ioloop):
+    # overlap: skip skips runs while max_instances (default: 1) are running
+    task = create(ioloop, overlap='skip')
+    assert task.start() is not None
+    assert task.start() is None
+    assert task.stats['skipped'] == 1
+    task.release.set()
+    assert ioloop.run_sync(lambda: wait(lambda: task.running == 0))
+    assert len(task.calls) == 1
+    assert task.stats['runs'] == 1
+    assert task.stats['last_duration'] >= 0
+    # Once done, it runs again
+    assert task.start() is not None
+    assert ioloop.run_sync(lambda: wait(lambda: task.stats['runs'] == 2))
+
+    task = create(ioloop, overlap='skip', max_instances=2)
+    task.start()
+    task.start()
+    task.start()
+    assert task.running == 2
+    assert task.stats['skipped'] == 1
+    task.release.set()
+
+
+def test_queue(ioloop):
+    # overlap: queue runs once after the running task finishes, with the last queued args
+    task = create(ioloop, overlap='queue')
+    task.start(1)
+    task.start(2)
+    task.start(3)
+    assert task.stats['queued'] == 2
+    task.release.set()
+    assert ioloop.run_sync(lambda: wait(lambda: task.stats['runs'] == 2 and not task.running))
+    assert task.calls == [(1,), (3,)]
+
+
+def test_errors(ioloop):
+    # Errors are counted, and don't leave the task running
+    def fail():
+        raise ValueError('fail')
+
+    task = Task('fail', {'function': fail}, pool, ioloop=ioloop)
+    with pytest.raises(ValueError):
+        task.start()
+    assert task.running == 0
+    assert task.stats['errors'] == 1
+    task = Task('fail', {'function': fail, 'thread': True}, pool, ioloop=ioloop)
+    task.start()
+    assert ioloop.run_sync(lambda: wait(lambda: task.stats['errors'] == 1))
+    assert task.running == 0
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        Task('invalid', {'function': print, 'overlap': 'wait'}, pool)
+
+
+def double(x):
+    return x * 2
+
+
+@pytest.fixture(scope='module')
+def processpool():
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        pytest.skip('process: true tests need fork')
+    pool = ProcessPoolExecutor(2, mp_context=multiprocessing.get_context('fork'))
+    yield pool
+    pool.shutdown()
+
+
+def test_process(ioloop, processpool):
+    # process: true runs expressions and callables in the process pool, and returns the result
+    conf = {'function': '__import__("os").getpid()', 'process': True}
+    task = Task('pid', conf, pool, ioloop=ioloop, processpool=processpool)
+    assert task.start().result(10) != os.getpid()
+    task = Task('double', {'function': double, 'process': True}, pool, processpool=processpool)
+    assert task.function(3).result(10) == 6
+    assert task.target is double
+    # Exceptions are raised in the future, and counted
+    conf = {'function': '1 / 0', 'process': True}
+    task = Task('fail', conf, pool, ioloop=ioloop, processpool=processpool)
+    with pytest.raises(ZeroDivisionError):
+        task.start().result(10)
+    assert ioloop.run_sync(lambda: wait(lambda: task.stats['errors'] == 1))
+    # timeout: raises a TimeoutError
+    conf = {'function': '__import__("time").sleep(5)', 'process': True, 'timeout': 0.2}
+    task = Task('slow', conf, pool, ioloop=ioloop, processpool=processpool)
+    start = time.time()
+    with pytest.raises(TimeoutError):
+        task.start().result(10)
+    assert time.time() - start < 2
+    # overlap: applies to process tasks too
+    conf = {'function': '__import__("time").sleep(0.5)', 'process': True, 'overlap': 'skip'}
+    task = Task('skip', conf, pool, ioloop=ioloop, processpool=processpool)
+    assert task.start() is not None
+    assert task.start() is None
+    assert ioloop.run_sync(lambda: wait(lambda: task.running == 0))
+    # process: true needs a processpool
+    with pytest.raises(ValueError):
+        Task('nopool', {'function': 'None', 'process': True}, pool)
+
+
+def test_processpool_reconfigure(ioloop):
+    # Tasks keep working when processpool: is reconfigured, and the old pool is shut down
+    import gramex.services
+
+    gramex.services.processpool({'workers': 1})
+    task = Task(
+        'double',
+        {'function': double, 'process': True},
+        pool,
+        processpool=gramex.services._processpool,
+    )
+    assert task.function(2).result(10) == 4
+    gramex.services.processpool({'workers': 2})
+    assert task.function(3).result(10) == 6
+    gramex.services.info.processpool.shutdown()
+
+
+def pooled(url):
+    # Return the number of pooled connections before querying the engine, and the query result
+    import gramex.data
+
+    engine = gramex.data.create_engine(url, poolclass=sa.pool.QueuePool)
+    checkedin = engine.pool.checkedin()
+    data = gramex.data.filter(url, table='t', poolclass=sa.pool.QueuePool)
+    return checkedin, data['x'].tolist()
+
+
+def test_process_engines(tmp_path):
+    # Process tasks don't use the parent's pooled DB connections, or its create_engine() lock
+    import gramex.data
+
+    url = f'sqlite:///{tmp_path / "data.db"}'
+    gramex.data.insert(url, table='t', args={'x': [1, 2]}, poolclass=sa.pool.QueuePool)
+    # The parent has pooled connections
+    checkedin, data = pooled(url)
+    assert checkedin > 0
+    assert data == [1, 2]
+    processpool = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('fork'))
+    conf = {'function': pooled, 'process': True, 'timeout': 5}
+    task = Task('pooled', conf, pool, processpool=processpool)
+    try:
+        # Workers fork on the first submit. Fork while another thread holds the lock
+        with gramex.data._ENGINE_LOCK:
+            future = task.function(url)
+        assert future.result(10) == (0, [1, 2])
+    finally:
+        processpool.shutdown()
@@ -0,0 +1,49 @@
+import json
+import os
+import pytest
+import requests
+import sqlite3
+import time
+from utils import gramex_port
+
+GRAMEX_PORT = gramex_port()
+if not gramex_port():
+    pytest.skip(f'gramex is not running on port {GRAMEX_PORT}', allow_module_level=True)
+
+DELAY = 0.1
+SESSION_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'session.db')
+
+
+def stored(session_id):
+    '''Return the session saved in the store'''
+    time.sleep(DELAY)
+    with sqlite3.connect(SESSION_DB) as conn:
+        rows = conn.execute('SELECT value FROM store WHERE key=?', [session_id]).fetchall()
+    return json.loads(rows[0][0]) if rows else None
+
+
+def test_session_save():
+    base = f'http://localhost:{GRAMEX_PORT}/session'
+    session = requests.Session()
+    # Empty sessions are not saved. With app.session.lazy, the cookie isn't set either
+    sid = session.get(f'{base}/get').json()['id']
+    assert stored(sid) is None
+    assert 'sid' not in session.cookies
+    # When the session has data, it's saved and the cookie is set
+    r = session.get(f'{base}/set?x=1')
+    sid = r.json()['id']
+    assert session.cookies['sid']
+    assert stored(sid)['id'] == sid
+    # Top-level and nested changes are saved
+    assert r.json()['data'] == {'x': '1'}
+    assert stored(sid)['data'] == {'x': '1'}
+    assert session.get(f'{base}/set?y=2').json()['data'] == {'x': '1', 'y': '2'}
+    assert stored(sid)['data'] == {'x': '1', 'y': '2'}
+    # Inactive expiry sets the last visited time _l
+    session.get(f'{base}/inactive')
+    saved = stored(sid)
+    assert saved['_i'] == 3600
+    assert saved['_l'] <= time.time()
+    # Reading the session doesn't save it. _l is updated at most once every touch: seconds
+    assert session.get(f'{base}/get').json()['_l'] == saved['_l']
+    assert stored(sid) == saved
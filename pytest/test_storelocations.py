@@ -0,0 +1,42 @@
+import gramex.data
+from gramex.services import info, storelocations_insert, storelocations_flush
+
+
+def test_flush(tmp_path, monkeypatch):
+    url = f'sqlite:///{tmp_path / "log.db"}'
+    columns = {'id': {'type': 'INTEGER', 'primary_key': True}, 'event': 'TEXT'}
+    conf = {'url': url, 'table': 'log', 'columns': columns}
+    monkeypatch.setitem(info.storelocations, 'testlog', conf)
+
+    def events():
+        return gramex.data.filter(url, table='log', args={'_sort': ['id']})['event'].tolist()
+
+    # Queued rows are inserted in one batch
+    storelocations_insert('testlog', {'id': [1], 'event': ['a']})
+    storelocations_insert('testlog', {'id': [2, 3], 'event': ['b', 'c']})
+    storelocations_flush()
+    assert events() == ['a', 'b', 'c']
+
+    # If the batch fails, it's retried once
+    calls, insert = [], gramex.data.insert
+
+    def flaky(*args, **kwargs):
+        calls.append(kwargs['args'])
+        if len(calls) == 1:
+            raise ConnectionError('lost connection')
+        return insert(*args, **kwargs)
+
+    monkeypatch.setattr(gramex.data, 'insert', flaky)
+    storelocations_insert('testlog', {'id': [4], 'event': ['d']})
+    storelocations_insert('testlog', {'id': [5], 'event': ['e']})
+    storelocations_flush()
+    assert len(calls) == 2
+    assert events() == ['a', 'b', 'c', 'd', 'e']
+    monkeypatch.setattr(gramex.data, 'insert', insert)
+
+    # If it fails again, e.g. due to a bad row, other rows are still inserted
+    storelocations_insert('testlog', {'id': [6], 'event': ['f']})
+    storelocations_insert('testlog', {'id': [1], 'event': ['duplicate']})
+    storelocations_insert('testlog', {'id': [7, 8], 'event': ['g', 'h']})
+    storelocations_flush()
+    assert events() == ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']
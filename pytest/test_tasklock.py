@@ -0,0 +1,141 @@
+import os
+import time
+import threading
+import multiprocessing
+import pytest
+import asyncio
+import tornado.ioloop
+from gramex.services.scheduler import Task
+from gramex.services.tasklock import SQLiteLock, create_lock
+
+if 'fork' not in multiprocessing.get_all_start_methods():
+    pytest.skip('lock tests run instances via fork', allow_module_level=True)
+fork = multiprocessing.get_context('fork')
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def conf(request, tmp_path):
+    if request.param == 'sqlite':
+        yield {'type': 'sqlite', 'path': str(tmp_path / 'lock.db')}
+        return
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.TcpFakeServer(('127.0.0.1', 0))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    yield {'type': 'redis', 'path': f'{host}:{port}', 'prefix': f'test:{time.time()}:'}
+    server.shutdown()
+
+
+def instance(conf, path, barrier, firings):
+    # Simulate a Gramex instance that runs a locked schedule when all instances fire together
+    def function():
+        with open(path, 'a') as handle:
+            handle.write(f'{os.getpid()}\n')
+        time.sleep(0.1)
+
+    task = Task('report', {'function': function, 'startup': False, 'lock': conf}, None)
+    for _ in range(firings):
+        barrier.wait(10)
+        task.start()
+        time.sleep(1.2)
+
+
+def test_once(conf, tmp_path):
+    # Each firing runs once across instances
+    path, instances, firings = tmp_path / 'runs.txt', 4, 2
+    barrier = fork.Barrier(instances)
+    conf = dict(conf, hold=1)
+    procs = [
+        fork.Process(target=instance, args=(conf, path, barrier, firings))
+        for _ in range(instances)
+    ]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join(30)
+        assert proc.exitcode == 0
+    assert len(path.read_text().split()) == firings
+
+
+def every_instance(conf, path, barrier, offset, duration):
+    # Simulate a Gramex instance that starts offset seconds after others, with an every: schedule
+    def function():
+        with open(path, 'a') as handle:
+            handle.write(f'{os.getpid()}\n')
+
+    barrier.wait(10)
+    end = time.time() + duration
+    time.sleep(offset)
+    ioloop = tornado.ioloop.IOLoop()
+    Task('every', {'function': function, 'every': '1s', 'lock': conf}, None, ioloop=ioloop)
+    ioloop.run_sync(lambda: asyncio.sleep(end - time.time()))
+
+
+def test_every(conf, tmp_path):
+    # every: schedules fire at different offsets on each instance. Each interval runs once
+    path, offsets = tmp_path / 'runs.txt', (0, 0.3, 0.6)
+    barrier = fork.Barrier(len(offsets))
+    procs = [
+        fork.Process(target=every_instance, args=(conf, path, barrier, offset, 3.5))
+        for offset in offsets
+    ]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join(30)
+        assert proc.exitcode == 0
+    assert len(path.read_text().split()) == 3
+
+
+def crash(conf):
+    create_lock(conf).acquire('crash')
+    os._exit(0)
+
+
+def test_crash(conf):
+    # If the holder crashes without releasing, the lease expires after ttl
+    proc = fork.Process(target=crash, args=(dict(conf, ttl=1),))
+    proc.start()
+    proc.join(10)
+    lock = create_lock(dict(conf, ttl=1))
+    assert lock.acquire('crash') is None
+    time.sleep(1.2)
+    assert lock.acquire('crash') is not None
+
+
+def test_renew(conf):
+    # The holder renews the lease while it runs, even beyond ttl
+    lock, other = create_lock(dict(conf, ttl=0.6)), create_lock(dict(conf, ttl=0.6))
+    token = lock.acquire('renew')
+    assert token is not None
+    time.sleep(1.5)
+    assert other.acquire('renew') is None
+    # Only the holder can release
+    assert not other.release('renew', 'wrong-token')
+    assert lock.release('renew', token)
+    token = other.acquire('renew')
+    assert token is not None
+    # hold: keeps the lease after release, for hold seconds
+    assert other.release('renew', token, hold=0.5)
+    assert lock.acquire('renew') is None
+    time.sleep(0.6)
+    assert lock.acquire('renew') is not None
+
+
+def test_task(tmp_path):
+    # Tasks skip runs when another instance holds the lock, and count them
+    conf = {'path': str(tmp_path / 'lock.db')}
+    task = Task('task', {'function': lambda: 1, 'startup': False, 'lock': conf}, None)
+    token = SQLiteLock(**conf).acquire('task')
+    assert task.start() is None
+    assert task.stats['locked'] == 1
+    assert task.running == 0
+    SQLiteLock(**conf).release('task', token)
+    assert task.start() == 1
+    assert task.stats['runs'] == 1
+    # lock: true uses the default SQLite lock
+    task = Task('default', {'function': lambda: 1, 'startup': False, 'lock': True}, None)
+    assert isinstance(task.lock, SQLiteLock)
+    with pytest.raises(ValueError):
+        create_lock({'type': 'nolock'})
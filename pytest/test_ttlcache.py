@@ -0,0 +1,159 @@
+import sys
+import pickle
+import time
+import threading
+from gramex.services.ttlcache import TTLCache
+
+
+def test_expire():
+    cache = TTLCache(maxsize=10)
+    cache.set('persistent', 1, 10)
+    cache.set('transient', 2, -1)
+    assert cache.get('persistent') == 1
+    assert cache.get('transient') is None
+    assert len(cache) == 1
+    assert list(cache) == ['persistent']
+    cache.clear()
+    assert len(cache) == 0
+    assert list(cache) == []
+
+
+def test_expire_order():
+    # Keys expire in order of expiry, not insertion
+    cache = TTLCache(maxsize=10, getsizeof=len)
+    cache.set('late', 'xx', 10)
+    cache.set('soon', 'xxx', 0.01)
+    cache.set('later', 'x', 20)
+    assert len(cache) == 3
+    assert cache.currsize == 6
+    time.sleep(0.02)
+    assert len(cache) == 2
+    assert cache.currsize == 3
+    assert sorted(cache) == ['late', 'later']
+    # Re-setting a key with a new expiry replaces the old expiry
+    cache.set('late', 'xx', 0.01)
+    cache.set('later', 'x', 10)
+    time.sleep(0.02)
+    assert list(cache) == ['later']
+    # Keys re-set many times don't grow the cache
+    for index in range(5000):
+        cache.set('key', str(index), 10)
+    assert len(cache) == 2
+    assert cache.get('key') == '4999'
+
+
+def test_pickle():
+    cache = TTLCache(maxsize=10)
+    cache.set('a', 1, 10)
+    cache.set('b', 2, 0.01)
+    time.sleep(0.02)
+    copy = pickle.loads(pickle.dumps(cache))
+    assert dict(copy.items()) == {'a': 1}
+    assert len(copy) == 1
+
+
+def test_threads():
+    # Concurrent sets use their own value's size, and don't change getsizeof
+    cache = TTLCache(maxsize=1000000, getsizeof=len)
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+
+    errors = []
+
+    def setter(index):
+        try:
+            for key in range(5000):
+                cache[key % 500] = 'x' * index
+        except Exception as e:
+            errors.append(e)
+
+    try:
+        threads = [threading.Thread(target=setter, args=(index,)) for index in range(1, 17)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert errors == []
+    assert cache.getsizeof('x' * 50) == 50
+    assert cache.currsize == sum(len(value) for value in cache.values())
+
+
+def test_lru():
+    cache = TTLCache(maxsize=3)
+    for key in 'abc':
+        cache[key] = key
+    assert cache.get('a') == 'a'
+    cache['d'] = 'd'
+    # b is the least recently used, so it's evicted
+    assert sorted(cache) == ['a', 'c', 'd']
+
+
+def test_admission():
+    cache = TTLCache(maxsize=3, admission=True)
+    # Frequently accessed keys are cached
+    for _ in range(5):
+        for key in 'abc':
+            if cache.get(key) is None:
+                cache[key] = key
+    assert sorted(cache) == ['a', 'b', 'c']
+    # A scan of one-off keys doesn't evict them
+    for index in range(100):
+        key = f'scan{index}'
+        if cache.get(key) is None:
+            cache[key] = key
+    assert sorted(cache) == ['a', 'b', 'c']
+    # A key accessed more often than the cached keys is admitted
+    for _ in range(10):
+        if cache.get('hot') is None:
+            cache['hot'] = 'hot'
+    assert 'hot' in cache
+    assert len(cache) == 3
+    # Existing keys can always be updated
+    cache['hot'] = 'x'
+    assert cache.get('hot') == 'x'
+
+
+def test_maxentry():
+    cache = TTLCache(maxsize=100, getsizeof=len, maxentry=5)
+    cache['small'] = 'x' * 5
+    cache['large'] = 'x' * 6
+    assert 'large' not in cache
+    assert cache.currsize == 5
+    # Updating a key with a large value removes it
+    cache['small'] = 'x' * 6
+    assert 'small' not in cache
+    assert cache.currsize == 0
+
+
+def test_quota():
+    cache = TTLCache(maxsize=100, getsizeof=len, quota={'/app1/': 10, '/app1/sub/': 5})
+    cache[('/app1/a', 1)] = 'x' * 4
+    cache[('/app1/b', 1)] = 'x' * 4
+    cache[('/app2/a', 1)] = 'x' * 40
+    cache[('/app1/sub/a', 1)] = 'x' * 4
+    assert cache.currsize == 52
+    # Adding to /app1/ evicts the least recently used key in /app1/ only
+    assert cache.get(('/app1/a', 1)) is not None
+    cache[('/app1/c', 1)] = 'x' * 4
+    assert ('/app1/b', 1) not in cache
+    assert ('/app1/a', 1) in cache
+    assert ('/app2/a', 1) in cache
+    # The longest prefix applies. /app1/sub/ keys don't count against /app1/
+    cache[('/app1/sub/b', 1)] = 'x' * 4
+    assert ('/app1/sub/a', 1) not in cache
+    assert ('/app1/a', 1) in cache
+    assert ('/app1/c', 1) in cache
+    # Values larger than the quota are not cached. Updating a key re-uses its quota
+    cache[('/app1/d', 1)] = 'x' * 11
+    assert ('/app1/d', 1) not in cache
+    cache[('/app1/a', 1)] = 'x' * 6
+    assert ('/app1/a', 1) in cache
+    assert ('/app1/c', 1) in cache
+    # Expired and deleted keys free up their quota
+    cache.set(('/app1/a', 1), 'x' * 6, 0.01)
+    time.sleep(0.02)
+    del cache[('/app1/c', 1)]
+    cache[('/app1/e', 1)] = 'x' * 10
+    assert ('/app1/e', 1) in cache
@@ -0,0 +1,70 @@
+import re
+import random
+import gramex.services
+import tornado.web
+from tornado.httputil import HTTPServerRequest
+from gramex.services.urlrouter import URLRouter, literal_prefix
+
+
+class Handler(tornado.web.RequestHandler):
+    pass
+
+
+def test_literal_prefix():
+    def prefix(pattern, flags=0):
+        return literal_prefix(re.compile(pattern, flags))
+
+    assert prefix(r'/app/api/(.*)') == '/app/api/'
+    assert prefix(r'/app/x?') == '/app/'
+    assert prefix(r'/app/x+') == '/app/'
+    assert prefix(r'/app/x*') == '/app/'
+    assert prefix(r'/app/x{0,2}') == '/app/'
+    assert prefix(r'/app\.js') == '/app.js'
+    assert prefix(r'/app/\d+') == '/app/'
+    assert prefix(r'/(app|api)/') == '/'
+    assert prefix(r'/a/$') == '/a/'
+    # Alternations use their common prefix
+    assert prefix(r'/a|/b') == '/'
+    # Alternations without a common prefix, case-insensitive and wildcard patterns match all paths
+    assert prefix(r'a|/b') == ''
+    assert prefix(r'(?i)/app/') == ''
+    assert prefix(r'/app/', re.IGNORECASE) == ''
+    assert prefix(r'.*') == ''
+
+
+def route(router, path):
+    delegate = router.find_handler(HTTPServerRequest(method='GET', uri=path))
+    return None if delegate is None else delegate.handler_class.__name__
+
+
+def test_priority():
+    # URLRouter matches the same handler as Tornado's router, in the same priority order
+    words = ['', 'a', 'b', 'ab', 'api', 'app']
+    patterns = ['/(.*)', '/a(.*)', '(?i)/A/', '/a|/b/c', '.*/x', '/ab/(\\d+)', '/app/x?']
+    for a in words:
+        for b in words:
+            patterns += [f'/{a}/{b}', f'/{a}/{b}/(.*)', f'/{a}/{b}.*', f'/{a}(/{b})?']
+    paths = [f'/{a}/{b}{c}' for a in words for b in words for c in ('', '/', '/x', '1', '.js')]
+    paths += ['/', '', '/A/', '/b/c', '/ab/12', '/ab/12x', '/app/x', '/app/']
+    random.seed(0)
+    app = gramex.services.GramexApp()
+    for _ in range(20):
+        random.shuffle(patterns)
+        rules = [
+            tornado.web.URLSpec(pattern, type(f'H{i}', (Handler,), {}))
+            for i, pattern in enumerate(patterns)
+        ]
+        tornado_router = tornado.web._ApplicationRouter(app, rules)
+        router = URLRouter(app, rules)
+        for path in paths:
+            assert route(router, path) == route(tornado_router, path), path
+
+
+def test_add_rules():
+    # Rules added later are indexed too
+    app = gramex.services.GramexApp()
+    router = URLRouter(app, [tornado.web.URLSpec('/a/.*', type('A', (Handler,), {}))])
+    assert route(router, '/a/b') == 'A'
+    assert route(router, '/b/c') is None
+    router.add_rules([tornado.web.URLSpec('/b/.*', type('B', (Handler,), {}))])
+    assert route(router, '/b/c') == 'B'
@@ -3,10 +3,11 @@ import os
 import time
 import unittest
 import gramex.cache
+import gramex.data
 import pandas as pd
 import sqlalchemy as sa
 from gramex.config import variables
-from nose.tools import eq_, assert_raises
+from nose.tools import eq_, ok_, assert_raises
 from orderedattrdict import AttrDict
 from . import folder, dbutils, afe
 
@@ -119,6 +120,13 @@ class TestOpener(unittest.TestCase):
         eq_(result.kwargs, {'num': 1, 's': 'a', 'none': None})
 
 
+class CopyCache(dict):
+    '''A cache that returns copies of values, like Redis or disk caches'''
+
+    def __getitem__(self, key):
+        return dict(super().__getitem__(key))
+
+
 class TestSqliteCacheQuery(unittest.TestCase):
     data = pd.read_csv(os.path.join(cache_folder, 'data.csv'), encoding='utf-8')
     states = [['t1'], 'SELECT COUNT(*) FROM t1', lambda: gramex.cache.stat(state_file)]
@@ -130,7 +138,8 @@ class TestSqliteCacheQuery(unittest.TestCase):
 
     @classmethod
     def tearDownClass(cls):
-        dbutils.sqlite_drop_db('test_cache')
+        cls.engine.dispose()
+        dbutils.sqlite_drop_db('test_cache.db')
 
     def test_wheres(self):
         w = gramex.cache._wheres
@@ -194,6 +203,52 @@ class TestSqliteCacheQuery(unittest.TestCase):
         eq_(gramex.cache.query(**kwargs)[1], True, msg)
         eq_(gramex.cache.query(**kwargs)[1], True, msg)
 
+    def test_query_state_ttl(self):
+        # state_ttl= checks the state at most once every state_ttl seconds
+        calls = []
+
+        def state():
+            calls.append(1)
+            return len(calls) // 3
+
+        sql = 'SELECT * FROM t2 LIMIT 3'
+        kwargs = {'sql': sql, 'engine': self.engine, 'state': state, '_reload_status': True}
+        eq_(gramex.cache.query(state_ttl=0.5, **kwargs)[1], True)
+        eq_(len(calls), 1)
+        eq_(gramex.cache.query(state_ttl=0.5, **kwargs)[1], False)
+        eq_(len(calls), 1)
+        # After state_ttl, the state is checked, and the query re-run only if it changed
+        time.sleep(0.5)
+        eq_(gramex.cache.query(state_ttl=0.5, **kwargs)[1], False)
+        eq_(len(calls), 2)
+        eq_(gramex.cache.query(**kwargs)[1], True)
+        eq_(len(calls), 3)
+        # Entries without a checked time (e.g. from older versions) are re-checked.
+        # The checked time is saved back to the cache, since Redis / disk caches return copies
+        cache = CopyCache()
+        kwargs.update(state=lambda: 1, state_ttl=60, _cache=cache)
+        eq_(gramex.cache.query(**kwargs)[1], True)
+        for key, val in cache.items():
+            cache[key] = {'data': val['data'], 'status': val['status']}
+        eq_(gramex.cache.query(**kwargs)[1], False)
+        ok_(all('checked' in val for val in cache.values()))
+
+    def test_filter_state_ttl(self):
+        # gramex.data.filter(query=) caches the query by its text, and honors state_ttl
+        calls = []
+
+        def state():
+            calls.append(1)
+            return 1
+
+        c0 = len(gramex.cache._QUERY_CACHE)
+        for _ in range(3):
+            gramex.data.filter(
+                self.url, query='SELECT * FROM t2 LIMIT 4', state=state, state_ttl=60
+            )
+        eq_(len(calls), 1)
+        eq_(len(gramex.cache._QUERY_CACHE), c0 + 1)
+
 
 class TestMySQLCacheQuery(TestSqliteCacheQuery):
     states = ['SELECT COUNT(*) FROM t1', lambda: gramex.cache.stat(state_file)]
@@ -2,6 +2,7 @@ import os
 import re
 import csv
 import yaml
+import time
 import socket
 import inspect
 import logging
@@ -13,6 +14,7 @@ from orderedattrdict import AttrDict
 from yaml.constructor import ConstructorError
 from gramex.config import ChainConfig, PathConfig, walk, merge, ConfigYAMLLoader, _add_ns
 from gramex.config import recursive_encode, prune_keys, TimedRotatingCSVHandler, slug
+from gramex.config import QueueHandler
 
 info = AttrDict(
     home=Path(__file__).absolute().parent,
@@ -467,3 +469,78 @@ class TestTimedRotatingCSVHandler(unittest.TestCase):
         for path in [cls.csv1, cls.csv2]:
             if path.exists():
                 path.unlink()
+
+
+class TestQueueHandler(unittest.TestCase):
+    csv = info.home / 'queue.csv'
+
+    def rows(self):
+        rows = []
+        for path in sorted(info.home.glob('queue.csv*')):
+            with path.open() as handle:
+                rows += [row[0] for row in csv.reader(handle)]
+        return sorted(rows)
+
+    def wait(self, count, timeout=5):
+        end = time.time() + timeout
+        while len(self.rows()) < count and time.time() < end:
+            time.sleep(0.01)
+
+    def test_queue(self):
+        handler = TimedRotatingCSVHandler(filename=str(self.csv), keys=['a'], encoding='utf-8')
+        self.handler = QueueHandler(handler, batch=3, interval=10)
+        logger = logging.getLogger('test-queue')
+        logger.setLevel(logging.INFO)
+        logger.addHandler(self.handler)
+        # Records are written in batches of 3 (or every 10 seconds) via a background thread
+        logger.info({'a': 1})
+        logger.info({'a': 2})
+        self.wait(2, timeout=0.2)
+        eq_(self.rows(), [])
+        logger.info({'a': 3})
+        self.wait(3)
+        eq_(self.rows(), ['1', '2', '3'])
+        # .close() writes pending records
+        logger.info({'a': 4})
+        self.handler.close()
+        eq_(self.rows(), ['1', '2', '3', '4'])
+
+    def test_rollover(self):
+        # Rollovers happen in the background thread
+        handler = TimedRotatingCSVHandler(
+            filename=str(self.csv), keys=['a'], encoding='utf-8', when='S'
+        )
+        self.handler = QueueHandler(handler, batch=2, interval=0.1)
+        logger = logging.getLogger('test-queue')
+        logger.setLevel(logging.INFO)
+        logger.addHandler(self.handler)
+        logger.info({'a': 1})
+        time.sleep(1.1)
+        logger.info({'a': 2})
+        self.handler.close()
+        ok_(len(list(info.home.glob('queue.csv.*'))) > 0)
+        eq_(self.rows(), ['1', '2'])
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs os.fork()')
+    def test_fork(self):
+        # Forked children (e.g. app.listen.processes) restart the writer thread
+        handler = TimedRotatingCSVHandler(filename=str(self.csv), keys=['a'], encoding='utf-8')
+        self.handler = QueueHandler(handler, batch=10, interval=0.1)
+        logger = logging.getLogger('test-queue')
+        logger.setLevel(logging.INFO)
+        logger.addHandler(self.handler)
+        logger.info({'a': 1})
+        self.wait(1)
+        pid = os.fork()
+        if pid == 0:
+            logger.info({'a': 2})
+            self.handler.close()
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.handler.close()
+        eq_(self.rows(), ['1', '2'])
+
+    def tearDown(self):
+        logging.getLogger('test-queue').removeHandler(self.handler)
+        for path in info.home.glob('queue.csv*'):
+            path.unlink()
@@ -1,12 +1,15 @@
 import os
 import json
+import sqlite3
+import contextlib
 import time
 import shutil
 import unittest
+from threading import Thread
 from nose.tools import eq_, ok_
 from nose.plugins.skip import SkipTest
 import gramex.cache
-from gramex.cache import JSONStore, SQLiteStore, RedisStore
+from gramex.cache import JSONStore, SQLiteStore, RedisStore, HDF5Store
 
 # It must be possible to import from basehandler for backward-compatibility
 from gramex.handlers.basehandler import JSONStore, SQLiteStore, RedisStore  # noqa
@@ -30,6 +33,22 @@ def tearDown():
         shutil.rmtree(folder)
 
 
+def load_jsonl(path):
+    '''Replay a JSONStore journal: {key: value} lines set keys, [key, ...] lines delete keys'''
+    data = {}
+    if os.path.exists(path):
+        with open(path, 'r') as handle:
+            for line in handle:
+                row = json.loads(line)
+                if isinstance(row, dict):
+                    row.pop('\x00expire', None)
+                    data.update(row)
+                else:
+                    for key in row:
+                        data.pop(key, None)
+    return data
+
+
 class TestJSONStore(unittest.TestCase):
     store_class = JSONStore
     store_file = 'data.json'
@@ -44,11 +63,7 @@ class TestJSONStore(unittest.TestCase):
 
     def load(self):
         '''Load all data in the store and return it'''
-        if os.path.exists(self.path):
-            with open(self.path, 'r') as handle:
-                data = json.load(handle)
-            return data
-        return {}
+        return load_jsonl(self.path)
 
     def test_01_flush(self):
         # Run this test first to ensure flush() without dump() is possible
@@ -122,6 +137,45 @@ class TestJSONStore(unittest.TestCase):
             eq_(self.load(), data)
             ok_(str_key in self.store.keys())  # noqa SIM118 self.store is not iterable
 
+    def test_ttl(self):
+        # Keys expire at expire=. load() ignores them, and purge() deletes them
+        now = time.time()
+        self.store.dump('ttl-past', {'v': 1}, expire=now - 1)
+        self.store.dump('ttl-soon', {'v': 2}, expire=now + 0.5)
+        self.store.dump('ttl-later', {'v': 3}, expire=now + 1000)
+        eq_(self.store.load('ttl-past', None), None)
+        eq_(self.store.load('ttl-soon', None), {'v': 2})
+        time.sleep(0.6)
+        eq_(self.store.load('ttl-soon', None), None)
+        self.store.purge()
+        data = self.load()
+        ok_('ttl-past' not in data)
+        ok_('ttl-soon' not in data)
+        eq_(data['ttl-later'], {'v': 3})
+        # Saving a key again without expire= removes the expiry
+        expiry = time.time() + 1000
+        self.store.dump('ttl-soon', {'v': 4}, expire=time.time() + 0.1)
+        self.store.dump('ttl-soon', {'v': 5, '_t': expiry})
+        time.sleep(0.2)
+        self.store.purge()
+        eq_(self.store.load('ttl-soon', None), {'v': 5, '_t': expiry})
+        eq_(self.load()['ttl-soon'], {'v': 5, '_t': expiry})
+
+    def test_many(self):
+        # set_many() saves multiple keys. get_many() returns default for missing / expired keys
+        expiry = time.time() + 1000
+        items = {'many-1': {'v': 1, '_t': expiry}, 'many-2': {'v': 2, '_t': expiry}}
+        self.store.set_many(items)
+        self.store.set_many({'many-3': {'v': 3}}, expire=time.time() - 1)
+        eq_(
+            self.store.get_many(['many-1', 'many-2', 'many-3', 'many-4'], None),
+            dict(items, **{'many-3': None, 'many-4': None}),
+        )
+        self.store.flush()
+        data = self.load()
+        eq_(data['many-1'], items['many-1'])
+        eq_(data['many-2'], items['many-2'])
+
     @classmethod
     def teardownClass(cls):
         # Close the store and ensure that the handle is closed
@@ -130,19 +184,111 @@ class TestJSONStore(unittest.TestCase):
         cls.store2.close()
 
 
+class TestJSONStoreJournal(unittest.TestCase):
+    def test_journal(self):
+        path = os.path.join(folder, 'journal.json')
+        store = JSONStore(path, flush=None)
+        store.dump('a', {'v': 1})
+        store.dump('b', {'v': 2})
+        store.flush()
+        size = os.stat(path).st_size
+        # Unchanged keys are not written, even if dumped
+        store.dump('a', {'v': 1})
+        store.flush()
+        eq_(os.stat(path).st_size, size)
+        # Changed keys are appended, including in-place changes to dumped values
+        value = store.load('b')
+        value['v'] = 3
+        store.dump('b', value)
+        store.flush()
+        with open(path) as handle:
+            lines = handle.readlines()
+        eq_(json.loads(lines[-1]), {'b': {'v': 3}})
+        # Deleted keys are appended as a list. Other instances read appended lines
+        store2 = JSONStore(path, flush=None)
+        store.dump('a', None)
+        store.flush()
+        store2.dump('c', {'v': 4})
+        store2.flush()
+        eq_(store2.load('a', None), None)
+        eq_(load_jsonl(path), {'b': {'v': 3}, 'c': {'v': 4}})
+        # The file is compacted to one line per key when it has too many lines
+        for index in range(10):
+            store.dump('a', {'v': index})
+            store.flush()
+        with open(path) as handle:
+            ok_(len(handle.readlines()) <= 2 * 3)
+        eq_(load_jsonl(path), {'a': {'v': 9}, 'b': {'v': 3}, 'c': {'v': 4}})
+        store.close()
+        store2.close()
+
+    def test_legacy(self):
+        # Files with a single JSON object are read, and rewritten as JSON lines on flush
+        path = os.path.join(folder, 'legacy.json')
+        with open(path, 'w') as handle:
+            json.dump({'a': {'v': 1}, 'b': {'v': 2}}, handle, indent=2)
+        store = JSONStore(path, flush=None)
+        eq_(store.load('a'), {'v': 1})
+        store.dump('c', {'v': 3})
+        store.close()
+        with open(path) as handle:
+            eq_(
+                [json.loads(line) for line in handle],
+                [{'a': {'v': 1}}, {'b': {'v': 2}}, {'c': {'v': 3}}],
+            )
+
+
+class TestStoreExpiry(unittest.TestCase):
+    def check_restart(self, store_class, path):
+        store = store_class(path, flush=None)
+        store.dump('soon', {'v': 1}, expire=time.time() + 0.5)
+        store.dump('later', {'v': 2}, expire=time.time() + 1000)
+        store.dump('never', {'v': 3})
+        store.close()
+        # After a restart, keys saved with an expire still expire and are purged
+        store = store_class(path, flush=None)
+        eq_(store.load('soon'), {'v': 1})
+        time.sleep(0.6)
+        eq_(store.load('soon', None), None)
+        store.purge()
+        eq_(sorted(store.keys()), ['later', 'never'])
+        store.close()
+        store = store_class(path, flush=None)
+        eq_(sorted(store.keys()), ['later', 'never'])
+        ok_('later' in store._expiry)
+        # Saving a key without an expire clears its expiry
+        store.dump('later', {'v': 4})
+        store.close()
+        store = store_class(path, flush=None)
+        ok_('later' not in store._expiry)
+        eq_(store.load('later'), {'v': 4})
+        store.close()
+
+    def test_json(self):
+        self.check_restart(JSONStore, os.path.join(folder, 'expiry.json'))
+
+    def test_hdf5(self):
+        self.check_restart(HDF5Store, os.path.join(folder, 'expiry.h5'))
+
+
 class TestSQLiteStore(TestJSONStore):
     store_class = SQLiteStore
     store_file = 'data.db'
 
     def load(self):
-        return {self.store._escape(key): val for key, val in self.store.store.items()}
+        # Read committed data via a separate connection, like another process would
+        with contextlib.closing(sqlite3.connect(self.path)) as conn:
+            rows = conn.execute('SELECT key, value FROM store').fetchall()
+        return {key: json.loads(val) for key, val in rows}
 
 
 class TestRedisStore(TestJSONStore):
+    prefix = ''
+
     @classmethod
     def setupClass(cls):
         gramex.cache.open(os.path.join(tests_dir, 'gramex.yaml'), 'config')
-        host = variables['REDIS_SERVER']
+        host, port = variables['REDIS_SERVER'], 6379
 
         import redis
 
@@ -151,14 +297,45 @@ class TestRedisStore(TestJSONStore):
             # Re-initialize the database by clearing it
             cls.redis.flushdb()
         except redis.exceptions.ConnectionError:
-            raise SkipTest('No redis server at %s' % host)
+            # If there's no Redis server, test against fakeredis
+            host, port = fake_redis_server()
+            cls.redis = redis.StrictRedis(host, port, decode_responses=True, encoding='utf-8')
 
-        cls.plainstore = RedisStore(path=host, flush=None)
-        cls.store = RedisStore(path='%s:6379' % host, flush=None, purge_keys=BaseMixin._purge_keys)
+        kwargs = {'flush': None, 'prefix': cls.prefix}
+        cls.plainstore = RedisStore(path=host if port == 6379 else f'{host}:{port}', **kwargs)
+        cls.store = RedisStore(path=f'{host}:{port}', purge_keys=BaseMixin._purge_keys, **kwargs)
         cls.store2 = RedisStore(
-            path='%s:6379:0' % host, flush=None, purge_keys=BaseMixin._purge_keys
+            path=f'{host}:{port}:0', purge_keys=BaseMixin._purge_keys, **kwargs
         )
 
     def load(self):
         '''Load all data in the store and return it'''
-        return {key: json.loads(self.redis.get(key)) for key in self.redis.keys()}
+        keys = self.redis.keys(self.prefix + '*')
+        return {key[len(self.prefix) :]: json.loads(self.redis.get(key)) for key in keys}
+
+
+class TestRedisStorePrefix(TestRedisStore):
+    prefix = 'test:'
+
+    def test_prefix(self):
+        self.store.dump('x', {'v': 1})
+        eq_(self.redis.get('test:x'), '{"v":1}')
+        # keys() and purge() ignore keys without the prefix
+        self.redis.set('other', 'null')
+        ok_('other' not in list(self.store.keys()))
+        self.store.purge()
+        eq_(self.redis.get('other'), 'null')
+        self.redis.delete('other')
+
+
+def fake_redis_server():
+    '''Start a fakeredis server on a free port and return (host, port)'''
+    try:
+        from fakeredis import TcpFakeServer
+    except ImportError:
+        raise SkipTest('No redis server, and fakeredis is not installed')
+    server = TcpFakeServer(('127.0.0.1', 0))
+    # Don't wait for client connections to close when Python exits
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address
@@ -239,6 +239,24 @@ class TestCacheFunctionHandler(TestGramex):
         eq_(r3.status_code, NOT_MODIFIED)
         eq_(incr, gramex.services.info.increment)
 
+    def test_compressed_cache(self):
+        # Cached responses are stored compressed, and served with the original ETag
+        r1 = self.get('/cache/compressed', headers={'Accept-Encoding': 'gzip'})
+        incr = gramex.services.info.increment
+        r2 = self.get('/cache/compressed', headers={'Accept-Encoding': 'gzip'})
+        eq_(incr, gramex.services.info.increment)
+        eq_(r2.headers['Content-Encoding'], 'gzip')
+        eq_(r2.headers['Etag'], r1.headers['Etag'])
+        eq_(r2.text, r1.text)
+        # Clients that don't accept gzip get the original body
+        r3 = self.get('/cache/compressed', headers={'Accept-Encoding': 'identity'})
+        ok_('Content-Encoding' not in r3.headers)
+        eq_(r3.text, r1.text)
+        # A matching ETag returns a 304 from the cache
+        r4 = self.get('/cache/compressed', headers={'If-None-Match': r1.headers['Etag']})
+        eq_(r4.status_code, NOT_MODIFIED)
+        eq_(incr, gramex.services.info.increment)
+
     def test_multi_browser(self):
         # When a 304 is served as the first response, ensure original headers are not lost.
         session1 = requests.Session()
@@ -89,8 +89,10 @@ class TestFunctionHandler(TestGramex):
     def test_pipelines(self):
         self.check('/func/pipeline', text='--/func/pipeline--/func/pipeline')
         import gramex.data
-        from gramex.services import info
+        from gramex.services import info, storelocations_flush
 
+        # Pipeline runs are logged in the background. Insert them before reading
+        storelocations_flush()
         execs = gramex.data.filter(
             **info.storelocations.pipeline, args={'_sort': ['-start'], '_limit': ['1']}
         )